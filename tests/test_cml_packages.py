@@ -0,0 +1,54 @@
+import asyncio
+import re
+from decimal import Decimal
+
+from pydantic import SecretStr
+
+from vk_to_commerceml.devtools.fake_cml import FakeCmlServer, run_fake_cml_server
+from vk_to_commerceml.infrastructure.cml.client import CmlClient
+from vk_to_commerceml.infrastructure.cml.models import (
+    Catalog,
+    CatalogClassifier,
+    ImportDocument,
+    Offer,
+    OffersDocument,
+    PackageOfOffers,
+    Product,
+)
+
+RE_ONLY_CHANGES = re.compile('СодержитТолькоИзменения="(true|false)"'.encode())
+RE_PRODUCT_ID = re.compile('<Товар>\\s*<Ид>([^<]+)</Ид>'.encode())
+
+
+async def upload_packages(products: int, package_size: int) -> list[tuple[str, bytes]]:
+    server = FakeCmlServer(latency=0, keep_imported=True)
+    numbers = range(products)
+    async with run_fake_cml_server(server) as url:
+        cml_client = CmlClient(package_size=package_size)
+        try:
+            session = await cml_client.get_session(url, 'login', SecretStr('password'))
+            await session.upload(
+                ImportDocument(
+                    classifier=CatalogClassifier(),
+                    catalog=Catalog(products=[Product(id=f'vk_{number}', name=str(number)) for number in numbers]),
+                ),
+                OffersDocument(package_of_offers=PackageOfOffers(
+                    offers=[Offer(id=f'vk_{number}', name=str(number), quantity=Decimal(1)) for number in numbers],
+                )),
+            )
+        finally:
+            await cml_client.close()
+    return server.imported
+
+
+def test_only_first_package_replaces_catalog() -> None:
+    # the site deactivates products of later packages until they arrive, see "Packaged imports" in README
+    imported = asyncio.run(upload_packages(products=250, package_size=100))
+    filenames = [filename for filename, _ in imported]
+    assert filenames[:4] == ['import_1.xml', 'offers_1.xml', 'import_2.xml', 'offers_2.xml']
+    assert [RE_ONLY_CHANGES.findall(document) for _, document in imported] == (
+        [[b'false'], [b'false']] + [[b'true']] * (len(imported) - 2)
+    )
+    product_ids = [RE_PRODUCT_ID.findall(document) for filename, document in imported if filename.startswith('import')]
+    assert len(product_ids[0]) == 100
+    assert sum(product_ids, []) == [f'vk_{number}'.encode() for number in range(250)]
@@ -0,0 +1,26 @@
+from vk_to_commerceml.services.description_parser import normalize_properties_block, parse_description
+
+
+def test_parse_description_inline_separator() -> None:
+    parsed = parse_description('Футболка хлопковая -- Размер: M, L')
+    assert parsed.description == 'Футболка хлопковая'
+    assert parsed.properties == (('размер', 'Размер'),)
+    assert parsed.property_values == (('размер', 'M'), ('размер', 'L'))
+    assert parsed.full_name == 'Размер M, L'
+
+
+def test_parse_description_block_separator() -> None:
+    parsed = parse_description('Футболка\nхлопковая\n\n--\nРазмер: M\nЦвет: белый')
+    assert parsed.description == 'Футболка\nхлопковая'
+    assert parsed.properties == (('размер', 'Размер'), ('цвет', 'Цвет'))
+    assert parsed.property_values == (('размер', 'M'), ('цвет', 'белый'))
+
+
+def test_normalize_ignores_inline_separator() -> None:
+    description = 'Футболка хлопковая -- Размер: M, L'
+    assert normalize_properties_block(description) == description
+
+
+def test_normalize_block() -> None:
+    description = 'Футболка\n--\nРазмер : M,L, M\nЦвет: белый'
+    assert normalize_properties_block(description) == 'Футболка\n\n--\nРазмер: M, L\nЦвет: белый'
@@ -1,34 +1,103 @@
+import asyncio
+import importlib
 import logging
+import multiprocessing
 from collections.abc import AsyncIterator
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 
-from vk_to_commerceml.api import bot, oauth
+from vk_to_commerceml.api import bot, oauth, stats, vk_callback
 from vk_to_commerceml.app_state import app_state
-from vk_to_commerceml.bot.main import start_telegram, stop_telegram
-from vk_to_commerceml.infrastructure.cml.client import CmlClient
-from vk_to_commerceml.infrastructure.secrets import Secrets
-from vk_to_commerceml.infrastructure.vk.client import VkClient
-from vk_to_commerceml.settings import settings
+from vk_to_commerceml.settings import get_settings
 
 logger = logging.getLogger(__name__)
 
 
+async def start_bot() -> None:
+    # aiogram is the slowest import by far, load it off the event loop after the API is ready
+    try:
+        bot_main = await asyncio.to_thread(importlib.import_module, 'vk_to_commerceml.bot.main')
+        await bot_main.start_telegram()
+    except Exception as exc:
+        logger.exception('Telegram bot start failure: %s', exc)
+        return
+    logger.info('🤖 Telegram bot started')
+
+
 @asynccontextmanager
 async def lifespan(application: FastAPI) -> AsyncIterator[None]:
+    from redis.asyncio import Redis
+
+    from vk_to_commerceml.infrastructure.cml.client import CmlClient
+    from vk_to_commerceml.infrastructure.cml.debug_file_saver import DebugArtifactWriter, DebugRetention
+    from vk_to_commerceml.infrastructure.cml.import_hashes import CmlImportHashStore
+    from vk_to_commerceml.infrastructure.cml.transfer import CmlMetricsStore
+    from vk_to_commerceml.infrastructure.secrets import Secrets
+    from vk_to_commerceml.infrastructure.sync_history import SyncHistory
+    from vk_to_commerceml.infrastructure.vk.cache import VkCache
+    from vk_to_commerceml.infrastructure.vk.callback import VkCallbackRegistry
+    from vk_to_commerceml.infrastructure.vk.client import VkClient
+    from vk_to_commerceml.services.item_sync import ItemChangeDebouncer
+
+    settings = get_settings()
     logging.basicConfig(level=logging.INFO)
     logger.info('🚀 Starting application')
-    app_state.vk_client = VkClient()
-    app_state.cml_client = CmlClient(settings.cml_debug_base_path)
-    app_state.secrets = Secrets(settings.encryption_key)
-    await start_telegram()
+    app_state.redis = Redis.from_url(str(settings.redis_url))
+    app_state.vk_client = VkClient(
+        settings.vk.api_limit_per_host, settings.vk.cdn_limit, settings.vk.cdn_limit_per_host,
+        settings.vk.download_concurrency,
+        VkCache(
+            app_state.redis, settings.vk.groups_cache_ttl, settings.vk.market_cache_ttl,
+            settings.vk.market_signature_ttl,
+        ),
+        settings.vk.api_rate,
+    )
+    app_state.cml_client = CmlClient(
+        settings.cml_debug_base_path, settings.cml_auth_ttl, settings.cml_upload_concurrency,
+        DebugArtifactWriter(
+            settings.cml_debug_base_path,
+            DebugRetention(
+                max_age_days=settings.cml_debug_max_age_days,
+                max_total_bytes=settings.cml_debug_max_total_bytes,
+                max_runs_per_site=settings.cml_debug_max_runs_per_site,
+            ),
+            sample_rate=settings.cml_debug_sample_rate,
+            failures_only=settings.cml_debug_failures_only,
+        ),
+        settings.cml_package_size,
+        settings.cml_package_target_duration,
+        CmlMetricsStore(app_state.redis),
+        CmlImportHashStore(app_state.redis, settings.cml_import_hash_ttl),
+        settings.cml_connector_limit_per_host,
+    )
+    app_state.secrets = Secrets(
+        settings.encryption_key, settings.old_encryption_keys, settings.secrets_cache_ttl, settings.secrets_cache_size,
+    )
+    # the server already runs threads, forking it could copy their held locks into the workers
+    app_state.process_pool = ProcessPoolExecutor(
+        settings.process_pool_workers, mp_context=multiprocessing.get_context('forkserver')
+    )
+    app_state.sync_history = SyncHistory(
+        app_state.redis, settings.sync_history_size, settings.sync_history_max_age_days
+    )
+    app_state.vk_callbacks = VkCallbackRegistry(app_state.redis)
+    app_state.item_debouncer = ItemChangeDebouncer(vk_callback.sync_changed_items, settings.vk.callback_debounce)
+    bot_task = asyncio.create_task(start_bot())
     yield
     logger.info('⛔ Stopping application')
-    await stop_telegram()
+    await app_state.item_debouncer.close()
+    bot_task.cancel()
+    if bot_task.done() and not bot_task.cancelled():
+        from vk_to_commerceml.bot.main import stop_telegram
+
+        await stop_telegram()
     await app_state.cml_client.close()
     await app_state.vk_client.close()
+    app_state.process_pool.shutdown(cancel_futures=True)
+    await app_state.redis.aclose()
 
 
 app = FastAPI(
@@ -37,6 +106,8 @@ app = FastAPI(
 )
 app.include_router(bot.router)
 app.include_router(oauth.router)
+app.include_router(stats.router)
+app.include_router(vk_callback.router)
 
 
 @app.get('/', include_in_schema=False)
@@ -1,14 +1,8 @@
-from aiogram.fsm.context import FSMContext
-from aiogram.utils.link import create_telegram_link
 from fastapi import APIRouter, Query
 from fastapi.responses import RedirectResponse
 
 from vk_to_commerceml.app_state import app_state
-from vk_to_commerceml.bot.connect import select_vk_group
-from vk_to_commerceml.bot.main import bot
-from vk_to_commerceml.bot.states import Form
-from vk_to_commerceml.infrastructure.vk.client import OAUTH_URL
-from vk_to_commerceml.settings import settings
+from vk_to_commerceml.settings import get_settings
 
 router = APIRouter(
     prefix='/oauth',
@@ -18,6 +12,15 @@ router = APIRouter(
 
 @router.get('/callback', status_code=303)
 async def oauth_callback(code: str = Query(), state: str = Query()) -> RedirectResponse:
+    from aiogram.fsm.context import FSMContext
+    from aiogram.utils.link import create_telegram_link
+
+    from vk_to_commerceml.bot.connect import select_vk_group
+    from vk_to_commerceml.bot.main import get_bot
+    from vk_to_commerceml.bot.states import Form
+
+    settings = get_settings()
+    bot = get_bot()
     bot_info = await bot.me()
     assert bot_info.username
     if state not in app_state.oauth_request_state_keys:
@@ -46,7 +49,14 @@ async def oauth_callback(code: str = Query(), state: str = Query()) -> RedirectR
 
 @router.get('/redirect/{state}', status_code=303)
 async def redirect(state: str) -> RedirectResponse:
-    bot_info = await bot.me()
+    from aiogram.utils.link import create_telegram_link
+
+    from vk_to_commerceml.bot.main import get_bot
+    from vk_to_commerceml.bot.states import Form
+    from vk_to_commerceml.infrastructure.vk.client import OAUTH_URL
+
+    settings = get_settings()
+    bot_info = await get_bot().me()
     assert bot_info.username
     if state not in app_state.oauth_request_state_keys:
         return RedirectResponse(url=create_telegram_link(bot_info.username, start='auth_fail'), status_code=303)
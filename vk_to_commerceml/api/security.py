@@ -0,0 +1,21 @@
+import hmac
+from typing import Annotated
+
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from vk_to_commerceml.settings import get_settings
+
+bearer = HTTPBearer(auto_error=False)
+
+
+async def verify_admin_token(
+    credentials: Annotated[HTTPAuthorizationCredentials | None, Depends(bearer)],
+) -> None:
+    admin_api_token = get_settings().admin_api_token
+    if admin_api_token is None:
+        raise HTTPException(status_code=403, detail='Admin API is disabled')
+    if credentials is None or not hmac.compare_digest(
+        credentials.credentials.encode(), admin_api_token.get_secret_value().encode()
+    ):
+        raise HTTPException(status_code=401, detail='Invalid admin token', headers={'WWW-Authenticate': 'Bearer'})
@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends, HTTPException
+
+from vk_to_commerceml.api.security import verify_admin_token
+from vk_to_commerceml.app_state import app_state
+from vk_to_commerceml.infrastructure.sync_history import SyncStats
+from vk_to_commerceml.infrastructure.vk.pool_stats import PoolStats
+
+router = APIRouter(
+    prefix='/stats',
+    tags=['stats'],
+)
+
+
+@router.get('/vk-pools', dependencies=[Depends(verify_admin_token)])
+async def vk_pools() -> dict[str, PoolStats]:
+    return app_state.vk_client.pool_stats
+
+
+@router.get('/sync', dependencies=[Depends(verify_admin_token)])
+async def sync_runs(vk_group_id: int | None = None) -> SyncStats:
+    if not app_state.sync_history:
+        raise HTTPException(status_code=503, detail='Sync history is not available')
+    return await app_state.sync_history.stats(vk_group_id)
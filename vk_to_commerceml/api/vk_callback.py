@@ -0,0 +1,96 @@
+import logging
+from typing import Any
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from yarl import URL
+
+from vk_to_commerceml.app_state import app_state
+from vk_to_commerceml.infrastructure.sync_history import SyncRun
+from vk_to_commerceml.infrastructure.vk.callback import CallbackEvent
+
+logger = logging.getLogger(__name__)
+router = APIRouter(
+    prefix='/vk',
+    tags=['vk'],
+)
+
+
+@router.post('/callback', response_class=PlainTextResponse)
+async def vk_callback(event: CallbackEvent) -> str:
+    group = await app_state.vk_callbacks.get_group(event.group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail='Group is not subscribed')
+    if event.type == 'confirmation':
+        return group.confirmation
+    if not group.check_secret(event.secret):
+        raise HTTPException(status_code=403, detail='Invalid secret')
+    if (item_id := event.item_id) is not None:
+        logger.info('VK callback %s for item %d of group %d', event.type, item_id, event.group_id)
+        app_state.item_debouncer.add(event.group_id, item_id)
+    return 'ok'
+
+
+async def sync_changed_items(group_id: int, item_ids: set[int]) -> None:
+    synced_sites: set[tuple[str, str]] = set()
+    for chat in await app_state.vk_callbacks.chats(group_id):
+        try:
+            await sync_chat_items(group_id, item_ids, chat, synced_sites)
+        except Exception as exc:
+            logger.exception('Item sync failure for chat %s of group %d: %s', chat.get('chat_id'), group_id, exc)
+
+
+async def sync_chat_items(
+    group_id: int, item_ids: set[int], chat: dict[str, Any], synced_sites: set[tuple[str, str]]
+) -> None:
+    from aiogram.fsm.storage.base import StorageKey
+
+    from vk_to_commerceml.bot.models import Site, get_vk_group_ids
+    from vk_to_commerceml.bot.states import Form
+    from vk_to_commerceml.bot.sync import SyncCallback
+    from vk_to_commerceml.services.profiling import SyncProfiler
+    from vk_to_commerceml.services.sync import SyncService
+
+    key = StorageKey(**chat)
+    state = await app_state.bot_storage.get_state(key)
+    data = await app_state.bot_storage.get_data(key)
+    if state != Form.cml_password_entered.state or group_id not in get_vk_group_ids(data):
+        logger.info('Chat %d is not configured for group %d anymore, unsubscribed', key.chat_id, group_id)
+        await app_state.vk_callbacks.unsubscribe(group_id, chat)
+        return
+    site = data['cml_url'], data['cml_login']
+    if site in synced_sites:
+        return
+    synced_sites.add(site)
+    options = SyncCallback.model_validate_json(data['sync']) if data.get('sync') else SyncCallback()
+    sync_service = SyncService(
+        app_state.cml_client, data['cml_url'], data['cml_login'], app_state.secrets.decrypt(data['cml_password']),
+        app_state.vk_client, app_state.secrets.decrypt(data['vk_token']), get_vk_group_ids(data),
+        app_state.process_pool,
+    )
+    profiler = SyncProfiler(tags={'chat_id': key.chat_id, 'site': data['cml_site'], 'items': len(item_ids)})
+    outcome = 'success'
+    async with profiler:
+        try:
+            synced = await sync_service.sync_items(
+                group_id, item_ids, with_disabled=options.with_disabled,
+                skip_multiple_group=data['cml_site'] == Site.TILDA, profiler=profiler,
+            )
+            logger.info('Item sync for chat %d: %d items sent to %s', key.chat_id, synced, data['cml_url'])
+        except Exception as exc:
+            logger.exception('Item sync failure for chat %d: %s', key.chat_id, exc)
+            outcome = 'main_failed'
+    if app_state.sync_history:
+        profile = profiler.profile
+        await app_state.sync_history.record(SyncRun(
+            started_at=profile.started_at,
+            vk_group_id=group_id,
+            cml_host=URL(data['cml_url']).host or data['cml_url'],
+            mode='full' if profile.tags.get('full_sync') else 'items',
+            items=profile.tags.get('catalog_size', 0),
+            uploaded_bytes=profile.tags.get('uploaded_bytes', 0),
+            retries=profile.tags.get('retries', 0),
+            outcome=outcome,
+            duration=profile.duration,
+            phases={phase.name: phase.duration for phase in profile.phases},
+        ))
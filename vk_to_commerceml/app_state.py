@@ -1,17 +1,30 @@
-from aiogram.fsm.storage.base import StorageKey
-from aiogram.fsm.storage.redis import RedisStorage
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING
 
-from vk_to_commerceml.infrastructure.cml.client import CmlClient
-from vk_to_commerceml.infrastructure.secrets import Secrets
-from vk_to_commerceml.infrastructure.vk.client import VkClient
+if TYPE_CHECKING:
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.fsm.storage.redis import RedisStorage
+    from redis.asyncio import Redis
+
+    from vk_to_commerceml.infrastructure.cml.client import CmlClient
+    from vk_to_commerceml.infrastructure.secrets import Secrets
+    from vk_to_commerceml.infrastructure.sync_history import SyncHistory
+    from vk_to_commerceml.infrastructure.vk.callback import VkCallbackRegistry
+    from vk_to_commerceml.infrastructure.vk.client import VkClient
+    from vk_to_commerceml.services.item_sync import ItemChangeDebouncer
 
 
 class AppState:
-    vk_client: VkClient
-    cml_client: CmlClient
-    oauth_request_state_keys: dict[str, StorageKey] = {}
-    bot_storage: RedisStorage
-    secrets: Secrets
+    vk_client: 'VkClient'
+    cml_client: 'CmlClient'
+    oauth_request_state_keys: dict[str, 'StorageKey'] = {}
+    bot_storage: 'RedisStorage'
+    redis: 'Redis'
+    secrets: 'Secrets'
+    sync_history: 'SyncHistory | None' = None
+    process_pool: ProcessPoolExecutor
+    vk_callbacks: 'VkCallbackRegistry'
+    item_debouncer: 'ItemChangeDebouncer'
 
 
 app_state = AppState()
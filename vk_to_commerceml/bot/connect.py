@@ -1,3 +1,4 @@
+import logging
 from importlib import resources
 from secrets import token_urlsafe
 
@@ -14,13 +15,16 @@ from yarl import URL
 from vk_to_commerceml.app_state import app_state
 from vk_to_commerceml.bot.models import SITE_CML_URLS, SITE_DISPLAY_NAMES, Site
 from vk_to_commerceml.bot.states import Form
+from vk_to_commerceml.infrastructure.vk.models import GroupItem
 from vk_to_commerceml.settings import settings
 
+logger = logging.getLogger(__name__)
 router = Router()
 
 
 class VkGroupCallback(CallbackData, prefix='vk_group'):
-    id: int
+    id: int = 0
+    done: bool = False
 
 
 class SiteCallback(CallbackData, prefix='site'):
@@ -29,7 +33,17 @@ class SiteCallback(CallbackData, prefix='site'):
 
 @router.message(Command('logout'))
 async def command_logout(message: types.Message, state: FSMContext) -> None:
+    vk_token = await state.get_value('vk_token')
+    cml_password = await state.get_value('cml_password')
     await state.clear()
+    try:
+        if vk_token:
+            vk_client = await app_state.vk_client.get_session(app_state.secrets.decrypt(vk_token))
+            await vk_client.invalidate_cache()
+    except Exception as exc:
+        logger.exception('VK cache not invalidated on logout: %s', exc)
+    finally:
+        app_state.secrets.forget(vk_token, cml_password)
     await message.answer('Авторизация в ВК удалена')
 
 
@@ -159,25 +173,61 @@ async def select_site(message: types.Message) -> None:
     await message.answer('Какой сайт вы хотите подключить?', reply_markup=builder.as_markup())
 
 
+def get_vk_groups_markup(groups: list[GroupItem], selected: list[int]) -> types.InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    for group in groups:
+        builder.button(
+            text=('☑' if group.id in selected else '☐') + f'  {group.name}',
+            callback_data=VkGroupCallback(id=group.id),
+        )
+    builder.button(
+        text='✅ готово',
+        callback_data=VkGroupCallback(done=True),
+    )
+    builder.adjust(1)
+    return builder.as_markup()
+
+
 @router.callback_query(Form.vk_authorized, VkGroupCallback.filter())
 async def callback_vk_group(query: types.CallbackQuery, callback_data: VkGroupCallback, state: FSMContext) -> None:
     if not query.message:
         return
     data = await state.get_data()
+    selected: list[int] = data.get('vk_group_ids') or []
     vk_token = app_state.secrets.decrypt(data['vk_token'])
     vk_client = await app_state.vk_client.get_session(vk_token)
     groups = await vk_client.get_groups()
+    if callback_data.done:
+        selected_groups = [group for group_id in selected for group in groups if group.id == group_id]
+        if not selected_groups:
+            await query.answer('Выберите хотя бы одну группу')
+            return
+        await state.update_data(
+            vk_group_id=selected_groups[0].id, vk_group_ids=[group.id for group in selected_groups]
+        )
+        await state.set_state(Form.vk_group_selected)
+        await query.answer('Группы сохранены' if len(selected_groups) > 1 else 'Группа сохранена')
+        if isinstance(query.message, types.Message):
+            await query.message.delete()
+        await query.message.answer(
+            ('Выбраны группы: ' if len(selected_groups) > 1 else 'Выбрана группа: ')
+            + ', '.join(f'`{group.name}`' for group in selected_groups),
+            parse_mode=ParseMode.MARKDOWN_V2,
+        )
+        await select_site(message=query.message)
+        return
     group = next(iter(group for group in groups if group.id == callback_data.id), None)
     if not group:
         await query.answer('Группа не найдена')
         return
-    await state.update_data(vk_group_id=group.id)
-    await state.set_state(Form.vk_group_selected)
-    await query.answer('Группа сохранена')
+    if group.id in selected:
+        selected = [group_id for group_id in selected if group_id != group.id]
+    else:
+        selected = [*selected, group.id]
+    await state.update_data(vk_group_ids=selected)
     if isinstance(query.message, types.Message):
-        await query.message.delete()
-    await query.message.answer(f'Выбрана группа: `{group.name}`', parse_mode=ParseMode.MARKDOWN_V2)
-    await select_site(message=query.message)
+        await query.message.edit_reply_markup(reply_markup=get_vk_groups_markup(groups, selected))
+    await query.answer('Группа выбрана' if group.id in selected else 'Группа убрана')
 
 
 @router.message(Form.vk_authorized)
@@ -186,15 +236,10 @@ async def select_vk_group(message: types.Message, state: FSMContext) -> None:
     vk_token = app_state.secrets.decrypt(data['vk_token'])
     vk_client = await app_state.vk_client.get_session(vk_token)
     groups = await vk_client.get_groups()
-
-    builder = InlineKeyboardBuilder()
-    for group in groups:
-        builder.button(
-            text=group.name,
-            callback_data=VkGroupCallback(id=group.id),
-        )
-    builder.adjust(1)
-    await message.answer('Из какой группы вы хотите получать товары?', reply_markup=builder.as_markup())
+    await message.answer(
+        'Из каких групп вы хотите получать товары? Товары нескольких групп будут объединены в один каталог',
+        reply_markup=get_vk_groups_markup(groups, data.get('vk_group_ids') or []),
+    )
 
 
 @router.message()
@@ -1,25 +1,44 @@
 import asyncio
 import logging
+from functools import cache
 
 from aiogram import Bot, Dispatcher, Router, types
+from aiogram.fsm.storage.base import BaseStorage
 from aiogram.fsm.storage.redis import RedisStorage
-from redis.asyncio import Redis
 
 from vk_to_commerceml.app_state import app_state
 from vk_to_commerceml.bot import connect, sync
+from vk_to_commerceml.bot.progress import RateLimitMiddleware
+from vk_to_commerceml.infrastructure.rate_limiter import RateLimiter
 from vk_to_commerceml.settings import settings
 
 logger = logging.getLogger(__name__)
 
 router = Router()
-bot = Bot(token=settings.bot_token.get_secret_value())
-task: asyncio.Task[None]
+task: asyncio.Task[None] | None = None
+
+
+@cache
+def get_bot() -> Bot:
+    bot = Bot(token=settings.bot_token.get_secret_value())
+    bot.session.middleware(RateLimitMiddleware(
+        RateLimiter(settings.bot_api_rate, burst=max(int(settings.bot_api_rate), 1))
+    ))
+    return bot
+
+
+def build_dispatcher(storage: BaseStorage) -> Dispatcher:
+    dp = Dispatcher(storage=storage)
+    dp.include_router(sync.router)
+    dp.include_router(connect.router)
+    return dp
 
 
 async def set_bot_commands_menu(my_bot: Bot) -> None:
     # Register commands for Telegram bot (menu)
     commands = [
         types.BotCommand(command='/sync', description='Запуск синхронизации'),
+        types.BotCommand(command='/stats', description='Статистика синхронизаций'),
         types.BotCommand(command='/logout', description='Сбросить авторизации'),
     ]
     try:
@@ -30,13 +49,14 @@ async def set_bot_commands_menu(my_bot: Bot) -> None:
 
 async def start_telegram() -> None:
     global task
+    bot = get_bot()
     await set_bot_commands_menu(bot)
-    app_state.bot_storage = RedisStorage(Redis.from_url(str(settings.redis_url)))
-    dp = Dispatcher(storage=app_state.bot_storage)
-    dp.include_router(sync.router)
-    dp.include_router(connect.router)
+    app_state.bot_storage = RedisStorage(app_state.redis)
+    dp = build_dispatcher(app_state.bot_storage)
     task = asyncio.create_task(dp._polling(bot, allowed_updates=['message', 'callback_query', 'inline_query']))
 
 
 async def stop_telegram() -> None:
-    task.cancel()
+    if task:
+        task.cancel()
+    await get_bot().session.close()
@@ -1,5 +1,5 @@
 from enum import StrEnum
-from typing import Final
+from typing import Any, Final
 
 
 class Site(StrEnum):
@@ -20,3 +20,7 @@ SITE_CATALOG_URLS: Final[dict[Site, str]] = {
     Site.TILDA: 'https://store.tilda.ru/store/?projectid={login}',
     Site.CUSTOM: '{login}',
 }
+
+
+def get_vk_group_ids(data: dict[str, Any]) -> list[int]:
+    return data.get('vk_group_ids') or [data['vk_group_id']]
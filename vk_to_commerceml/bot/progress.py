@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import time
+from typing import Final
+
+from aiogram import Bot, types
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import GetUpdates, Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from vk_to_commerceml.infrastructure.rate_limiter import RateLimiter
+from vk_to_commerceml.services.sync import SyncPhase
+
+logger = logging.getLogger(__name__)
+PROGRESS_INTERVAL = 3.0
+
+PHASE_TITLES: Final[dict[SyncPhase, str]] = {
+    SyncPhase.GET_PRODUCTS: 'Получение товаров из ВК',
+    SyncPhase.UPLOAD: 'Отправка товаров на сайт',
+    SyncPhase.PHOTO_DOWNLOAD: 'Загрузка фото из ВК',
+    SyncPhase.PHOTO_UPLOAD: 'Отправка фото на сайт',
+}
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    def __init__(self, rate_limiter: RateLimiter) -> None:
+        self.__rate_limiter = rate_limiter
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not isinstance(method, GetUpdates):
+            await self.__rate_limiter.acquire()
+        return await make_request(bot, method)
+
+
+class ProgressReporter:
+    def __init__(self, message: types.Message, min_interval: float = PROGRESS_INTERVAL) -> None:
+        self.__message = message
+        self.__min_interval = min_interval
+        self.__title = message.text or ''
+        self.__phases: dict[SyncPhase, tuple[int, str]] = {}
+        self.__sent_text = self.__render()
+        self.__edited_at = time.monotonic()
+        self.__task: asyncio.Task[None] | None = None
+
+    def __render(self) -> str:
+        lines = [self.__title]
+        for phase, (percent, note) in self.__phases.items():
+            lines.append(f'{PHASE_TITLES[phase]}: {percent}%' + (f' ({note})' if note else ''))
+        return '\n'.join(lines)
+
+    def update(self, phase: SyncPhase, percent: int, note: str = '') -> None:
+        self.__phases[phase] = percent, note
+        if not self.__task or self.__task.done():
+            self.__task = asyncio.create_task(self.__flush())
+
+    async def __flush(self) -> None:
+        try:
+            while self.__render() != self.__sent_text:
+                await asyncio.sleep(max(self.__edited_at + self.__min_interval - time.monotonic(), 0))
+                await self.__edit()
+        except Exception as exc:
+            logger.exception('Progress update failed: %s', exc)
+
+    async def __edit(self) -> None:
+        text = self.__render()
+        try:
+            await self.__message.edit_text(text)
+        except TelegramRetryAfter as exc:
+            logger.warning('Progress edit throttled for %d seconds', exc.retry_after)
+            self.__edited_at = time.monotonic() + exc.retry_after
+            return
+        except TelegramBadRequest as exc:
+            logger.warning('Progress edit failed: %s', exc)
+        self.__sent_text = text
+        self.__edited_at = time.monotonic()
+
+    async def finish(self, title: str | None = None) -> None:
+        if title:
+            self.__title = title
+        if self.__task:
+            self.__task.cancel()
+        if self.__render() != self.__sent_text:
+            try:
+                await self.__edit()
+            except Exception as exc:
+                logger.warning('Progress finish failed: %s', exc)
@@ -1,17 +1,26 @@
+import dataclasses
 import logging
 from datetime import datetime
 from importlib import resources
+from pathlib import Path
 
 from aiogram import F, Router, types
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from yarl import URL
 
 from vk_to_commerceml.app_state import app_state
-from vk_to_commerceml.bot.models import SITE_CATALOG_URLS, Site
+from vk_to_commerceml.bot.models import SITE_CATALOG_URLS, Site, get_vk_group_ids
+from vk_to_commerceml.bot.progress import ProgressReporter
 from vk_to_commerceml.bot.states import Form
-from vk_to_commerceml.services.sync import SyncService, SyncState
+from vk_to_commerceml.infrastructure.sync_history import SyncRun
+from vk_to_commerceml.infrastructure.traffic import TrafficRecorder
+from vk_to_commerceml.services.csv_writer import CsvOptions
+from vk_to_commerceml.services.profiling import ProfileMode, SyncProfiler
+from vk_to_commerceml.services.sync import SyncPhase, SyncProgress, SyncService, SyncState
+from vk_to_commerceml.settings import settings
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -20,7 +29,14 @@ router = Router()
 class SyncCallback(CallbackData, prefix='sync'):
     with_disabled: bool = False
     with_photos: bool = False
+    prices_only: bool = False
+    force: bool = False
     start: bool = False
+    retry: bool = False
+
+
+def is_admin_chat(message: types.Message | types.InaccessibleMessage) -> bool:
+    return message.chat.id in settings.admin_chat_ids
 
 
 @router.callback_query(Form.cml_password_entered, SyncCallback.filter(F.start))
@@ -30,80 +46,175 @@ async def callback_sync(query: types.CallbackQuery, callback_data: SyncCallback,
     started_at = datetime.now()
     data = await state.get_data()
     vk_token = app_state.secrets.decrypt(data['vk_token'])
-    vk_group_id: int = data['vk_group_id']
+    vk_group_ids = get_vk_group_ids(data)
+    vk_group_id = vk_group_ids[0]
     cml_site: str = data['cml_site']
     cml_url: str = data['cml_url']
     cml_login: str = data['cml_login']
     cml_password = app_state.secrets.decrypt(data['cml_password'])
-    await state.update_data(sync=callback_data.model_dump_json(exclude={'start'}))
+    await state.update_data(sync=callback_data.model_dump_json(exclude={'start', 'retry'}))
     sync_service = SyncService(
         app_state.cml_client, cml_url, cml_login, cml_password,
-        app_state.vk_client, vk_token, vk_group_id
+        app_state.vk_client, vk_token, vk_group_ids, app_state.process_pool
     )
     await query.answer('Запуск синхронизации')
-    await query.message.answer('Запуск синхронизации')
-    try:
-        async for status, content in sync_service.sync(
-            callback_data.with_disabled, callback_data.with_photos,
-            skip_multiple_group=cml_site == Site.TILDA,
-            make_csv=cml_site == Site.TILDA,
-        ):
-            match status:
-                case SyncState.GET_PRODUCTS_SUCCESS:
-                    await query.message.answer(f'Из ВК успешно получено {content} товаров')
-                case SyncState.GET_PRODUCTS_FAILED:
-                    await query.message.answer(f'Ошибка получения товаров из ВК: {content}')
-                case SyncState.MAIN_SUCCESS:
-                    if content and isinstance(content, str):
-                        catalog_url = SITE_CATALOG_URLS[data['cml_site']].format(login=cml_login)
-                        csv_file = types.BufferedInputFile(content.encode('utf8'), filename='categories.csv')
-                        caption = 'Товары успешно отправлены на сайт. Чтобы проставить категорию новым товарам нужно ' \
-                                  f'загрузить CSV-файл ниже на {catalog_url}, ' \
-                                  'иначе они будут без категории.'
-
-                        files = resources.files('vk_to_commerceml.data')
-                        await query.message.answer_media_group(
-                            media=[
-                                types.InputMediaPhoto(
-                                    media=types.BufferedInputFile(
-                                        file=files.joinpath('import_csv_01.png').read_bytes(),
-                                        filename='import_csv_01.png',
-                                    ),
-                                ),
-                                types.InputMediaPhoto(
-                                    media=types.BufferedInputFile(
-                                        file=files.joinpath('import_csv_02.png').read_bytes(),
-                                        filename='import_csv_02.png',
-                                    ),
-                                ),
-                                types.InputMediaPhoto(
-                                    media=types.BufferedInputFile(
-                                        file=files.joinpath('import_csv_03.png').read_bytes(),
-                                        filename='import_csv_03.png',
-                                    ),
-                                    caption=caption,
-                                ),
-                            ],
+    progress = ProgressReporter(
+        await query.message.answer('Запуск синхронизации'), settings.bot_progress_interval
+    )
+    profile_mode: ProfileMode | None = None
+    if data.get('profile') and is_admin_chat(query.message):
+        profile_mode = ProfileMode.model_validate_json(data['profile'])
+    if profile_mode and profile_mode.once:
+        await state.update_data(profile=None)
+    profiler = SyncProfiler(
+        settings.cml_debug_base_path / f'profile_{vk_group_id}' if settings.cml_debug_base_path else None,
+        tags={'chat_id': query.message.chat.id, 'site': cml_site, **callback_data.model_dump(exclude={'start'})},
+        mode=profile_mode,
+        recorder=TrafficRecorder(settings.traffic_capture_anonymize) if profile_mode and profile_mode.capture else None,
+    )
+    outcome = 'success'
+    photos = 0
+    async with profiler:
+        try:
+            async for status, content in sync_service.sync(
+                callback_data.with_disabled, callback_data.with_photos,
+                skip_multiple_group=cml_site == Site.TILDA,
+                make_csv=cml_site == Site.TILDA and not callback_data.prices_only,
+                snapshot_max_age=settings.vk.market_snapshot_max_age if callback_data.retry else None,
+                csv_options=CsvOptions(
+                    max_bytes=settings.csv_max_bytes, compress=settings.csv_gzip, with_prices=settings.csv_with_prices,
+                ),
+                profiler=profiler,
+                prices_only=callback_data.prices_only,
+                skip_unchanged=not callback_data.force,
+            ):
+                match status:
+                    case SyncState.PROGRESS if isinstance(content, SyncProgress):
+                        progress.update(content.phase, content.percent)
+                    case SyncState.GET_PRODUCTS_SUCCESS:
+                        progress.update(SyncPhase.GET_PRODUCTS, 100, f'{content} товаров')
+                    case SyncState.NO_CHANGES:
+                        outcome = status.name.lower()
+                        progress.update(SyncPhase.GET_PRODUCTS, 100, f'{content} товаров')
+                        await query.message.answer(
+                            'Товары в ВК не изменились с прошлой синхронизации, отправка на сайт пропущена'
                         )
-                        await query.message.answer_document(csv_file)
-                    else:
-                        await query.message.answer('Товары успешно отправлены на сайт')
-                case SyncState.MAIN_FAILED:
-                    await query.message.answer(f'Ошибка отправки товаров на сайт: {content}')
-                case SyncState.PHOTO_SUCCESS:
-                    await query.message.answer(f'Успешно отправлено {content} фото на сайт')
-                case SyncState.PHOTO_FAILED:
-                    await query.message.answer(f'Ошибка отправки фото на сайт: {content}')
+                    case SyncState.GET_PRODUCTS_FAILED:
+                        outcome = status.name.lower()
+                        await query.message.answer(f'Ошибка получения товаров из ВК: {content}')
+                    case SyncState.MAIN_SUCCESS:
+                        progress.update(SyncPhase.UPLOAD, 100)
+                        if content and isinstance(content, Path):
+                            try:
+                                catalog_url = SITE_CATALOG_URLS[data['cml_site']].format(login=cml_login)
+                                csv_file = types.FSInputFile(
+                                    content, filename=f'categories{"".join(content.suffixes)}'
+                                )
+                                caption = 'Товары успешно отправлены на сайт. ' \
+                                          'Чтобы проставить категорию новым товарам нужно ' \
+                                          f'загрузить CSV-файл ниже на {catalog_url}, ' \
+                                          'иначе они будут без категории.'
 
-    except Exception as exc:
-        logger.exception('Unexpected sync error: %r', exc)
-        await query.message.answer(f'Непредвиденная ошибка: {exc}')
+                                files = resources.files('vk_to_commerceml.data')
+                                await query.message.answer_media_group(
+                                    media=[
+                                        types.InputMediaPhoto(
+                                            media=types.BufferedInputFile(
+                                                file=files.joinpath('import_csv_01.png').read_bytes(),
+                                                filename='import_csv_01.png',
+                                            ),
+                                        ),
+                                        types.InputMediaPhoto(
+                                            media=types.BufferedInputFile(
+                                                file=files.joinpath('import_csv_02.png').read_bytes(),
+                                                filename='import_csv_02.png',
+                                            ),
+                                        ),
+                                        types.InputMediaPhoto(
+                                            media=types.BufferedInputFile(
+                                                file=files.joinpath('import_csv_03.png').read_bytes(),
+                                                filename='import_csv_03.png',
+                                            ),
+                                            caption=caption,
+                                        ),
+                                    ],
+                                )
+                                await query.message.answer_document(csv_file)
+                            finally:
+                                content.unlink(missing_ok=True)
+                    case SyncState.CSV_FAILED:
+                        outcome = status.name.lower()
+                        await query.message.answer(
+                            f'Товары отправлены на сайт, но CSV-файл с категориями не сформирован: {content}'
+                        )
+                    case SyncState.MAIN_FAILED:
+                        outcome = status.name.lower()
+                        await query.message.answer(
+                            f'Ошибка отправки товаров на сайт: {content}',
+                            reply_markup=get_retry_markup(callback_data),
+                        )
+                    case SyncState.PHOTO_SUCCESS:
+                        photos = content if isinstance(content, int) else 0
+                        progress.update(SyncPhase.PHOTO_UPLOAD, 100, f'{content} фото')
+                    case SyncState.PHOTO_FAILED:
+                        outcome = status.name.lower()
+                        await query.message.answer(
+                            f'Ошибка отправки фото на сайт: {content}',
+                            reply_markup=get_retry_markup(callback_data),
+                        )
+
+        except Exception as exc:
+            logger.exception('Unexpected sync error: %r', exc)
+            outcome = 'error'
+            await progress.finish('Синхронизация прервана')
+            await query.message.answer(f'Непредвиденная ошибка: {exc}')
+    await record_sync_run(profiler, vk_group_id, cml_url, callback_data, outcome, photos)
+    if outcome == 'error':
         return
+    await progress.finish('Синхронизация завершена')
     await query.message.answer(f'Синхронизация завершена за {datetime.now() - started_at}')
 
 
+async def record_sync_run(
+    profiler: SyncProfiler, vk_group_id: int, cml_url: str, callback_data: SyncCallback, outcome: str, photos: int,
+) -> None:
+    if not app_state.sync_history:
+        return
+    profile = profiler.profile
+    if callback_data.prices_only:
+        mode = 'prices'
+    else:
+        mode = 'full_with_photos' if callback_data.with_photos else 'full'
+    run = SyncRun(
+        started_at=profile.started_at,
+        vk_group_id=vk_group_id,
+        cml_host=URL(cml_url).host or cml_url,
+        mode=mode,
+        items=profile.tags.get('catalog_size', 0),
+        photos=photos,
+        uploaded_bytes=profile.tags.get('uploaded_bytes', 0),
+        retries=profile.tags.get('retries', 0),
+        outcome=outcome,
+        duration=profile.duration,
+        phases={phase.name: phase.duration for phase in profile.phases},
+    )
+    try:
+        await app_state.sync_history.record(run)
+    except Exception as exc:
+        logger.exception('Sync history record failure: %s', exc)
+
+
+def get_retry_markup(callback_data: SyncCallback) -> types.InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.button(
+        text='🔁 повторить',
+        callback_data=callback_data.model_copy(update={'start': True, 'retry': True}),
+    )
+    return builder.as_markup()
+
+
 async def get_sync_markup(state: FSMContext, callback_data: SyncCallback) -> types.InlineKeyboardMarkup:
-    await state.update_data(sync=callback_data.model_dump_json(exclude={'start'}))
+    await state.update_data(sync=callback_data.model_dump_json(exclude={'start', 'retry'}))
     builder = InlineKeyboardBuilder()
     builder.button(
         text=('☑' if callback_data.with_disabled else '☐') + '  получать скрытые в ВК',
@@ -113,6 +224,14 @@ async def get_sync_markup(state: FSMContext, callback_data: SyncCallback) -> typ
         text=('☑' if callback_data.with_photos else '☐') + '  синхронизировать фото',
         callback_data=callback_data.model_copy(update={'with_photos': not callback_data.with_photos}),
     )
+    builder.button(
+        text=('☑' if callback_data.prices_only else '☐') + '  только цены и остатки',
+        callback_data=callback_data.model_copy(update={'prices_only': not callback_data.prices_only}),
+    )
+    builder.button(
+        text=('☑' if callback_data.force else '☐') + '  отправить, даже если нет изменений',
+        callback_data=callback_data.model_copy(update={'force': not callback_data.force}),
+    )
     builder.button(
         text='🚀 запуск',
         callback_data=callback_data.model_copy(update={'start': True}),
@@ -139,3 +258,77 @@ async def command_sync(message: types.Message, state: FSMContext) -> None:
         text='Настройте синхронизацию и запустите',
         reply_markup=await get_sync_markup(state, callback_data),
     )
+
+
+@router.message(Command('profile'), is_admin_chat)
+async def command_profile(message: types.Message, command: CommandObject, state: FSMContext) -> None:
+    args = set((command.args or '').split())
+    if 'off' in args:
+        await state.update_data(profile=None)
+        await message.answer('Профилирование синхронизации выключено')
+        return
+    profile_mode = ProfileMode(cprofile='full' in args, once='once' in args, capture='capture' in args)
+    await state.update_data(profile=profile_mode.model_dump_json())
+    await message.answer(
+        'Профилирование' + (' с записью трафика' if profile_mode.capture else '') + ' включено '
+        + ('для следующей синхронизации' if profile_mode.once else 'для этого чата')
+    )
+
+
+@router.message(Form.cml_password_entered, Command('stats'))
+async def command_stats(message: types.Message, state: FSMContext) -> None:
+    if not app_state.sync_history:
+        await message.answer('Статистика синхронизаций недоступна')
+        return
+    stats = await app_state.sync_history.stats(await state.get_value('vk_group_id'))
+    if not stats.runs:
+        await message.answer('Синхронизаций пока не было')
+        return
+    lines = [
+        f'Синхронизаций: {stats.runs}',
+        ', '.join(f'{outcome}: {count}' for outcome, count in stats.outcomes.items()),
+        '',
+        'Длительность этапов, p50 / p95:',
+    ]
+    for phase, phase_stats in stats.phases.items():
+        lines.append(f'{phase}: {phase_stats.p50:.1f} / {phase_stats.p95:.1f} с (n={phase_stats.count})')
+    await message.answer('\n'.join(lines))
+
+
+@router.message(Form.cml_password_entered, Command('callback'))
+async def command_callback(message: types.Message, command: CommandObject, state: FSMContext) -> None:
+    vk_group_ids = get_vk_group_ids(await state.get_data())
+    chat = dataclasses.asdict(state.key)
+    args = (command.args or '').split()
+    if not args:
+        await message.answer(
+            'Укажите код подтверждения из настроек Callback API сообщества ВК: /callback <код>'
+            + (' <id группы>' if len(vk_group_ids) > 1 else '')
+            + '. Отключить обновление товаров по событиям ВК: /callback off'
+        )
+        return
+    if args[0] == 'off':
+        for vk_group_id in vk_group_ids:
+            await app_state.vk_callbacks.unsubscribe(vk_group_id, chat)
+        await message.answer('Обновление товаров по событиям ВК выключено')
+        return
+    if len(args) > 1:
+        vk_group_id = int(args[1]) if args[1].isdigit() else 0
+        if vk_group_id not in vk_group_ids:
+            await message.answer(f'Группа {args[1]} не подключена')
+            return
+    elif len(vk_group_ids) > 1:
+        await message.answer(
+            'Подключено несколько групп, укажите id группы: /callback <код> <id группы>. '
+            f'Подключены: {", ".join(map(str, vk_group_ids))}'
+        )
+        return
+    else:
+        vk_group_id = vk_group_ids[0]
+    group = await app_state.vk_callbacks.subscribe(vk_group_id, args[0], chat)
+    await message.answer(
+        'В настройках сообщества ВК (Управление → Работа с API → Callback API) укажите:\n'
+        f'адрес: {URL(str(settings.base_url)) / "vk" / "callback"}\n'
+        f'секретный ключ: {group.secret}\n'
+        'и включите события «Товары». Изменённые товары будут отправляться на сайт через несколько секунд.'
+    )
@@ -0,0 +1,332 @@
+import asyncio
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Annotated
+
+import typer
+
+app = typer.Typer(no_args_is_help=True)
+
+
+@app.callback()
+def main(verbose: Annotated[bool, typer.Option('--verbose', '-v')] = False) -> None:
+    logging.basicConfig(level=logging.INFO if verbose else logging.WARNING)
+
+
+@app.command()
+def bench_cml_upload(
+    photos: int = 200,
+    photo_size: int = 100_000,
+    latency: float = 0.15,
+    concurrency: Annotated[list[int], typer.Option()] = [1, 4],
+    max_parallel: int | None = None,
+    zip_yes: Annotated[bool, typer.Option('--zip')] = False,
+    file_limit: int | None = None,
+) -> None:
+    """Measure per-file photo upload throughput against the fake CommerceML server."""
+    from pydantic import SecretStr
+
+    from vk_to_commerceml.devtools.fake_cml import FakeCmlServer, run_fake_cml_server
+    from vk_to_commerceml.infrastructure.cml.client import CmlClient
+    from vk_to_commerceml.infrastructure.cml.models import Catalog, CatalogClassifier, ImportDocument, Product
+
+    async def run(upload_concurrency: int) -> None:
+        server = FakeCmlServer(latency=latency, zip_yes=zip_yes, file_limit=file_limit, max_parallel=max_parallel)
+        async with run_fake_cml_server(server) as url:
+            tmp_dir = tempfile.mkdtemp()
+            cml_client = CmlClient(upload_concurrency=upload_concurrency)
+            try:
+                session = await cml_client.get_session(url, 'login', SecretStr('password'))
+                photo_data: dict[str, Path] = {}
+                for number in range(photos):
+                    photo_data[f'photo_{number}.jpg'] = photo_path = Path(tmp_dir, f'photo_{number}.jpg')
+                    photo_path.write_bytes(bytes(photo_size))
+                document = ImportDocument(
+                    classifier=CatalogClassifier(),
+                    catalog=Catalog(only_changes=True, products=[
+                        Product(id='product', name='Product', images=list(photo_data)),
+                    ]),
+                )
+                started_at = time.perf_counter()
+                await session.upload(import_document=document, photos=photo_data)
+                elapsed = time.perf_counter() - started_at
+            finally:
+                await cml_client.close()
+                shutil.rmtree(tmp_dir)
+        typer.echo(
+            f'concurrency={upload_concurrency}: {server.stats.files} files, {server.stats.bytes} bytes '
+            f'in {elapsed:.2f}s ({server.stats.files / elapsed:.1f} files/s, '
+            f'{server.stats.bytes / elapsed / 1024 / 1024:.2f} MiB/s), max parallel: {server.stats.max_parallel}'
+        )
+
+    for upload_concurrency in concurrency:
+        asyncio.run(run(upload_concurrency))
+
+
+@app.command()
+def bench_parser(descriptions: int = 50_000, unique: int = 50_000) -> None:
+    """Measure description parsing with a cold and a warm memoization cache."""
+    from vk_to_commerceml.services.description_parser import DescriptionParser, parse_description
+
+    texts = [
+        f'Товар номер {number % unique}\nПодробное описание товара {number % unique}\n\n--\n'
+        f'Размер: S, M, L\nЦвет: красный, синий\nМатериал: хлопок {number % unique}\n'
+        for number in range(descriptions)
+    ]
+    started_at = time.perf_counter()
+    for text in texts:
+        parse_description(text)
+    typer.echo(f'uncached: {descriptions} descriptions in {time.perf_counter() - started_at:.3f}s')
+    parser = DescriptionParser()
+    for run_name in ('cold', 'warm'):
+        started_at = time.perf_counter()
+        for text in texts:
+            parser.parse(text)
+        typer.echo(
+            f'{run_name}: {descriptions} descriptions in {time.perf_counter() - started_at:.3f}s, '
+            f'hits: {parser.hits}, misses: {parser.misses}'
+        )
+
+
+@app.command()
+def bulk_normalize_properties(
+    vk_group_id: int,
+    vk_token: Annotated[str, typer.Option(envvar='VK_TOKEN')],
+    apply: bool = False,
+    show_diff: bool = False,
+) -> None:
+    """Normalize the "--" property block of every item description in a VK group (dry run by default)."""
+    from pydantic import SecretStr
+
+    from vk_to_commerceml.infrastructure.vk.client import VkClient
+    from vk_to_commerceml.services.bulk_edit import BulkEditService, BulkEditStatus
+    from vk_to_commerceml.services.description_parser import normalize_properties_block
+
+    async def run() -> None:
+        vk_client = VkClient()
+        try:
+            service = BulkEditService(vk_client, SecretStr(vk_token), vk_group_id)
+            counts: Counter[BulkEditStatus] = Counter()
+            async for result in service.edit_descriptions(normalize_properties_block, dry_run=not apply):
+                counts[result.status] += 1
+                if result.status == BulkEditStatus.UNCHANGED:
+                    continue
+                typer.echo(f'{result.status}: {result.item_id} {result.title} {result.error or ""}')
+                if show_diff and result.diff:
+                    typer.echo(result.diff)
+            typer.echo(', '.join(f'{status}: {count}' for status, count in counts.items()))
+        finally:
+            await vk_client.close()
+
+    asyncio.run(run())
+
+
+@app.command()
+def bench_secrets(dispatches: int = 1000, chats: int = 100, rotated: bool = True) -> None:
+    """Measure secret decryption for concurrent sync dispatches with and without the decryption cache."""
+    from cryptography.fernet import Fernet
+    from pydantic import SecretStr
+
+    from vk_to_commerceml.infrastructure.secrets import Secrets
+
+    key, old_key = Fernet.generate_key(), Fernet.generate_key()
+    encrypting = Secrets(old_key if rotated else key)
+    tokens = [
+        (encrypting.encrypt(SecretStr(f'vk-token-{chat}')), encrypting.encrypt(SecretStr(f'password-{chat}')))
+        for chat in range(chats)
+    ]
+
+    async def run(secrets: Secrets) -> list[float]:
+        started_at = time.perf_counter()
+
+        async def dispatch(number: int) -> float:
+            await asyncio.sleep(0)
+            vk_token, cml_password = tokens[number % chats]
+            secrets.decrypt(vk_token)
+            secrets.decrypt(cml_password)
+            return time.perf_counter() - started_at
+
+        return await asyncio.gather(*(dispatch(number) for number in range(dispatches)))
+
+    for name, cache_size in (('uncached', 0), ('cached', chats * 2)):
+        secrets = Secrets(key, [old_key], cache_size=cache_size)
+        latencies = sorted(asyncio.run(run(secrets)))
+        typer.echo(
+            f'{name}: {dispatches} dispatches in {latencies[-1]:.3f}s, '
+            f'p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, '
+            f'p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms, '
+            f'hits: {secrets.hits}, misses: {secrets.misses}'
+        )
+
+
+@app.command()
+def bench_bot(
+    chats: Annotated[list[int], typer.Option()] = [1, 10, 50],
+    items: int = 500,
+    with_photos: bool = False,
+    vk_latency: float = 0.05,
+    cml_latency: float = 0.05,
+    telegram_latency: float = 0.05,
+    bot_api_rate: float = 25,
+    redis_url: str | None = None,
+    trace_memory: bool = True,
+) -> None:
+    """Feed /sync commands and sync callbacks for concurrent chats into the bot dispatcher against fake servers."""
+    for name in ('VK__CLIENT_ID', 'VK__CLIENT_SECRET'):
+        os.environ.setdefault(name, 'load-test')
+    os.environ.setdefault('VK__OAUTH_CALLBACK_URL', 'http://127.0.0.1/oauth')
+    from vk_to_commerceml.devtools.bot_load import BotLoadOptions, run_bot_load
+
+    options = BotLoadOptions(
+        items=items, with_photos=with_photos, vk_latency=vk_latency, cml_latency=cml_latency,
+        telegram_latency=telegram_latency, bot_api_rate=bot_api_rate or None, redis_url=redis_url,
+        trace_memory=trace_memory,
+    )
+    for report in asyncio.run(run_bot_load(chats, options)):
+        typer.echo(
+            f'chats={report.chats}: {report.updates} updates in {report.duration:.2f}s '
+            f'({report.throughput:.1f} updates/s), errors: {report.errors}'
+        )
+        if report.command and report.sync:
+            typer.echo(
+                f'  /sync p50 {report.command.p50 * 1000:.0f} ms, p95 {report.command.p95 * 1000:.0f} ms; '
+                f'sync p50 {report.sync.p50:.2f}s, p95 {report.sync.p95:.2f}s, max {report.sync.max:.2f}s'
+            )
+        memory = f'{report.memory_peak / 1024 / 1024:.1f} MiB' if report.memory_peak is not None else 'n/a'
+        typer.echo(
+            f'  loop lag max {report.lag_max * 1000:.0f} ms, mean {report.lag_mean * 1000:.1f} ms; '
+            f'memory peak {memory}; telegram calls: {report.telegram_calls}'
+        )
+
+
+@app.command()
+def simulate_vk_callback(
+    group_id: int,
+    item_ids: Annotated[list[int], typer.Option('--item-id')],
+    secret: str = '',
+    url: str = 'http://127.0.0.1:8000/vk/callback',
+    event_type: str = 'market_item_edit',
+    repeat: int = 1,
+    interval: float = 0.1,
+    confirm: bool = False,
+) -> None:
+    """Send VK Callback API events to a local server, as bursts of item changes."""
+    import uuid
+
+    from aiohttp import ClientSession
+
+    async def send(session: ClientSession, event: dict[str, object]) -> None:
+        started_at = time.perf_counter()
+        async with session.post(url, json={'group_id': group_id, 'event_id': uuid.uuid4().hex, **event}) as response:
+            text = await response.text()
+        typer.echo(f'{event["type"]}: {response.status} {text!r} in {(time.perf_counter() - started_at) * 1000:.0f} ms')
+
+    async def run() -> None:
+        async with ClientSession() as session:
+            if confirm:
+                await send(session, {'type': 'confirmation'})
+            for _ in range(repeat):
+                for item_id in item_ids:
+                    await send(session, {
+                        'type': event_type, 'secret': secret, 'object': {'id': item_id, 'owner_id': -group_id},
+                    })
+                    await asyncio.sleep(interval)
+
+    asyncio.run(run())
+
+
+@app.command()
+def replay_sync(
+    fixture_path: Path,
+    time_scale: Annotated[float, typer.Option(help='Multiplier for recorded response times, 0 for full speed')] = 1.0,
+    cprofile: bool = False,
+    output: Path | None = None,
+) -> None:
+    """Replay a sync recorded with /profile capture against recorded VK and CommerceML responses."""
+    for name in ('VK__CLIENT_ID', 'VK__CLIENT_SECRET'):
+        os.environ.setdefault(name, 'replay')
+    os.environ.setdefault('VK__OAUTH_CALLBACK_URL', 'http://127.0.0.1/oauth')
+    from pydantic import SecretStr
+
+    from vk_to_commerceml.devtools.replay import ReplayServer, replay_urls, run_replay_server
+    from vk_to_commerceml.infrastructure.cml.client import CmlClient
+    from vk_to_commerceml.infrastructure.traffic import load_fixture
+    from vk_to_commerceml.infrastructure.vk.client import VkClient
+    from vk_to_commerceml.services.profiling import ProfileMode, SyncProfiler
+    from vk_to_commerceml.services.sync import SyncService, SyncState
+
+    fixture = load_fixture(fixture_path)
+    tags = fixture.tags
+
+    async def run() -> None:
+        server = ReplayServer(fixture, time_scale)
+        async with run_replay_server(server) as base_url:
+            vk_url, cml_url = replay_urls(fixture, base_url)
+            vk_client = VkClient(api_url=vk_url, api_rate=1000)
+            cml_client = CmlClient()
+            profiler = SyncProfiler(output, tags={'fixture': str(fixture_path)}, mode=ProfileMode(cprofile=cprofile))
+            try:
+                sync_service = SyncService(
+                    cml_client, cml_url, 'replay', SecretStr('replay'), vk_client, SecretStr('replay'),
+                    tags.get('vk_group_ids') or [tags['vk_group_id']],
+                )
+                async with profiler:
+                    async for status, content in sync_service.sync(
+                        tags.get('with_disabled', False), tags.get('with_photos', False),
+                        make_csv=tags.get('site') == 'tilda', profiler=profiler,
+                        prices_only=tags.get('prices_only', False),
+                    ):
+                        if status != SyncState.PROGRESS:
+                            typer.echo(f'{status.name}: {content}')
+            finally:
+                await vk_client.close()
+                await cml_client.close()
+        for phase in profiler.profile.phases:
+            typer.echo(f'{phase.name}: {phase.duration:.2f}s, loop lag max {phase.lag_max * 1000:.0f} ms')
+        typer.echo(
+            f'total {profiler.profile.duration:.2f}s, {len(fixture.exchanges)} recorded exchanges, '
+            f'served {server.stats.served}, fallbacks {server.stats.fallbacks}, missing {server.stats.missing}'
+        )
+
+    asyncio.run(run())
+
+
+@app.command()
+def import_time(
+    module: str = 'vk_to_commerceml.api.main',
+    budget: Annotated[float, typer.Option(help='Maximum cumulative import time in seconds')] = 1.0,
+    top: int = 15,
+) -> None:
+    """Measure the cold import time of a module with -X importtime and fail when it exceeds the budget."""
+    started_at = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True,
+    )
+    elapsed = time.perf_counter() - started_at
+    if result.returncode:
+        typer.echo(result.stderr, err=True)
+        raise typer.Exit(result.returncode)
+    timings: list[tuple[int, int, str]] = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix('import time:').split('|')
+        timings.append((int(self_us), int(cumulative_us), name.strip()))
+    module_time = next((cumulative for _, cumulative, name in timings if name == module), 0) / 1_000_000
+    for self_time, cumulative_time, name in sorted(timings, reverse=True)[:top]:
+        typer.echo(f'{self_time / 1000:9.1f} ms self {cumulative_time / 1000:9.1f} ms cumulative  {name}')
+    typer.echo(f'{module}: {module_time:.3f}s import, {elapsed:.3f}s with interpreter start, budget {budget:.3f}s')
+    if module_time > budget:
+        typer.echo(f'Import time budget exceeded by {module_time - budget:.3f}s', err=True)
+        raise typer.Exit(1)
+
+
+if __name__ == '__main__':
+    app()
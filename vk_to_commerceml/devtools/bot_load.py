@@ -0,0 +1,186 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import time
+import tracemalloc
+from collections import Counter
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.redis import RedisStorage
+from aiogram.types import Update
+from cryptography.fernet import Fernet
+from pydantic import BaseModel, SecretStr
+from redis.asyncio import Redis
+
+from vk_to_commerceml.app_state import app_state
+from vk_to_commerceml.bot.main import build_dispatcher
+from vk_to_commerceml.bot.progress import RateLimitMiddleware
+from vk_to_commerceml.bot.states import Form
+from vk_to_commerceml.bot.sync import SyncCallback
+from vk_to_commerceml.devtools.fake_bot import FakeBotSession, get_fake_bot
+from vk_to_commerceml.devtools.fake_cml import FakeCmlServer, run_fake_cml_server
+from vk_to_commerceml.devtools.fake_vk import FakeVkServer, run_fake_vk_server
+from vk_to_commerceml.infrastructure.cml.client import CmlClient
+from vk_to_commerceml.infrastructure.cml.transfer import CmlMetricsStore
+from vk_to_commerceml.infrastructure.rate_limiter import RateLimiter
+from vk_to_commerceml.infrastructure.secrets import Secrets
+from vk_to_commerceml.infrastructure.sync_history import DurationStats, SyncHistory, duration_stats
+from vk_to_commerceml.infrastructure.vk.client import VkClient
+from vk_to_commerceml.services.profiling import LoopLagMonitor, lag_stats
+
+logger = logging.getLogger(__name__)
+FIRST_CHAT_ID = 1_000_000
+
+
+class BotLoadOptions(BaseModel):
+    items: int = 500
+    with_photos: bool = False
+    photos_per_item: int = 1
+    vk_latency: float = 0.05
+    vk_api_rate: float = 3
+    cml_latency: float = 0.05
+    telegram_latency: float = 0.05
+    bot_api_rate: float | None = 25
+    process_pool_workers: int | None = 2
+    redis_url: str | None = None
+    trace_memory: bool = True
+
+
+class BotLoadReport(BaseModel):
+    chats: int
+    updates: int
+    errors: int
+    duration: float
+    throughput: float
+    command: DurationStats | None
+    sync: DurationStats | None
+    lag_max: float
+    lag_mean: float
+    memory_peak: int | None
+    telegram_calls: dict[str, int]
+
+
+class BotLoadGenerator:
+    def __init__(self, dp: Dispatcher, bot: Bot, cml_url: str, options: BotLoadOptions) -> None:
+        self.__dp = dp
+        self.__bot = bot
+        self.__cml_url = cml_url
+        self.__options = options
+        self.__update_ids = itertools.count(1)
+        self.__chat_ids: Iterator[int] = itertools.count(FIRST_CHAT_ID)
+
+    def __update(self, **event: Any) -> Update:
+        return Update.model_validate({'update_id': next(self.__update_ids), **event}, context={'bot': self.__bot})
+
+    async def __prepare_chat(self, chat_id: int) -> None:
+        state = self.__dp.fsm.get_context(self.__bot, chat_id, chat_id)
+        await state.set_state(Form.cml_password_entered)
+        await state.set_data({
+            'vk_token': app_state.secrets.encrypt(SecretStr(f'vk-token-{chat_id}')),
+            'vk_group_id': chat_id,
+            'cml_site': 'custom',
+            'cml_url': self.__cml_url,
+            'cml_login': f'chat_{chat_id}',
+            'cml_password': app_state.secrets.encrypt(SecretStr(f'password-{chat_id}')),
+        })
+
+    async def __feed(self, update: Update) -> float:
+        started_at = time.perf_counter()
+        if await self.__dp.feed_update(self.__bot, update) is UNHANDLED:
+            raise Exception(f'Update {update.update_id} is not handled')
+        return time.perf_counter() - started_at
+
+    async def __run_chat(self, chat_id: int) -> tuple[float, float]:
+        await self.__prepare_chat(chat_id)
+        chat = {'id': chat_id, 'type': 'private'}
+        user = {'id': chat_id, 'is_bot': False, 'first_name': f'Chat {chat_id}'}
+        command_latency = await self.__feed(self.__update(message={
+            'message_id': 1, 'date': int(time.time()), 'chat': chat, 'from': user, 'text': '/sync',
+        }))
+        sync_latency = await self.__feed(self.__update(callback_query={
+            'id': str(chat_id),
+            'from': user,
+            'chat_instance': str(chat_id),
+            'data': SyncCallback(with_photos=self.__options.with_photos, start=True).pack(),
+            'message': {
+                'message_id': 2, 'date': int(time.time()), 'chat': chat, 'text': 'Настройте синхронизацию и запустите',
+                'from': {'id': self.__bot.id, 'is_bot': True, 'first_name': 'Fake bot'},
+            },
+        }))
+        return command_latency, sync_latency
+
+    async def run_level(self, chats: int) -> BotLoadReport:
+        session = self.__bot.session
+        calls_before = Counter(session.calls) if isinstance(session, FakeBotSession) else Counter()
+        if self.__options.trace_memory:
+            tracemalloc.start()
+        lag_monitor = LoopLagMonitor()
+        lag_monitor.start()
+        started_at = time.perf_counter()
+        try:
+            results = await asyncio.gather(
+                *(self.__run_chat(next(self.__chat_ids)) for _ in range(chats)), return_exceptions=True,
+            )
+            duration = time.perf_counter() - started_at
+        finally:
+            await lag_monitor.stop()
+            memory_peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+            if self.__options.trace_memory:
+                tracemalloc.stop()
+        latencies = [result for result in results if isinstance(result, tuple)]
+        for result in results:
+            if isinstance(result, BaseException):
+                logger.error('Load test chat failure: %r', result)
+        lag_max, lag_mean = lag_stats(lag_monitor.samples)
+        calls = Counter(session.calls) - calls_before if isinstance(session, FakeBotSession) else Counter()
+        return BotLoadReport(
+            chats=chats,
+            updates=chats * 2,
+            errors=chats - len(latencies),
+            duration=duration,
+            throughput=len(latencies) * 2 / duration,
+            command=duration_stats([command for command, _ in latencies]) if latencies else None,
+            sync=duration_stats([sync for _, sync in latencies]) if latencies else None,
+            lag_max=lag_max,
+            lag_mean=lag_mean,
+            memory_peak=memory_peak,
+            telegram_calls=dict(calls),
+        )
+
+
+async def run_bot_load(levels: list[int], options: BotLoadOptions) -> list[BotLoadReport]:
+    vk_server = FakeVkServer(options.items, options.photos_per_item, options.vk_latency)
+    cml_server = FakeCmlServer(latency=options.cml_latency, zip_yes=True)
+    redis = Redis.from_url(options.redis_url) if options.redis_url else None
+    storage: BaseStorage = RedisStorage(redis) if redis else MemoryStorage()
+    bot = get_fake_bot(options.telegram_latency)
+    if options.bot_api_rate:
+        bot.session.middleware(RateLimitMiddleware(
+            RateLimiter(options.bot_api_rate, burst=max(int(options.bot_api_rate), 1))
+        ))
+    async with run_fake_vk_server(vk_server) as vk_url, run_fake_cml_server(cml_server) as cml_url:
+        app_state.vk_client = VkClient(api_rate=options.vk_api_rate, api_url=vk_url)
+        app_state.cml_client = CmlClient(metrics_store=CmlMetricsStore(redis) if redis else None)
+        app_state.secrets = Secrets(Fernet.generate_key())
+        app_state.sync_history = SyncHistory(redis) if redis else None
+        app_state.process_pool = ProcessPoolExecutor(
+            options.process_pool_workers, mp_context=multiprocessing.get_context('forkserver')
+        )
+        try:
+            generator = BotLoadGenerator(build_dispatcher(storage), bot, cml_url, options)
+            return [await generator.run_level(chats) for chats in levels]
+        finally:
+            await app_state.vk_client.close()
+            await app_state.cml_client.close()
+            app_state.process_pool.shutdown(cancel_futures=True)
+            await storage.close()
+            await bot.session.close()
+            if redis:
+                await redis.aclose()
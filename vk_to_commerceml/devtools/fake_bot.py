@@ -0,0 +1,60 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from collections.abc import AsyncGenerator
+from typing import Any, cast, get_origin
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+
+BOT_TOKEN = '42:FAKE-LOAD-TEST-TOKEN'
+
+
+class FakeBotSession(BaseSession):
+    def __init__(self, latency: float = 0.05) -> None:
+        super().__init__()
+        self.__latency = latency
+        self.__message_ids = itertools.count(1)
+        self.calls: Counter[str] = Counter()
+
+    def __message(self, method: TelegramMethod[Any]) -> dict[str, Any]:
+        return {
+            'message_id': next(self.__message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(getattr(method, 'chat_id', None) or 0), 'type': 'private'},
+            'from': {'id': 42, 'is_bot': True, 'first_name': 'Fake bot'},
+            'text': getattr(method, 'text', None),
+        }
+
+    async def make_request(
+        self, bot: Bot, method: TelegramMethod[TelegramType], timeout: int | None = None,
+    ) -> TelegramType:
+        self.calls[method.__api_method__] += 1
+        await asyncio.sleep(self.__latency)
+        returning = method.__returning__
+        result: Any
+        if returning is bool:
+            result = True
+        elif get_origin(returning) is list:
+            result = [self.__message(method)]
+        else:
+            result = self.__message(method)
+        response = self.check_response(bot, method, 200, json.dumps({'ok': True, 'result': result}))
+        return cast(TelegramType, response.result)
+
+    async def stream_content(
+        self, url: str, headers: dict[str, Any] | None = None, timeout: int = 30, chunk_size: int = 65536,
+        raise_for_status: bool = True,
+    ) -> AsyncGenerator[bytes]:
+        yield b''
+
+    async def close(self) -> None:
+        pass
+
+
+def get_fake_bot(latency: float = 0.05) -> Bot:
+    return Bot(token=BOT_TOKEN, session=FakeBotSession(latency))
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+from aiohttp import web
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+SESSID = 'fake_sessid'
+
+
+class FakeCmlStats(BaseModel):
+    files: int = 0
+    bytes: int = 0
+    imports: int = 0
+    auths: int = 0
+    max_parallel: int = 0
+
+
+class FakeCmlServer:
+    def __init__(
+        self, latency: float = 0.15, zip_yes: bool = False, file_limit: int | None = None,
+        max_parallel: int | None = None, import_latency: float = 0.0, keep_imported: bool = False,
+    ) -> None:
+        self.__latency = latency
+        self.__zip_yes = zip_yes
+        self.__file_limit = file_limit
+        self.__max_parallel = max_parallel
+        self.__import_latency = import_latency
+        self.__keep_imported = keep_imported
+        self.__parallel = 0
+        self.stats = FakeCmlStats()
+        self.imported: list[tuple[str, bytes]] = []
+        self.__files: dict[str, bytes] = {}
+        self.app = web.Application(client_max_size=1024 ** 3)
+        self.app.router.add_route('*', '/cml', self.__handle)
+
+    async def __handle(self, request: web.Request) -> web.Response:
+        mode = request.query.get('mode')
+        self.__parallel += 1
+        self.stats.max_parallel = max(self.stats.max_parallel, self.__parallel)
+        try:
+            await asyncio.sleep(self.__latency)
+            match mode:
+                case 'checkauth':
+                    self.stats.auths += 1
+                    return web.Response(text=f'success\nPHPSESSID\n{SESSID}\nsessid={SESSID}\n')
+                case 'init':
+                    lines = [f'zip={"yes" if self.__zip_yes else "no"}']
+                    if self.__file_limit:
+                        lines.append(f'file_limit={self.__file_limit}')
+                    return web.Response(text='\n'.join(lines))
+                case 'file':
+                    if self.__max_parallel and self.__parallel > self.__max_parallel:
+                        return web.Response(text='failure\nToo many parallel uploads')
+                    data = await request.read()
+                    filename = request.query.get('filename', '')
+                    if self.__keep_imported and filename.endswith('.xml'):
+                        self.__files[filename] = self.__files.get(filename, b'') + data
+                    self.stats.files += 1
+                    self.stats.bytes += len(data)
+                    return web.Response(text='success')
+                case 'import':
+                    await asyncio.sleep(self.__import_latency)
+                    self.stats.imports += 1
+                    if self.__keep_imported:
+                        filename = request.query.get('filename', '')
+                        self.imported.append((filename, self.__files.pop(filename, b'')))
+                    return web.Response(text='success')
+            return web.Response(text=f'failure\nUnknown mode: {mode}')
+        finally:
+            self.__parallel -= 1
+
+
+@asynccontextmanager
+async def run_fake_cml_server(server: FakeCmlServer, host: str = '127.0.0.1') -> AsyncIterator[str]:
+    runner = web.AppRunner(server.app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    url = f'http://{host}:{port}/cml'
+    logger.info('Fake CommerceML server started: %s', url)
+    try:
+        yield url
+    finally:
+        await runner.cleanup()
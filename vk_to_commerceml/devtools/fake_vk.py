@@ -0,0 +1,111 @@
+import asyncio
+import io
+import logging
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any
+
+from aiohttp import web
+from PIL import Image
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+CATEGORIES = ['Одежда', 'Обувь', 'Аксессуары', 'Сумки']
+
+
+class FakeVkStats(BaseModel):
+    requests: int = 0
+    photos: int = 0
+    max_parallel: int = 0
+
+
+class FakeVkServer:
+    def __init__(
+        self, items: int = 500, photos_per_item: int = 1, latency: float = 0.05, photo_latency: float = 0.02,
+    ) -> None:
+        self.__items = items
+        self.__photos_per_item = photos_per_item
+        self.__latency = latency
+        self.__photo_latency = photo_latency
+        self.__parallel = 0
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480), (200, 120, 40)).save(buffer, 'JPEG')
+        self.__photo = buffer.getvalue()
+        self.stats = FakeVkStats()
+        self.app = web.Application()
+        self.app.router.add_get('/method/groups.get', self.__groups_get)
+        self.app.router.add_get('/method/market.get', self.__market_get)
+        self.app.router.add_get('/method/market.getById', self.__market_get_by_id)
+        self.app.router.add_get('/photos/{name}', self.__photo_get)
+
+    async def __api_call(self) -> None:
+        self.stats.requests += 1
+        self.__parallel += 1
+        self.stats.max_parallel = max(self.stats.max_parallel, self.__parallel)
+        try:
+            await asyncio.sleep(self.__latency)
+        finally:
+            self.__parallel -= 1
+
+    def __item(self, request: web.Request, owner_id: int, item_id: int) -> dict[str, Any]:
+        photos_url = request.url.with_path('/photos')
+        return {
+            'id': item_id,
+            'owner_id': owner_id,
+            'title': f'Товар {item_id}',
+            'description': f'Описание товара {item_id}\n\nРазмер: {40 + item_id % 8}\nЦвет: синий',
+            'price': {'amount': str(100 + item_id % 900), 'old_amount': None},
+            'category': {'id': 1, 'name': 'Одежда'},
+            'availability': 0,
+            'sku': f'SKU-{item_id}',
+            'photos': [
+                {'id': item_id * 100 + number, 'owner_id': owner_id, 'sizes': [
+                    {'width': 640, 'url': str(photos_url / f'{item_id * 100 + number}.jpg')},
+                ]}
+                for number in range(self.__photos_per_item)
+            ],
+            'owner_info': {'category': CATEGORIES[item_id % len(CATEGORIES)]},
+            'date': 1_700_000_000 + item_id,
+        }
+
+    async def __groups_get(self, request: web.Request) -> web.Response:
+        await self.__api_call()
+        return web.json_response({'response': {'count': 1, 'items': [{'id': 1, 'name': 'Fake group'}]}})
+
+    async def __market_get(self, request: web.Request) -> web.Response:
+        await self.__api_call()
+        owner_id = int(request.query['owner_id'])
+        offset = int(request.query.get('offset', 0))
+        count = int(request.query.get('count', 100))
+        item_ids = range(offset, min(offset + count, self.__items))
+        items = [self.__item(request, owner_id, item_id) for item_id in item_ids]
+        return web.json_response({'response': {'count': self.__items, 'items': items}})
+
+    async def __market_get_by_id(self, request: web.Request) -> web.Response:
+        await self.__api_call()
+        items = []
+        for item_ids in request.query['item_ids'].split(','):
+            owner_id, item_id = map(int, item_ids.rsplit('_', 1))
+            if item_id < self.__items:
+                items.append(self.__item(request, owner_id, item_id))
+        return web.json_response({'response': {'count': len(items), 'items': items}})
+
+    async def __photo_get(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.__photo_latency)
+        self.stats.photos += 1
+        return web.Response(body=self.__photo, content_type='image/jpeg')
+
+
+@asynccontextmanager
+async def run_fake_vk_server(server: FakeVkServer, host: str = '127.0.0.1') -> AsyncIterator[str]:
+    runner = web.AppRunner(server.app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    url = f'http://{host}:{port}/method'
+    logger.info('Fake VK server started: %s', url)
+    try:
+        yield url
+    finally:
+        await runner.cleanup()
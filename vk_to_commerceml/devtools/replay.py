@@ -0,0 +1,117 @@
+import asyncio
+import io
+import json
+import logging
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any
+
+from aiohttp import web
+from PIL import Image
+from pydantic import BaseModel
+from yarl import URL
+
+from vk_to_commerceml.infrastructure.traffic import SECRET_PARAMS, TrafficExchange, TrafficFixture
+
+logger = logging.getLogger(__name__)
+VOLATILE_PARAMS = SECRET_PARAMS | {'v'}
+
+ReplayKey = tuple[str, str, str, str, tuple[tuple[str, str], ...]]
+
+
+def replay_key(service: str, method: str, url: URL, exclude: frozenset[str] = frozenset()) -> ReplayKey:
+    query = tuple(sorted(
+        (name, value) for name, value in url.query.items() if name not in VOLATILE_PARAMS and name not in exclude
+    ))
+    return service, method.upper(), url.host or '', url.path, query
+
+
+class ReplayStats(BaseModel):
+    served: int = 0
+    fallbacks: int = 0
+    missing: int = 0
+
+
+class ReplayServer:
+    def __init__(self, fixture: TrafficFixture, time_scale: float = 1.0) -> None:
+        self.__time_scale = time_scale
+        self.__exchanges: dict[ReplayKey, deque[TrafficExchange]] = {}
+        self.__fallbacks: dict[ReplayKey, deque[TrafficExchange]] = {}
+        for exchange in fixture.exchanges:
+            url = URL(exchange.url)
+            self.__exchanges.setdefault(replay_key(exchange.service, exchange.method, url), deque()).append(exchange)
+            self.__fallbacks.setdefault(
+                replay_key(exchange.service, exchange.method, url, frozenset({'filename'})), deque()
+            ).append(exchange)
+        self.__cdn_hosts = {URL(exchange.url).host for exchange in fixture.exchanges if exchange.service == 'vk_cdn'}
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480), (120, 120, 120)).save(buffer, 'JPEG')
+        self.__photo = buffer.getvalue()
+        self.stats = ReplayStats()
+        self.app = web.Application(client_max_size=1024 ** 3)
+        self.app.router.add_route('*', '/{service}/{host}/{path:.*}', self.__handle)
+
+    @staticmethod
+    def __next(exchanges: dict[ReplayKey, deque[TrafficExchange]], key: ReplayKey) -> TrafficExchange | None:
+        queue = exchanges.get(key)
+        if not queue:
+            return None
+        return queue.popleft() if len(queue) > 1 else queue[0]
+
+    def __rewrite_urls(self, value: Any, origin: URL) -> Any:
+        if isinstance(value, dict):
+            return {key: self.__rewrite_urls(item, origin) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.__rewrite_urls(item, origin) for item in value]
+        if isinstance(value, str) and value.startswith('http') and (url := URL(value)).host in self.__cdn_hosts:
+            return str(origin.with_path(f'/vk_cdn/{url.host}{url.path}').with_query(url.query))
+        return value
+
+    async def __handle(self, request: web.Request) -> web.Response:
+        service = request.match_info['service']
+        url = URL.build(host=request.match_info['host'], path='/' + request.match_info['path'], query=request.query)
+        await request.read()
+        exchange = self.__next(self.__exchanges, replay_key(service, request.method, url))
+        if exchange is None:
+            exchange = self.__next(self.__fallbacks, replay_key(service, request.method, url, frozenset({'filename'})))
+            self.stats.fallbacks += exchange is not None
+        if exchange is None:
+            self.stats.missing += 1
+            logger.warning('Replay: no recorded exchange for %s %s %s', service, request.method, url)
+            return web.Response(status=404, text='No recorded exchange')
+        self.stats.served += 1
+        await asyncio.sleep(exchange.duration * self.__time_scale)
+        if exchange.body is None:
+            body = self.__photo + bytes(max(exchange.response_bytes - len(self.__photo), 0))
+            return web.Response(status=exchange.status, body=body, content_type=exchange.content_type or None)
+        if service == 'vk' and 'json' in exchange.content_type:
+            origin = request.url.origin()
+            return web.json_response(self.__rewrite_urls(json.loads(exchange.body), origin), status=exchange.status)
+        return web.Response(status=exchange.status, text=exchange.body, content_type=exchange.content_type or None)
+
+
+def replay_urls(fixture: TrafficFixture, base_url: str) -> tuple[str, str]:
+    vk_url = cml_url = ''
+    for exchange in fixture.exchanges:
+        url = URL(exchange.url)
+        if not vk_url and exchange.service == 'vk' and url.path.startswith('/method/'):
+            vk_url = f'{base_url}/vk/{url.host}/method'
+        if not cml_url and exchange.service == 'cml':
+            cml_url = f'{base_url}/cml/{url.host}{url.path}'
+    return vk_url, cml_url
+
+
+@asynccontextmanager
+async def run_replay_server(server: ReplayServer, host: str = '127.0.0.1') -> AsyncIterator[str]:
+    runner = web.AppRunner(server.app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    url = f'http://{host}:{port}'
+    logger.info('Replay server started: %s', url)
+    try:
+        yield url
+    finally:
+        await runner.cleanup()
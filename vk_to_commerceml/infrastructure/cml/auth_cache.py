@@ -0,0 +1,53 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+from aiohttp import CookieJar
+from pydantic import SecretStr
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CmlAuth:
+    password: SecretStr
+    sessid: str | None
+    zip_yes: bool
+    file_limit: int | None
+    cookie_jar: CookieJar
+    parallel_uploads: bool = True
+    created_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def common_params(self) -> dict[str, str]:
+        common_params = {'type': 'catalog'}
+        if self.sessid:
+            common_params['sessid'] = self.sessid
+        return common_params
+
+
+class CmlAuthCache:
+    def __init__(self, ttl: float) -> None:
+        self.__ttl = ttl
+        self.__entries: dict[tuple[str, str], CmlAuth] = {}
+        self.__locks: dict[tuple[str, str], asyncio.Lock] = {}
+
+    def lock(self, url: str, login: str) -> asyncio.Lock:
+        return self.__locks.setdefault((url, login), asyncio.Lock())
+
+    def get(self, url: str, login: str, password: SecretStr) -> CmlAuth | None:
+        auth = self.__entries.get((url, login))
+        if not auth:
+            return None
+        if time.monotonic() - auth.created_at > self.__ttl or auth.password != password:
+            self.invalidate(url, login)
+            return None
+        return auth
+
+    def set(self, url: str, login: str, auth: CmlAuth) -> None:
+        self.__entries[(url, login)] = auth
+
+    def invalidate(self, url: str, login: str) -> None:
+        if self.__entries.pop((url, login), None):
+            logger.info('CommerceML: cached auth dropped, url: %s, login: %s', url, login)
@@ -1,39 +1,93 @@
 import asyncio
-import io
 import itertools
 import logging
 import re
-from io import BytesIO
+import tempfile
+import time
 from pathlib import Path
-from typing import cast
-from zipfile import ZipFile
+from typing import BinaryIO, cast
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
 
-from aiohttp import BasicAuth, ClientSession, TCPConnector, hdrs
+import aiofiles
+from aiohttp import BasicAuth, ClientResponse, ClientSession, CookieJar, TCPConnector, hdrs
 from pydantic import SecretStr
 from yarl import URL
 
-from vk_to_commerceml.infrastructure.cml.debug_file_saver import DebugFileSaver
+from vk_to_commerceml.infrastructure.cml.auth_cache import CmlAuth, CmlAuthCache
+from vk_to_commerceml.infrastructure.cml.debug_file_saver import DebugArtifactWriter, DebugFileSaver
+from vk_to_commerceml.infrastructure.cml.import_hashes import CmlImportHashStore, content_hash
 from vk_to_commerceml.infrastructure.cml.models import ImportDocument, OffersDocument
+from vk_to_commerceml.infrastructure.cml.package_sizer import PACKAGE_TARGET_DURATION, PackageSizer
+from vk_to_commerceml.infrastructure.cml.transfer import CmlMetricsStore, SiteMetrics, choose_strategy
+from vk_to_commerceml.infrastructure.traffic import traffic_trace_config
 
 logger = logging.getLogger(__name__)
 RE_FILE_LIMIT = re.compile(r'^\s*file_limit\s*=\s*(\d+)\s*$', re.MULTILINE)
 RE_ZIP = re.compile(r'^\s*zip\s*=\s*yes\s*$', re.MULTILINE)
 RE_STATUS = re.compile(r'^\s*(?P<status>success|failure|progress)\s*(?P<detail>.*)$', re.DOTALL)
+RE_AUTH_FAILURE = re.compile(r'auth|sessid|session|авториз|сесси', re.IGNORECASE)
+CONNECTOR_LIMIT = 100
+CONNECTOR_LIMIT_PER_HOST = 32
+CONNECTOR_KEEPALIVE_TIMEOUT = 60
+CONNECTOR_DNS_CACHE_TTL = 300
+
+
+class CmlAuthError(Exception):
+    pass
+
+
+def raise_for_status(response: ClientResponse) -> None:
+    if response.status in (401, 403):
+        raise CmlAuthError(f'{response.status} {response.reason}')
+    response.raise_for_status()
+
+
+def raise_for_auth_failure(status: str, detail: str) -> None:
+    if status == 'failure' and RE_AUTH_FAILURE.search(detail):
+        raise CmlAuthError(detail)
+
+
+def write_zip(path: Path, files: dict[str, bytes | Path], compress_level: int | None = None) -> None:
+    with ZipFile(path, 'w') as zip_file:
+        for filename, data in files.items():
+            logger.info('Add file to zip: %s', filename)
+            if isinstance(data, Path):
+                zip_file.write(data, filename, compress_type=ZIP_STORED)
+            elif compress_level:
+                zip_file.writestr(filename, data, compress_type=ZIP_DEFLATED, compresslevel=compress_level)
+            else:
+                zip_file.writestr(filename, data)
 
 
 class CmlClientSession:
     def __init__(
         self, connector: TCPConnector, url: str, login: str, password: SecretStr,
-        debug_file_saver: DebugFileSaver
+        debug_file_saver: DebugFileSaver, auth_cache: CmlAuthCache, upload_concurrency: int = 1,
+        package_sizer: PackageSizer | None = None, metrics_store: CmlMetricsStore | None = None,
+        import_hash_store: CmlImportHashStore | None = None,
     ) -> None:
         self.__url = URL(url)
         self.__login = login
         self.__password = password
         self.__connector = connector
         self.__debug_file_saver = debug_file_saver
+        self.__auth_cache = auth_cache
+        self.__upload_concurrency = upload_concurrency
+        self.__package_sizer = package_sizer
+        self.__metrics_store = metrics_store
+        self.__metrics = SiteMetrics()
+        self.__import_hash_store = import_hash_store
+        self.__imported_hashes: dict[str, str] = {}
+        self.__document_kind: str | None = None
+        self.uploaded_bytes = 0
+        self.retries = 0
+        self.skipped_documents = 0
 
-    async def __import(self, session: ClientSession, filename: str, common_params: dict[str, str]) -> None:
+    async def __import(
+        self, session: ClientSession, filename: str, common_params: dict[str, str], size: int = 0,
+    ) -> None:
         logger.info('CommerceML: import %s', filename)
+        started_at = time.monotonic()
         status = 'failure'
         detail = ''
         for sleep_delay in itertools.count(start=1):
@@ -41,14 +95,16 @@ class CmlClientSession:
                 self.__url,
                 params={**common_params, 'mode': 'import', 'filename': filename},
             ) as response:
-                response.raise_for_status()
+                raise_for_status(response)
                 result = (await response.text()).strip()
                 logger.info('Response: %s', result)
             if m := RE_STATUS.match(result):
                 status = m.group('status')
                 prev_detail = detail
                 detail = m.group('detail')
+                raise_for_auth_failure(status, detail)
                 if 'Too many requests' in detail:
+                    self.retries += 1
                     await asyncio.sleep(sleep_delay)
                     continue
                 if status == 'progress':
@@ -58,40 +114,53 @@ class CmlClientSession:
             break
         if status != 'success':
             raise Exception(detail)
+        self.__metrics.observe_import(size, time.monotonic() - started_at)
 
     async def __file(self, session: ClientSession, filename: str, common_params: dict[str, str],
-                     content_type: str, data: io.BytesIO | bytes, file_limit: int | None = None) -> None:
-        if isinstance(data, io.BytesIO):
-            data_bytes = data.getvalue()
-        else:
-            data_bytes = data
-
-        if not content_type.startswith('image/'):
-            await self.__debug_file_saver.save_file(filename, data_bytes)
-
-        if file_limit:
-            for chunk_number, chunk in enumerate(itertools.batched(data_bytes, file_limit)):
+                     content_type: str, data: bytes | Path, file_limit: int | None = None) -> None:
+        if isinstance(data, Path):
+            if file_limit:
+                async with aiofiles.open(data, 'rb') as file:
+                    chunk_number = 0
+                    while file_chunk := await file.read(file_limit):
+                        await self.__upload_file_chunk(
+                            session, filename, common_params, content_type, file_chunk, chunk_number
+                        )
+                        chunk_number += 1
+            else:
+                with data.open('rb') as file:
+                    await self.__upload_file_chunk(
+                        session, filename, common_params, content_type, file, size=data.stat().st_size
+                    )
+        elif file_limit:
+            for chunk_number, chunk in enumerate(itertools.batched(data, file_limit)):
                 await self.__upload_file_chunk(
                     session, filename, common_params, content_type, bytes(chunk), chunk_number
                 )
         else:
-            await self.__upload_file_chunk(session, filename, common_params, content_type, data_bytes)
+            await self.__upload_file_chunk(session, filename, common_params, content_type, data)
 
     async def __upload_file_chunk(
         self, session: ClientSession, filename: str, common_params: dict[str, str],
-        content_type: str, data: bytes, chunk_number: int = 0
+        content_type: str, data: bytes | BinaryIO, chunk_number: int = 0, size: int = 0,
     ) -> None:
         logger.info('CommerceML: file %s, chunk number: %s', filename, chunk_number)
+        started_at = time.monotonic()
         async with session.post(
             self.__url,
             params={**common_params, 'mode': 'file', 'filename': filename},
             data=data,
             headers={hdrs.CONTENT_TYPE: content_type},
         ) as response:
-            response.raise_for_status()
+            raise_for_status(response)
             result = (await response.text()).strip()
+        size = len(data) if isinstance(data, bytes) else size
+        self.uploaded_bytes += size
+        self.__metrics.observe_chunk(size, time.monotonic() - started_at)
         logger.info('Response: %s', result)
         if not (m := RE_STATUS.match(result)) or m.group('status') != 'success':
+            if m:
+                raise_for_auth_failure(m.group('status'), m.group('detail'))
             raise Exception(result)
 
     async def __check_auth(self, session: ClientSession) -> str | None:
@@ -114,9 +183,11 @@ class CmlClientSession:
 
     async def __init(self, session: ClientSession, common_params: dict[str, str]) -> tuple[bool, int | None]:
         logger.info('CommerceML: init')
+        started_at = time.monotonic()
         async with session.get(self.__url, params={**common_params, 'mode': 'init'}) as response:
-            response.raise_for_status()
+            raise_for_status(response)
             response_text = await response.text()
+        self.__metrics.observe_latency(time.monotonic() - started_at)
         logger.info('Response: %s', response_text)
         zip_yes = bool(RE_ZIP.search(response_text))
         file_limit: int | None = None
@@ -124,96 +195,302 @@ class CmlClientSession:
             file_limit = int(m.group(1))
         return zip_yes, file_limit
 
+    def __client_session(self, cookie_jar: CookieJar) -> ClientSession:
+        return ClientSession(
+            connector=self.__connector, connector_owner=False, cookie_jar=cookie_jar,
+            trace_configs=[traffic_trace_config('cml')],
+        )
+
+    async def __get_auth(self, force: bool = False) -> CmlAuth:
+        url = str(self.__url)
+        async with self.__auth_cache.lock(url, self.__login):
+            if not force and (auth := self.__auth_cache.get(url, self.__login, self.__password)):
+                logger.info('CommerceML: cached auth reused, url: %s, login: %s', url, self.__login)
+                return auth
+            cookie_jar = CookieJar()
+            async with self.__client_session(cookie_jar) as session:
+                sessid = await self.__check_auth(session)
+                auth = CmlAuth(password=self.__password, sessid=sessid, zip_yes=False, file_limit=None,
+                               cookie_jar=cookie_jar)
+                auth.zip_yes, auth.file_limit = await self.__init(session, auth.common_params)
+            self.__auth_cache.set(url, self.__login, auth)
+            return auth
+
     async def check_auth(self) -> None:
-        async with ClientSession(connector=self.__connector, connector_owner=False) as session:
-            await self.__check_auth(session)
+        await self.__get_auth(force=True)
 
-    async def upload(self, import_document: ImportDocument,
+    async def upload(self, import_document: ImportDocument | None = None,
                      offers_document: OffersDocument | None = None,
-                     photos: dict[str, bytes] | None = None) -> None:
-        async with ClientSession(connector=self.__connector, connector_owner=False) as session:
-            sessid = await self.__check_auth(session)
+                     photos: dict[str, Path] | None = None, skip_unchanged: bool = False,
+                     document_kind: str | None = None) -> None:
+        if self.__metrics_store:
+            try:
+                self.__metrics = await self.__metrics_store.get(str(self.__url)) or self.__metrics
+            except Exception as exc:
+                logger.warning('CommerceML: site metrics not loaded: %s', exc)
+        packaged = bool(
+            self.__package_sizer and import_document and not photos
+            and len(import_document.catalog.products) > self.__package_sizer.size
+        )
+        # only whole documents of a known kind are hashed, any other upload invalidates the stored hashes
+        self.__document_kind = document_kind if not photos and not packaged else None
+        self.__imported_hashes = await self.__reset_import_hashes(skip_unchanged)
+        try:
+            auth = await self.__get_auth()
+            if packaged and self.__package_sizer and import_document:
+                await self.__upload_packages(auth, self.__package_sizer, import_document, offers_document)
+            else:
+                await self.__upload_with_reauth(auth, import_document, offers_document, photos)
+        except Exception as exc:
+            self.__debug_file_saver.save_failure(exc)
+            raise
+        finally:
+            if self.__metrics_store:
+                try:
+                    await self.__metrics_store.set(str(self.__url), self.__metrics)
+                except Exception as exc:
+                    logger.warning('CommerceML: site metrics not saved: %s', exc)
 
-            common_params = {'type': 'catalog'}
-            if sessid:
-                common_params['sessid'] = sessid
+    async def __upload_with_reauth(
+        self, auth: CmlAuth, import_document: ImportDocument | None, offers_document: OffersDocument | None,
+        photos: dict[str, Path] | None = None, package_number: int | None = None,
+    ) -> tuple[CmlAuth, float]:
+        try:
+            return auth, await self.__upload(auth, import_document, offers_document, photos, package_number)
+        except CmlAuthError as exc:
+            logger.warning('CommerceML: auth failure, re-authenticating: %s', exc)
+            self.retries += 1
+            self.__auth_cache.invalidate(str(self.__url), self.__login)
+            auth = await self.__get_auth(force=True)
+            return auth, await self.__upload(auth, import_document, offers_document, photos, package_number)
 
-            zip_yes, file_limit = await self.__init(session, common_params)
-            if zip_yes:
-                zip_bytes = BytesIO()
-                zip_file = ZipFile(zip_bytes, 'w')
+    async def __upload_packages(
+        self, auth: CmlAuth, package_sizer: PackageSizer, import_document: ImportDocument,
+        offers_document: OffersDocument | None,
+    ) -> None:
+        products = import_document.catalog.products
+        offers = {offer.id: offer for offer in offers_document.package_of_offers.offers} if offers_document else {}
+        offset = 0
+        for package_number in itertools.count(start=1):
+            if offset >= len(products):
+                break
+            package_products = products[offset:offset + package_sizer.size]
+            offset += len(package_products)
+            # only the first package may replace the catalog, the rest must not deactivate what came before;
+            # products of later packages stay hidden on the site until their package is imported
+            only_changes = import_document.catalog.only_changes or package_number > 1
+            package_import = import_document.model_copy(update={
+                'catalog': import_document.catalog.model_copy(
+                    update={'products': package_products, 'only_changes': only_changes}
+                ),
+            })
+            package_offers = offers_document.model_copy(update={
+                'package_of_offers': offers_document.package_of_offers.model_copy(update={
+                    'offers': [offers[product.id] for product in package_products if product.id in offers],
+                    'only_changes': offers_document.package_of_offers.only_changes or package_number > 1,
+                }),
+            }) if offers_document else None
+            logger.info('CommerceML: package %d with %d products', package_number, len(package_products))
+            auth, import_duration = await self.__upload_with_reauth(
+                auth, package_import, package_offers, package_number=package_number
+            )
+            package_sizer.observe(len(package_products), import_duration)
 
-            if photos:
-                for photo_name, photo_data in photos.items():
-                    if zip_yes:
-                        logger.info('Add file to zip: %s', photo_name)
-                        zip_file.writestr(photo_name, photo_data)
-                    else:
+    async def __upload_photos(
+        self, session: ClientSession, auth: CmlAuth, photos: dict[str, Path], chunk_size: int | None,
+    ) -> None:
+        pending = dict(photos)
+        if auth.parallel_uploads and self.__upload_concurrency > 1 and len(pending) > 1:
+            logger.info('CommerceML: parallel upload of %d photos, concurrency: %d',
+                        len(pending), self.__upload_concurrency)
+            semaphore = asyncio.Semaphore(self.__upload_concurrency)
+            failed = asyncio.Event()
+
+            async def upload_single(photo_name: str, photo_data: Path) -> None:
+                async with semaphore:
+                    if failed.is_set():
+                        return
+                    try:
                         await self.__file(
                             session=session,
                             filename=photo_name,
-                            common_params=common_params,
+                            common_params=auth.common_params,
                             content_type='image/jpeg',
                             data=photo_data,
-                            file_limit=file_limit,
+                            file_limit=chunk_size,
                         )
+                    except Exception:
+                        failed.set()
+                        raise
+                del pending[photo_name]
 
-            import_xml = cast(bytes, import_document.to_xml(pretty_print=True, encoding='UTF-8', standalone=True))
-            if zip_yes:
-                logger.info('Add file to zip: import.xml')
-                zip_file.writestr('import.xml', import_xml)
-            else:
-                await self.__file(
-                    session=session,
-                    filename='import.xml',
-                    common_params=common_params,
-                    content_type='application/xml; charset=utf-8',
-                    data=import_xml,
-                    file_limit=file_limit,
-                )
+            results = await asyncio.gather(
+                *(upload_single(photo_name, photo_data) for photo_name, photo_data in photos.items()),
+                return_exceptions=True,
+            )
+            errors = [result for result in results if isinstance(result, BaseException)]
+            for error in errors:
+                if isinstance(error, CmlAuthError):
+                    raise error
+            if errors:
+                logger.warning('CommerceML: parallel upload failed, falling back to sequential: %r', errors[0])
+                self.retries += 1
+                auth.parallel_uploads = False
+
+        for photo_name, photo_data in pending.items():
+            await self.__file(
+                session=session,
+                filename=photo_name,
+                common_params=auth.common_params,
+                content_type='image/jpeg',
+                data=photo_data,
+                file_limit=chunk_size,
+            )
+
+    async def __upload(self, auth: CmlAuth, import_document: ImportDocument | None = None,
+                       offers_document: OffersDocument | None = None,
+                       photos: dict[str, Path] | None = None, package_number: int | None = None) -> float:
+        suffix = f'_{package_number}' if package_number else ''
+        import_filename, offers_filename = f'import{suffix}.xml', f'offers{suffix}.xml'
+        documents: dict[str, bytes] = {}
+        if import_document:
+            documents[import_filename] = cast(
+                bytes, import_document.to_xml(pretty_print=True, encoding='UTF-8', standalone=True)
+            )
+        if offers_document:
+            documents[offers_filename] = cast(
+                bytes, offers_document.to_xml(pretty_print=True, encoding='UTF-8', standalone=True)
+            )
+        for filename, document in documents.items():
+            self.__debug_file_saver.save_file(filename, document)
 
-            if offers_document:
-                offers_xml = cast(bytes, offers_document.to_xml(pretty_print=True, encoding='UTF-8', standalone=True))
-                if zip_yes:
-                    logger.info('Add file to zip: offers.xml')
-                    zip_file.writestr('offers.xml', offers_xml)
+        photos = photos or {}
+        hashes: dict[str, str] = {}
+        if self.__document_kind and self.__import_hash_store:
+            hashes = {
+                filename: content_hash(cast(bytes, document.canonical().to_xml(encoding='UTF-8', standalone=True)))
+                for filename, document in ((import_filename, import_document), (offers_filename, offers_document))
+                if document
+            }
+        for filename, document_hash in hashes.items():
+            if self.__imported_hashes.get(f'{self.__document_kind}:{filename}') == document_hash:
+                logger.info('CommerceML: %s is unchanged since the last import, skipped', filename)
+                self.skipped_documents += 1
+                del documents[filename]
+                await self.__save_import_hash(filename, document_hash)
+        if not documents and not photos:
+            return 0.0
+        strategy = choose_strategy(
+            self.__metrics, auth.zip_yes, auth.file_limit,
+            xml_bytes=sum(len(document) for document in documents.values()),
+            photo_bytes=sum(photo.stat().st_size for photo in photos.values()),
+            photo_count=len(photos),
+            concurrency=self.__upload_concurrency if auth.parallel_uploads else 1,
+        )
+        logger.info(
+            'CommerceML: transfer to %s: %s, deflate level: %s, chunk size: %s (%s)',
+            self.__url.host, 'zip' if strategy.use_zip else 'per-file', strategy.compress_level,
+            strategy.chunk_size, strategy.reason,
+        )
+
+        async with self.__client_session(auth.cookie_jar) as session:
+            common_params = auth.common_params
+            files: dict[str, bytes | Path] = {}
+
+            if photos:
+                if strategy.use_zip:
+                    files.update(photos)
                 else:
+                    await self.__upload_photos(session, auth, photos, strategy.chunk_size)
+            files.update(documents)
+
+            if strategy.use_zip:
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    zip_path = Path(tmp_dir, 'stock.zip')
+                    await asyncio.to_thread(write_zip, zip_path, files, strategy.compress_level)
+                    await self.__file(
+                        session=session,
+                        filename='stock.zip',
+                        common_params=common_params,
+                        content_type='application/zip',
+                        data=zip_path,
+                        file_limit=strategy.chunk_size,
+                    )
+            else:
+                for filename, data in files.items():
                     await self.__file(
                         session=session,
-                        filename='offers.xml',
+                        filename=filename,
                         common_params=common_params,
                         content_type='application/xml; charset=utf-8',
-                        data=offers_xml,
-                        file_limit=file_limit,
+                        data=data,
+                        file_limit=strategy.chunk_size,
                     )
 
-            if zip_yes:
-                zip_file.close()
-                zip_bytes.seek(0)
-                await self.__file(
-                    session=session,
-                    filename='stock.zip',
-                    common_params=common_params,
-                    content_type='application/zip',
-                    data=zip_bytes,
-                    file_limit=file_limit,
-                )
-                zip_bytes.close()
+            import_started_at = time.monotonic()
+            for filename, document in documents.items():
+                await self.__import(session, filename, common_params, len(document))
+                if filename in hashes:
+                    await self.__save_import_hash(filename, hashes[filename])
+            return time.monotonic() - import_started_at
+
+    async def __reset_import_hashes(self, load: bool) -> dict[str, str]:
+        if not self.__import_hash_store:
+            return {}
+        imported_hashes: dict[str, str] = {}
+        try:
+            if load and self.__document_kind:
+                imported_hashes = await self.__import_hash_store.get(str(self.__url), self.__login)
+            await self.__import_hash_store.clear(str(self.__url), self.__login)
+        except Exception as exc:
+            logger.warning('CommerceML: imported document hashes not reset: %s', exc)
+        return imported_hashes
 
-            await self.__import(session, 'import.xml', common_params)
-            if offers_document:
-                await self.__import(session, 'offers.xml', common_params)
+    async def __save_import_hash(self, filename: str, document_hash: str) -> None:
+        if not self.__import_hash_store:
+            return
+        try:
+            await self.__import_hash_store.set(
+                str(self.__url), self.__login, f'{self.__document_kind}:{filename}', document_hash
+            )
+        except Exception as exc:
+            logger.warning('CommerceML: imported document hash not saved: %s', exc)
 
 
 class CmlClient:
-    def __init__(self, debug_base_path: Path | None = None) -> None:
-        self.__connector = TCPConnector()
-        self.__debug_base_path = debug_base_path
+    def __init__(
+        self, debug_base_path: Path | None = None, auth_ttl: float = 900, upload_concurrency: int = 1,
+        debug_artifact_writer: DebugArtifactWriter | None = None, package_size: int | None = None,
+        package_target_duration: float = PACKAGE_TARGET_DURATION, metrics_store: CmlMetricsStore | None = None,
+        import_hash_store: CmlImportHashStore | None = None, connector_limit_per_host: int = CONNECTOR_LIMIT_PER_HOST,
+    ) -> None:
+        self.__connector = TCPConnector(
+            limit=CONNECTOR_LIMIT,
+            limit_per_host=connector_limit_per_host,
+            keepalive_timeout=CONNECTOR_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=CONNECTOR_DNS_CACHE_TTL,
+        )
+        self.__debug_artifact_writer = debug_artifact_writer or DebugArtifactWriter(debug_base_path)
+        self.__auth_cache = CmlAuthCache(auth_ttl)
+        self.__upload_concurrency = upload_concurrency
+        self.__package_size = package_size
+        self.__package_target_duration = package_target_duration
+        self.__package_sizers: dict[tuple[str, str], PackageSizer] = {}
+        self.__metrics_store = metrics_store
+        self.__import_hash_store = import_hash_store
 
     async def close(self) -> None:
+        await self.__debug_artifact_writer.close()
         await self.__connector.close()
 
     async def get_session(self, url: str, login: str, password: SecretStr) -> CmlClientSession:
-        debug_file_saver = DebugFileSaver(self.__debug_base_path)
-        await debug_file_saver.create_dir()
-        return CmlClientSession(self.__connector, url, login, password, debug_file_saver)
+        debug_file_saver = self.__debug_artifact_writer.get_saver(f'{URL(url).host}_{login}')
+        package_sizer: PackageSizer | None = None
+        if self.__package_size:
+            package_sizer = self.__package_sizers.setdefault(
+                (url, login), PackageSizer(self.__package_size, self.__package_target_duration)
+            )
+        return CmlClientSession(
+            self.__connector, url, login, password, debug_file_saver, self.__auth_cache, self.__upload_concurrency,
+            package_sizer, self.__metrics_store, self.__import_hash_store,
+        )
@@ -1,41 +1,149 @@
+import asyncio
+import gzip
+import itertools
 import logging
-import os.path
+import re
+import shutil
+import time
 import uuid
 from datetime import UTC, datetime
 from pathlib import Path
+from typing import NamedTuple
 
-import aiofiles
-import aiofiles.os
+from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
+RE_UNSAFE = re.compile(r'[^\w.-]+')
 
 
-class DebugFileSaver:
-    def __init__(self, base_path: Path | None) -> None:
+class DebugRetention(BaseModel):
+    max_age_days: float = 30
+    max_total_bytes: int = 1024 * 1024 * 1024
+    max_runs_per_site: int = 50
+
+
+class DebugArtifact(NamedTuple):
+    run_dir: Path
+    filename: str
+    data: bytes
+
+
+def dir_size(path: Path) -> int:
+    return sum(file.stat().st_size for file in path.rglob('*') if file.is_file())
+
+
+def enforce_retention(base_path: Path, retention: DebugRetention) -> None:
+    now = time.time()
+    runs: list[tuple[float, int, Path]] = []
+    for site_dir in (path for path in base_path.iterdir() if path.is_dir()):
+        site_runs = sorted((path for path in site_dir.iterdir() if path.is_dir()), reverse=True)
+        for number, run_dir in enumerate(site_runs):
+            mtime = run_dir.stat().st_mtime
+            if number >= retention.max_runs_per_site or now - mtime > retention.max_age_days * 86400:
+                shutil.rmtree(run_dir, ignore_errors=True)
+            else:
+                runs.append((mtime, dir_size(run_dir), run_dir))
+    total_size = sum(size for _, size, _ in runs)
+    for _, size, run_dir in sorted(runs):
+        if total_size <= retention.max_total_bytes:
+            break
+        shutil.rmtree(run_dir, ignore_errors=True)
+        total_size -= size
+
+
+class DebugArtifactWriter:
+    def __init__(
+        self, base_path: Path | None, retention: DebugRetention | None = None, queue_size: int = 100,
+        sample_rate: int = 1, failures_only: bool = False,
+    ) -> None:
         self.__base_path = base_path
-        self.__target_dir: str | None = None
+        self.__retention = retention or DebugRetention()
+        self.__queue: asyncio.Queue[DebugArtifact] = asyncio.Queue(queue_size)
+        self.__task: asyncio.Task[None] | None = None
+        self.__runs = itertools.count()
+        self.__sample_rate = max(sample_rate, 1)
+        self.__failures_only = failures_only
+        self.__known_run_dirs: set[Path] = set()
 
-    async def create_dir(self) -> None:
+    def get_saver(self, site: str) -> 'DebugFileSaver':
         if not self.__base_path:
-            return
-        path = os.path.join(self.__base_path, str(uuid.uuid4()))
-        await aiofiles.os.makedirs(path, exist_ok=True)
-        self.__target_dir = os.path.abspath(path)
-        logger.info(f'CML upload debug dir created: {self.__target_dir:}')
+            return DebugFileSaver(self, None)
+        run_dir = self.__base_path / RE_UNSAFE.sub('_', site) / f'{datetime.now(UTC):%Y%m%d_%H%M%S}_{uuid.uuid4()}'
+        return DebugFileSaver(self, run_dir, buffered=self.__failures_only)
+
+    def sampled(self) -> bool:
+        return next(self.__runs) % self.__sample_rate == 0
 
-    async def save_file(self, filename: str, data: bytes | str) -> None:
-        if not self.__target_dir:
+    def submit(self, artifact: DebugArtifact) -> None:
+        if not self.__task:
+            self.__task = asyncio.create_task(self.__run())
+        try:
+            self.__queue.put_nowait(artifact)
+        except asyncio.QueueFull:
+            logger.warning('Debug artifact dropped, queue is full: %s', artifact.filename)
+
+    async def __run(self) -> None:
+        while True:
+            artifact = await self.__queue.get()
+            try:
+                await asyncio.to_thread(self.__write, artifact)
+            except Exception as e:
+                logger.exception(f'Debug file save error: {e}')
+            finally:
+                self.__queue.task_done()
+
+    def __write(self, artifact: DebugArtifact) -> None:
+        new_run = artifact.run_dir not in self.__known_run_dirs
+        if new_run:
+            artifact.run_dir.mkdir(parents=True, exist_ok=True)
+            self.__known_run_dirs.add(artifact.run_dir)
+            logger.info(f'CML upload debug dir created: {artifact.run_dir}')
+        file_path = artifact.run_dir / f'{datetime.now(UTC):%Y%m%d_%H%M%S}_{artifact.filename}.gz'
+        with gzip.open(file_path, 'wb') as file:
+            file.write(artifact.data)
+        if new_run and self.__base_path:
+            enforce_retention(self.__base_path, self.__retention)
+            self.__known_run_dirs = {path for path in self.__known_run_dirs if path.exists()}
+
+    async def close(self, timeout: float = 5) -> None:
+        if not self.__task:
             return
-        now = datetime.now(UTC)
-        file_path = os.path.join(self.__target_dir, f'{now:%Y%m%d_%H%M%S}_{filename}')
+        try:
+            await asyncio.wait_for(self.__queue.join(), timeout)
+        except TimeoutError:
+            logger.warning('Debug artifacts not written: %d', self.__queue.qsize())
+        self.__task.cancel()
+
 
-        if isinstance(data, str):
-            data_bytes = data.encode()
+class DebugFileSaver:
+    def __init__(self, writer: DebugArtifactWriter, run_dir: Path | None, buffered: bool = False) -> None:
+        self.__writer = writer
+        self.__run_dir = run_dir
+        self.__buffered = buffered
+        self.__sampled: bool | None = None
+        self.__buffer: list[DebugArtifact] = []
+
+    def save_file(self, filename: str, data: bytes | str) -> None:
+        if not self.__run_dir:
+            return
+        if self.__sampled is None:
+            self.__sampled = self.__buffered or self.__writer.sampled()
+        if not self.__sampled:
+            return
+        artifact = DebugArtifact(
+            run_dir=self.__run_dir,
+            filename=filename,
+            data=data.encode() if isinstance(data, str) else data,
+        )
+        if self.__buffered:
+            self.__buffer.append(artifact)
         else:
-            data_bytes = data
+            self.__writer.submit(artifact)
 
-        try:
-            async with aiofiles.open(file_path, 'wb') as f:
-                await f.write(data_bytes)
-        except Exception as e:
-            logger.exception(f'Debug file save error: {e}')
+    def save_failure(self, error: BaseException) -> None:
+        if not self.__run_dir:
+            return
+        self.save_file('error.txt', repr(error))
+        for artifact in self.__buffer:
+            self.__writer.submit(artifact)
+        self.__buffer.clear()
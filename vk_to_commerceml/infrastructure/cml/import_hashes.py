@@ -0,0 +1,41 @@
+import hashlib
+import logging
+import re
+from collections.abc import Awaitable
+from typing import cast
+
+from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+IMPORT_HASH_TTL = 7 * 24 * 3600
+HEAD_SIZE = 1024
+CREATION_DATE_RE = re.compile('ДатаФормирования="[^"]*"'.encode())
+
+
+def content_hash(document: bytes) -> str:
+    digest = hashlib.sha256(CREATION_DATE_RE.sub(b'', document[:HEAD_SIZE], count=1))
+    digest.update(document[HEAD_SIZE:])
+    return digest.hexdigest()
+
+
+class CmlImportHashStore:
+    def __init__(self, redis: Redis, ttl: int = IMPORT_HASH_TTL) -> None:
+        self.__redis = redis
+        self.__ttl = ttl
+
+    @staticmethod
+    def __key(url: str, login: str) -> str:
+        return f'cml:imported:{hashlib.sha256(f"{url} {login}".encode()).hexdigest()[:32]}'
+
+    async def get(self, url: str, login: str) -> dict[str, str]:
+        hashes = await cast(Awaitable[dict[bytes, bytes]], self.__redis.hgetall(self.__key(url, login)))
+        return {document.decode(): document_hash.decode() for document, document_hash in hashes.items()}
+
+    async def set(self, url: str, login: str, document: str, document_hash: str) -> None:
+        async with self.__redis.pipeline(transaction=False) as pipeline:
+            pipeline.hset(self.__key(url, login), document, document_hash)
+            pipeline.expire(self.__key(url, login), self.__ttl)
+            await pipeline.execute()
+
+    async def clear(self, url: str, login: str) -> None:
+        await self.__redis.delete(self.__key(url, login))
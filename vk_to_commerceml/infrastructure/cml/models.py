@@ -1,6 +1,7 @@
 from datetime import UTC, datetime
 from decimal import Decimal
 from functools import partial
+from operator import attrgetter
 
 from pydantic import ConfigDict
 from pydantic_xml import BaseXmlModel, attr, element, wrapped
@@ -76,6 +77,17 @@ class ImportDocument(CommercialInformation):
     classifier: CatalogClassifier
     catalog: Catalog
 
+    def canonical(self) -> 'ImportDocument':
+        return self.model_copy(update={
+            'classifier': self.classifier.model_copy(update={
+                'groups': sorted(self.classifier.groups, key=attrgetter('id')),
+                'properties': sorted(self.classifier.properties, key=attrgetter('id')),
+            }),
+            'catalog': self.catalog.model_copy(update={
+                'products': sorted(self.catalog.products, key=attrgetter('id')),
+            }),
+        })
+
 
 class PriceType(CmlBaseModel, tag='ТипЦены'):
     id: str = element(tag='Ид')
@@ -112,3 +124,10 @@ class PackageOfOffers(CmlBaseModel, tag='ПакетПредложений', skip
 
 class OffersDocument(CommercialInformation):
     package_of_offers: PackageOfOffers
+
+    def canonical(self) -> 'OffersDocument':
+        return self.model_copy(update={
+            'package_of_offers': self.package_of_offers.model_copy(update={
+                'offers': sorted(self.package_of_offers.offers, key=attrgetter('id')),
+            }),
+        })
@@ -0,0 +1,29 @@
+import logging
+
+logger = logging.getLogger(__name__)
+PACKAGE_TARGET_DURATION = 30.0
+PACKAGE_MIN_SIZE = 100
+PACKAGE_MAX_SIZE = 50_000
+
+
+class PackageSizer:
+    def __init__(
+        self, size: int, target_duration: float = PACKAGE_TARGET_DURATION,
+        min_size: int = PACKAGE_MIN_SIZE, max_size: int = PACKAGE_MAX_SIZE,
+    ) -> None:
+        self.__target_duration = target_duration
+        self.__min_size = min_size
+        self.__max_size = max_size
+        self.size = min(max(size, min_size), max_size)
+
+    def observe(self, products: int, duration: float) -> None:
+        if not products or duration <= 0:
+            return
+        estimated = products * self.__target_duration / duration
+        size = int(min(max(estimated, self.size / 2, self.__min_size), self.size * 2, self.__max_size))
+        if size != self.size:
+            logger.info(
+                'CommerceML: package of %d products imported in %.1fs, package size %d -> %d',
+                products, duration, self.size, size,
+            )
+        self.size = size
@@ -0,0 +1,125 @@
+import hashlib
+import logging
+import math
+from typing import NamedTuple
+
+from pydantic import BaseModel
+from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+EWMA_ALPHA = 0.3
+CHUNK_TARGET_DURATION = 10.0
+CHUNK_ALIGN = 64 * 1024
+MIN_BANDWIDTH_SAMPLE = 256 * 1024
+METRICS_TTL = 30 * 24 * 3600
+# deflate level: (compression ratio of CommerceML XML, compression throughput in bytes per second)
+DEFLATE_LEVELS: dict[int, tuple[float, float]] = {
+    1: (0.2, 60_000_000),
+    6: (0.14, 20_000_000),
+    9: (0.13, 6_000_000),
+}
+
+
+def ewma(current: float | None, sample: float) -> float:
+    return sample if current is None else current + EWMA_ALPHA * (sample - current)
+
+
+class SiteMetrics(BaseModel):
+    bandwidth: float | None = None
+    chunk_latency: float | None = None
+    import_speed: float | None = None
+    chunks: int = 0
+    imports: int = 0
+
+    def observe_latency(self, duration: float) -> None:
+        self.chunk_latency = ewma(self.chunk_latency, duration)
+
+    def observe_chunk(self, size: int, duration: float) -> None:
+        if duration <= 0:
+            return
+        self.chunks += 1
+        latency = self.chunk_latency or 0
+        if self.bandwidth:
+            self.observe_latency(max(duration - size / self.bandwidth, 0))
+        if size >= MIN_BANDWIDTH_SAMPLE:
+            self.bandwidth = ewma(self.bandwidth, size / max(duration - latency, duration / 2))
+
+    def observe_import(self, size: int, duration: float) -> None:
+        if duration <= 0:
+            return
+        self.imports += 1
+        self.import_speed = ewma(self.import_speed, size / duration)
+
+
+class TransferStrategy(NamedTuple):
+    use_zip: bool
+    compress_level: int | None
+    chunk_size: int | None
+    reason: str
+
+
+def choose_chunk_size(bandwidth: float | None, file_limit: int | None) -> int | None:
+    if not file_limit or not bandwidth:
+        return file_limit
+    size = int(bandwidth * CHUNK_TARGET_DURATION) // CHUNK_ALIGN * CHUNK_ALIGN
+    return min(max(size, CHUNK_ALIGN), file_limit)
+
+
+def choose_strategy(
+    metrics: SiteMetrics | None, zip_yes: bool, file_limit: int | None,
+    xml_bytes: int, photo_bytes: int, photo_count: int, concurrency: int,
+) -> TransferStrategy:
+    if not zip_yes:
+        chunk_size = choose_chunk_size(metrics.bandwidth if metrics else None, file_limit)
+        return TransferStrategy(False, None, chunk_size, 'site does not accept zip')
+    if not metrics or not metrics.bandwidth or metrics.chunk_latency is None:
+        return TransferStrategy(True, None, file_limit, 'no measurements yet')
+    bandwidth, latency = metrics.bandwidth, metrics.chunk_latency
+    chunk_size = choose_chunk_size(bandwidth, file_limit)
+
+    compress_level: int | None = None
+    compress_time, compressed_xml_bytes = 0.0, float(xml_bytes)
+    best_time = xml_bytes / bandwidth
+    for level, (ratio, throughput) in DEFLATE_LEVELS.items():
+        level_time = xml_bytes / throughput + xml_bytes * ratio / bandwidth
+        if level_time < best_time:
+            compress_level, best_time = level, level_time
+            compress_time, compressed_xml_bytes = xml_bytes / throughput, xml_bytes * ratio
+
+    def chunks(size: float) -> int:
+        return max(math.ceil(size / chunk_size), 1) if chunk_size else 1
+
+    zip_bytes = compressed_xml_bytes + photo_bytes
+    zip_time = compress_time + chunks(zip_bytes) * latency + zip_bytes / bandwidth
+    files_time = (
+        2 * chunks(xml_bytes / 2) * latency
+        + math.ceil(photo_count / max(concurrency, 1)) * chunks(photo_bytes / max(photo_count, 1)) * latency
+        + (xml_bytes + photo_bytes) / bandwidth
+    )
+    use_zip = zip_time <= files_time
+    reason = (
+        f'bandwidth {bandwidth / 1024:.0f} KiB/s, latency {latency * 1000:.0f} ms, '
+        f'zip ~{zip_time:.1f}s (deflate level {compress_level}) vs per-file ~{files_time:.1f}s'
+    )
+    if metrics.import_speed:
+        reason += f', import ~{xml_bytes / metrics.import_speed:.1f}s'
+    return TransferStrategy(use_zip, compress_level if use_zip else None, chunk_size, reason)
+
+
+class CmlMetricsStore:
+    def __init__(self, redis: Redis, ttl: int = METRICS_TTL) -> None:
+        self.__redis = redis
+        self.__ttl = ttl
+
+    @staticmethod
+    def __key(url: str) -> str:
+        return f'cml:metrics:{hashlib.sha256(url.encode()).hexdigest()[:32]}'
+
+    async def get(self, url: str) -> SiteMetrics | None:
+        data = await self.__redis.get(self.__key(url))
+        if data is None:
+            return None
+        return SiteMetrics.model_validate_json(data)
+
+    async def set(self, url: str, metrics: SiteMetrics) -> None:
+        await self.__redis.set(self.__key(url), metrics.model_dump_json(), ex=self.__ttl)
@@ -0,0 +1,28 @@
+import asyncio
+import time
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.__rate = rate
+        self.__burst = burst
+        self.__tokens = float(burst)
+        self.__updated_at = time.monotonic()
+        self.__lock = asyncio.Lock()
+
+    def __refill(self) -> None:
+        now = time.monotonic()
+        self.__tokens = min(self.__burst, self.__tokens + (now - self.__updated_at) * self.__rate)
+        self.__updated_at = now
+
+    def try_acquire(self) -> bool:
+        self.__refill()
+        if self.__tokens >= 1:
+            self.__tokens -= 1
+            return True
+        return False
+
+    async def acquire(self) -> None:
+        async with self.__lock:
+            while not self.try_acquire():
+                await asyncio.sleep((1 - self.__tokens) / self.__rate)
@@ -1,13 +1,53 @@
-from cryptography.fernet import Fernet
+import hashlib
+import time
+from collections import OrderedDict
+
+from cryptography.fernet import Fernet, MultiFernet
 from pydantic import SecretStr
 
+CACHE_TTL = 300
+CACHE_SIZE = 1024
+
 
 class Secrets:
-    def __init__(self, encryption_key: bytes) -> None:
-        self.__fernet = Fernet(encryption_key)
+    def __init__(
+        self, encryption_key: bytes, old_encryption_keys: list[bytes] | None = None,
+        cache_ttl: float = CACHE_TTL, cache_size: int = CACHE_SIZE,
+    ) -> None:
+        self.__fernet = MultiFernet([Fernet(key) for key in [encryption_key, *(old_encryption_keys or [])]])
+        self.__cache_ttl = cache_ttl
+        self.__cache_size = cache_size
+        self.__cache: OrderedDict[bytes, tuple[float, SecretStr]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def __key(token: str) -> bytes:
+        return hashlib.blake2b(token.encode('latin-1'), digest_size=16).digest()
 
     def encrypt(self, secret: SecretStr) -> str:
         return self.__fernet.encrypt(secret.get_secret_value().encode('utf-8')).decode('latin-1')
 
     def decrypt(self, token: str) -> SecretStr:
-        return SecretStr(self.__fernet.decrypt(token.encode('latin-1')).decode('utf-8'))
+        key = self.__key(token)
+        now = time.monotonic()
+        if (cached := self.__cache.get(key)) and now - cached[0] < self.__cache_ttl:
+            self.__cache.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        secret = SecretStr(self.__fernet.decrypt(token.encode('latin-1')).decode('utf-8'))
+        if self.__cache_size:
+            self.__cache[key] = now, secret
+            self.__cache.move_to_end(key)
+            while len(self.__cache) > self.__cache_size:
+                self.__cache.popitem(last=False)
+        return secret
+
+    def forget(self, *tokens: str | None) -> None:
+        for token in tokens:
+            if token:
+                self.__cache.pop(self.__key(token), None)
+
+    def clear(self) -> None:
+        self.__cache.clear()
@@ -0,0 +1,97 @@
+import logging
+import math
+from collections import Counter, defaultdict
+from collections.abc import Awaitable
+from datetime import UTC, datetime, timedelta
+from typing import cast
+
+from pydantic import BaseModel, Field
+from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+HISTORY_KEY = 'sync:history'
+HISTORY_SIZE = 5000
+HISTORY_MAX_AGE_DAYS = 30
+
+
+class SyncRun(BaseModel):
+    started_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
+    vk_group_id: int
+    cml_host: str
+    mode: str
+    items: int = 0
+    photos: int = 0
+    uploaded_bytes: int = 0
+    retries: int = 0
+    outcome: str = 'success'
+    duration: float = 0
+    phases: dict[str, float] = {}
+
+
+class DurationStats(BaseModel):
+    count: int
+    p50: float
+    p95: float
+    max: float
+
+
+class SyncStats(BaseModel):
+    runs: int = 0
+    outcomes: dict[str, int] = {}
+    phases: dict[str, DurationStats] = {}
+    sites: dict[str, dict[str, DurationStats]] = {}
+
+
+def percentile(values: list[float], rank: float) -> float:
+    return values[max(math.ceil(len(values) * rank) - 1, 0)]
+
+
+def duration_stats(values: list[float]) -> DurationStats:
+    values = sorted(values)
+    return DurationStats(count=len(values), p50=percentile(values, 0.5), p95=percentile(values, 0.95), max=values[-1])
+
+
+def summarize(runs: list[SyncRun]) -> SyncStats:
+    phases: defaultdict[str, list[float]] = defaultdict(list)
+    sites: defaultdict[str, defaultdict[str, list[float]]] = defaultdict(lambda: defaultdict(list))
+    for run in runs:
+        for phase, duration in {**run.phases, 'total': run.duration}.items():
+            phases[phase].append(duration)
+            sites[run.cml_host][phase].append(duration)
+    return SyncStats(
+        runs=len(runs),
+        outcomes=dict(Counter(run.outcome for run in runs)),
+        phases={phase: duration_stats(values) for phase, values in phases.items()},
+        sites={
+            site: {phase: duration_stats(values) for phase, values in site_phases.items()}
+            for site, site_phases in sites.items()
+        },
+    )
+
+
+class SyncHistory:
+    def __init__(self, redis: Redis, size: int = HISTORY_SIZE, max_age_days: float = HISTORY_MAX_AGE_DAYS) -> None:
+        self.__redis = redis
+        self.__size = size
+        self.__max_age = timedelta(days=max_age_days)
+
+    async def record(self, run: SyncRun) -> None:
+        async with self.__redis.pipeline(transaction=False) as pipeline:
+            pipeline.lpush(HISTORY_KEY, run.model_dump_json())
+            pipeline.ltrim(HISTORY_KEY, 0, self.__size - 1)
+            pipeline.expire(HISTORY_KEY, self.__max_age)
+            await pipeline.execute()
+
+    async def runs(self, vk_group_id: int | None = None) -> list[SyncRun]:
+        min_started_at = datetime.now(UTC) - self.__max_age
+        runs: list[SyncRun] = []
+        for data in await cast(Awaitable[list[bytes]], self.__redis.lrange(HISTORY_KEY, 0, -1)):
+            run = SyncRun.model_validate_json(data)
+            if run.started_at < min_started_at:
+                break
+            if vk_group_id is None or run.vk_group_id == vk_group_id:
+                runs.append(run)
+        return runs
+
+    async def stats(self, vk_group_id: int | None = None) -> SyncStats:
+        return summarize(await self.runs(vk_group_id))
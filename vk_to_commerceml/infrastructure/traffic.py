@@ -0,0 +1,205 @@
+import gzip
+import json
+import logging
+import time
+from contextvars import ContextVar, Token
+from datetime import UTC, datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+from aiohttp import ClientSession, TraceConfig, tracing
+from pydantic import BaseModel, Field
+from yarl import URL
+
+logger = logging.getLogger(__name__)
+SECRET_PARAMS = frozenset({'access_token', 'client_secret', 'code', 'sessid', 'password'})
+SECRET_KEYS = frozenset({'access_token', 'client_secret'})
+TEXT_KEYS = frozenset({'title', 'description', 'name', 'sku', 'first_name', 'last_name'})
+TEXT_CONTENT_TYPES = ('json', 'text', 'xml')
+
+current_recorder: ContextVar['TrafficRecorder | None'] = ContextVar('current_recorder', default=None)
+
+
+class TrafficExchange(BaseModel):
+    service: str
+    method: str
+    url: str
+    status: int
+    content_type: str = ''
+    offset: float
+    duration: float
+    request_bytes: int = 0
+    response_bytes: int = 0
+    body: str | None = None
+
+
+class TrafficFixture(BaseModel):
+    created_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
+    anonymized: bool = False
+    tags: dict[str, Any] = {}
+    exchanges: list[TrafficExchange] = []
+
+
+def scramble(text: str) -> str:
+    chars = []
+    for char in text:
+        if not char.isalpha():
+            chars.append(char)
+        elif 'а' <= char.lower() <= 'я' or char.lower() == 'ё':
+            chars.append('О' if char.isupper() else 'о')
+        else:
+            chars.append('X' if char.isupper() else 'x')
+    return ''.join(chars)
+
+
+class Anonymizer:
+    def __init__(self, enabled: bool = True) -> None:
+        self.__enabled = enabled
+        self.__hosts: dict[str, str] = {}
+
+    def url(self, url: str) -> str:
+        parsed = URL(url).without_query_params(*SECRET_PARAMS)
+        if self.__enabled and parsed.host:
+            parsed = parsed.with_host(self.__hosts.setdefault(parsed.host, f'host{len(self.__hosts) + 1}.invalid'))
+        return str(parsed)
+
+    def json(self, value: Any, key: str | None = None) -> Any:
+        if isinstance(value, dict):
+            return {
+                item_key: '' if item_key in SECRET_KEYS else self.json(item_value, item_key)
+                for item_key, item_value in value.items()
+            }
+        if isinstance(value, list):
+            return [self.json(item, key) for item in value]
+        if isinstance(value, str) and self.__enabled:
+            if key == 'url':
+                return self.url(value)
+            if key in TEXT_KEYS:
+                return scramble(value)
+        return value
+
+    def body(self, service: str, url: str, content_type: str, body: str) -> str:
+        if 'json' in content_type:
+            try:
+                return json.dumps(self.json(json.loads(body)), ensure_ascii=False)
+            except ValueError:
+                return body
+        if service == 'cml' and URL(url).query.get('mode') == 'checkauth' and body.startswith('success'):
+            lines = body.splitlines()
+            if len(lines) > 2:
+                lines[2] = 'replay'
+            if len(lines) > 3:
+                lines[3] = 'sessid=replay'
+            return '\n'.join(lines) + '\n'
+        return body
+
+
+class TrafficRecorder:
+    def __init__(self, anonymize: bool = True) -> None:
+        self.__anonymize = anonymize
+        self.__started_at = time.perf_counter()
+        self.__exchanges: list[tuple[TrafficExchange, list[bytes] | None]] = []
+        self.__streamed: dict[str, TrafficExchange] = {}
+
+    def activate(self) -> Token['TrafficRecorder | None']:
+        return current_recorder.set(self)
+
+    @staticmethod
+    def deactivate(token: Token['TrafficRecorder | None']) -> None:
+        current_recorder.reset(token)
+
+    def add(self, exchange: TrafficExchange, chunks: list[bytes] | None) -> None:
+        exchange.offset -= self.__started_at
+        self.__exchanges.append((exchange, chunks))
+        if chunks is None:
+            self.__streamed[exchange.url] = exchange
+
+    def count_streamed(self, url: str, size: int) -> None:
+        if exchange := self.__streamed.get(url):
+            exchange.response_bytes += size
+
+    def fixture(self, tags: dict[str, Any] | None = None) -> TrafficFixture:
+        anonymizer = Anonymizer(self.__anonymize)
+        exchanges: list[TrafficExchange] = []
+        for exchange, chunks in self.__exchanges:
+            body = b''.join(chunks or [])
+            exchanges.append(exchange.model_copy(update={
+                'url': anonymizer.url(exchange.url),
+                'response_bytes': len(body) if chunks else exchange.response_bytes,
+                'body': anonymizer.body(
+                    exchange.service, exchange.url, exchange.content_type, body.decode('utf-8', 'replace')
+                ) if chunks else None,
+            }))
+        if self.__anonymize:
+            tags = {key: value for key, value in (tags or {}).items() if key not in {'chat_id', 'site'}}
+        return TrafficFixture(anonymized=self.__anonymize, tags=tags or {}, exchanges=exchanges)
+
+    def save(self, path: Path, tags: dict[str, Any] | None = None) -> None:
+        fixture = self.fixture(tags)
+        with gzip.open(path, 'wt', encoding='utf-8') as file:
+            file.write(fixture.model_dump_json())
+        logger.info('Traffic fixture saved: %s, %d exchanges', path, len(fixture.exchanges))
+
+
+def count_streamed_bytes(url: URL, size: int) -> None:
+    if recorder := current_recorder.get():
+        recorder.count_streamed(str(url), size)
+
+
+def load_fixture(path: Path) -> TrafficFixture:
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        return TrafficFixture.model_validate_json(file.read())
+
+
+def traffic_trace_config(service: str) -> TraceConfig:
+    async def on_request_start(
+        session: ClientSession, context: SimpleNamespace, params: tracing.TraceRequestStartParams
+    ) -> None:
+        context.recorder = current_recorder.get()
+        context.started_at = time.perf_counter()
+        context.request_bytes = 0
+        context.exchange = None
+
+    async def on_request_chunk_sent(
+        session: ClientSession, context: SimpleNamespace, params: tracing.TraceRequestChunkSentParams
+    ) -> None:
+        if context.recorder:
+            context.request_bytes += len(params.chunk)
+
+    async def on_request_end(
+        session: ClientSession, context: SimpleNamespace, params: tracing.TraceRequestEndParams
+    ) -> None:
+        recorder: TrafficRecorder | None = context.recorder
+        if not recorder:
+            return
+        content_type = params.response.content_type
+        context.exchange = TrafficExchange(
+            service=service,
+            method=params.method,
+            url=str(params.url),
+            status=params.response.status,
+            content_type=content_type,
+            offset=context.started_at,
+            duration=time.perf_counter() - context.started_at,
+            request_bytes=context.request_bytes,
+        )
+        context.chunks = [] if any(text_type in content_type for text_type in TEXT_CONTENT_TYPES) else None
+        recorder.add(context.exchange, context.chunks)
+
+    async def on_response_chunk_received(
+        session: ClientSession, context: SimpleNamespace, params: tracing.TraceResponseChunkReceivedParams
+    ) -> None:
+        if not context.exchange:
+            return
+        if context.chunks is None:
+            context.exchange.response_bytes += len(params.chunk)
+        else:
+            context.chunks.append(params.chunk)
+
+    trace_config = TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_chunk_sent.append(on_request_chunk_sent)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_response_chunk_received.append(on_response_chunk_received)
+    return trace_config
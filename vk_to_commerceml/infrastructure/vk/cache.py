@@ -0,0 +1,100 @@
+import hashlib
+import logging
+import zlib
+from collections.abc import Awaitable
+from datetime import UTC, datetime
+from typing import cast
+
+from pydantic import SecretStr, TypeAdapter, ValidationError
+from redis.asyncio import Redis
+
+from vk_to_commerceml.infrastructure.vk.models import GroupItem, MarketItem, MarketSignature, MarketSnapshot
+
+logger = logging.getLogger(__name__)
+GROUPS_ADAPTER = TypeAdapter(list[GroupItem])
+
+
+def token_key(access_token: SecretStr) -> str:
+    return hashlib.sha256(access_token.get_secret_value().encode()).hexdigest()[:32]
+
+
+def target_key(target: str) -> str:
+    return hashlib.sha256(target.encode()).hexdigest()[:32]
+
+
+class VkCache:
+    def __init__(
+        self, redis: Redis, groups_ttl: int = 300, market_ttl: int = 3600, signature_ttl: int = 86400
+    ) -> None:
+        self.__redis = redis
+        self.__groups_ttl = groups_ttl
+        self.__market_ttl = market_ttl
+        self.__signature_ttl = signature_ttl
+
+    @staticmethod
+    def __groups_key(access_token: SecretStr) -> str:
+        return f'vk:groups:{token_key(access_token)}'
+
+    @staticmethod
+    def __market_key(owner_id: int, access_token: SecretStr, with_disabled: bool) -> str:
+        return f'vk:market:{owner_id}:{token_key(access_token)}:{int(with_disabled)}'
+
+    @staticmethod
+    def __signature_key(owner_id: int) -> str:
+        return f'vk:signature:{owner_id}'
+
+    async def get_groups(self, access_token: SecretStr) -> list[GroupItem] | None:
+        data = await self.__redis.get(self.__groups_key(access_token))
+        if data is None:
+            return None
+        return GROUPS_ADAPTER.validate_json(data)
+
+    async def set_groups(self, access_token: SecretStr, groups: list[GroupItem]) -> None:
+        await self.__redis.set(self.__groups_key(access_token), GROUPS_ADAPTER.dump_json(groups), ex=self.__groups_ttl)
+
+    async def invalidate_groups(self, access_token: SecretStr) -> None:
+        await self.__redis.delete(self.__groups_key(access_token))
+
+    async def get_market(
+        self, owner_id: int, access_token: SecretStr, with_disabled: bool, max_age: float
+    ) -> list[MarketItem] | None:
+        data = await self.__redis.get(self.__market_key(owner_id, access_token, with_disabled))
+        if data is None:
+            return None
+        try:
+            snapshot = MarketSnapshot.model_validate_json(zlib.decompress(data))
+        except ValidationError as exc:
+            logger.warning('Market snapshot is outdated: owner_id=%d, %s', owner_id, exc)
+            return None
+        age = (datetime.now(UTC) - snapshot.created_at).total_seconds()
+        if age > max_age:
+            return None
+        logger.info('Market snapshot reused: owner_id=%d, age=%.0fs, items=%d', owner_id, age, len(snapshot.items))
+        return snapshot.items
+
+    async def set_market(
+        self, owner_id: int, access_token: SecretStr, with_disabled: bool, items: list[MarketItem]
+    ) -> None:
+        snapshot = MarketSnapshot(created_at=datetime.now(UTC), items=items)
+        await self.__redis.set(
+            self.__market_key(owner_id, access_token, with_disabled),
+            zlib.compress(snapshot.model_dump_json().encode()),
+            ex=self.__market_ttl,
+        )
+
+    async def invalidate_market(self, owner_id: int) -> None:
+        keys = [key async for key in self.__redis.scan_iter(match=f'vk:market:{owner_id}:*')]
+        await self.__redis.delete(*keys, self.__signature_key(owner_id))
+
+    async def get_signature(self, owner_id: int, target: str) -> MarketSignature | None:
+        key = self.__signature_key(owner_id)
+        data = await cast(Awaitable[bytes | None], self.__redis.hget(key, target_key(target)))
+        if data is None:
+            return None
+        return MarketSignature.model_validate_json(data)
+
+    async def set_signature(self, owner_id: int, target: str, signature: MarketSignature) -> None:
+        async with self.__redis.pipeline(transaction=False) as pipeline:
+            pipeline.hset(self.__signature_key(owner_id), target_key(target), signature.model_dump_json())
+            pipeline.expire(self.__signature_key(owner_id), self.__signature_ttl)
+            await pipeline.execute()
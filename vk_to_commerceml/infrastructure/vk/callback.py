@@ -0,0 +1,71 @@
+import hmac
+import json
+import logging
+from collections.abc import Awaitable
+from secrets import token_urlsafe
+from typing import Any, cast
+
+from pydantic import BaseModel
+from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+ITEM_EVENT_PREFIX = 'market_item_'
+
+
+class CallbackEvent(BaseModel):
+    type: str
+    group_id: int
+    event_id: str = ''
+    secret: str | None = None
+    object: dict[str, Any] = {}
+
+    @property
+    def item_id(self) -> int | None:
+        if not self.type.startswith(ITEM_EVENT_PREFIX):
+            return None
+        item_id = self.object.get('item_id', self.object.get('id'))
+        return int(item_id) if item_id is not None else None
+
+
+class CallbackGroup(BaseModel):
+    confirmation: str
+    secret: str
+
+    def check_secret(self, secret: str | None) -> bool:
+        return secret is not None and hmac.compare_digest(secret, self.secret)
+
+
+class VkCallbackRegistry:
+    def __init__(self, redis: Redis) -> None:
+        self.__redis = redis
+
+    @staticmethod
+    def __group_key(group_id: int) -> str:
+        return f'vk:callback:group:{group_id}'
+
+    @staticmethod
+    def __chats_key(group_id: int) -> str:
+        return f'vk:callback:chats:{group_id}'
+
+    async def get_group(self, group_id: int) -> CallbackGroup | None:
+        data = await self.__redis.get(self.__group_key(group_id))
+        if data is None:
+            return None
+        return CallbackGroup.model_validate_json(data)
+
+    async def subscribe(self, group_id: int, confirmation: str, chat: dict[str, Any]) -> CallbackGroup:
+        group = await self.get_group(group_id)
+        if group:
+            group.confirmation = confirmation
+        else:
+            group = CallbackGroup(confirmation=confirmation, secret=token_urlsafe(24))
+        await self.__redis.set(self.__group_key(group_id), group.model_dump_json())
+        await cast(Awaitable[int], self.__redis.sadd(self.__chats_key(group_id), json.dumps(chat, sort_keys=True)))
+        return group
+
+    async def unsubscribe(self, group_id: int, chat: dict[str, Any]) -> None:
+        await cast(Awaitable[int], self.__redis.srem(self.__chats_key(group_id), json.dumps(chat, sort_keys=True)))
+
+    async def chats(self, group_id: int) -> list[dict[str, Any]]:
+        members = await cast(Awaitable[set[bytes]], self.__redis.smembers(self.__chats_key(group_id)))
+        return [json.loads(member) for member in members]
@@ -1,44 +1,111 @@
 import asyncio
 import contextlib
+import hashlib
+import itertools
+import json
 import logging
-import os.path
+import uuid
 from asyncio import Task
-from operator import attrgetter
+from collections.abc import Iterable
+from pathlib import Path
 from types import SimpleNamespace
 from typing import Any, TypeVar
 
 import aiofiles
 import aiofiles.os
-from aiohttp import ClientSession, DummyCookieJar, TraceConfig, hdrs, tracing
+from aiohttp import ClientSession, DummyCookieJar, TCPConnector, TraceConfig, hdrs, tracing
 from aiohttp.client_reqrep import json_re
 from pydantic import SecretStr, ValidationError
 from yarl import URL
 
+from vk_to_commerceml.infrastructure.rate_limiter import RateLimiter
+from vk_to_commerceml.infrastructure.traffic import count_streamed_bytes, traffic_trace_config
+from vk_to_commerceml.infrastructure.vk.cache import VkCache, token_key
 from vk_to_commerceml.infrastructure.vk.models import (
     ErrorResponse,
+    ExecuteRoot,
     GroupItem,
     GroupsGetRoot,
     MarketEditRoot,
+    MarketGetResponse,
     MarketGetRoot,
     MarketItem,
+    MarketSignature,
     Photo,
+    PhotoSize,
     VkBaseModel,
 )
+from vk_to_commerceml.infrastructure.vk.pool_stats import PoolStats
 
 logger = logging.getLogger(__name__)
 OAUTH_URL = URL('https://oauth.vk.com/authorize')
 VK_URL = URL('https://api.vk.com/method')
 T_VkBaseModel = TypeVar('T_VkBaseModel', bound=VkBaseModel)
+KEEPALIVE_TIMEOUT = 60
+DNS_CACHE_TTL = 300
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+GET_BY_ID_BATCH_SIZE = 100
+MARKET_PAGE_SIZE = 100
+EXECUTE_MAX_CALLS = 25
+EXECUTE_CODE_LIMIT = 60_000
+
+
+def select_photo_size(sizes: list[PhotoSize], max_width: int | None = None) -> PhotoSize | None:
+    best: PhotoSize | None = None
+    for size in sizes:
+        if best is None:
+            best = size
+        elif max_width and best.width > max_width:
+            if size.width < best.width:
+                best = size
+        elif (not max_width or size.width <= max_width) and size.width > best.width:
+            best = size
+    return best
+
+
+def market_signature(count: int, first_page: list[MarketItem]) -> MarketSignature:
+    digest = hashlib.sha256()
+    for item in first_page:
+        digest.update(item.model_dump_json(exclude={'photos', 'videos'}).encode())
+        digest.update(' '.join(str(photo.id) for photo in item.photos).encode())
+        digest.update(' '.join(str(video.id) for video in item.videos).encode())
+    return MarketSignature(
+        count=count,
+        max_date=max((item.date for item in first_page if item.date), default=None),
+        fingerprint=digest.hexdigest()[:32],
+    )
+
+
+def market_edit_call(owner_id: int, item_id: int, description: str) -> str:
+    return 'API.market.edit(' + json.dumps(
+        {'owner_id': owner_id, 'item_id': item_id, 'description': description}, ensure_ascii=False
+    ) + ')'
+
+
+def execute_code(calls: list[str]) -> str:
+    return f'return [{", ".join(calls)}];'
 
 
 class VkClientSession:
-    def __init__(self, session: ClientSession, access_token: SecretStr, tmp_dir: str) -> None:
+    def __init__(
+        self, session: ClientSession, cdn_session: ClientSession, access_token: SecretStr, tmp_dir: str,
+        download_semaphore: asyncio.Semaphore, cdn_stats: PoolStats, cache: VkCache | None = None,
+        rate_limiter: RateLimiter | None = None, api_url: URL = VK_URL
+    ) -> None:
         self.__session = session
+        self.__cdn_session = cdn_session
         self.__access_token = access_token
         self.__tmp_dir = tmp_dir
+        self.__download_semaphore = download_semaphore
+        self.__cdn_stats = cdn_stats
+        self.__cache = cache
+        self.__rate_limiter = rate_limiter
+        self.__api_url = api_url
 
     async def __request(self, response_model: type[T_VkBaseModel], method: str, url: str | URL,
                         **kwargs: Any) -> T_VkBaseModel:
+        if self.__rate_limiter:
+            await self.__rate_limiter.acquire()
         async with self.__session.request(method, url, **kwargs) as response:
             response.raise_for_status()
             content_type = response.content_type
@@ -52,8 +119,14 @@ class VkClientSession:
                 pass
             return response_model.model_validate_json(data)
 
-    async def get_groups(self) -> list[GroupItem]:
-        url = VK_URL / 'groups.get'
+    async def invalidate_cache(self) -> None:
+        if self.__cache:
+            await self.__cache.invalidate_groups(self.__access_token)
+
+    async def get_groups(self, use_cache: bool = True) -> list[GroupItem]:
+        if use_cache and self.__cache and (groups := await self.__cache.get_groups(self.__access_token)) is not None:
+            return groups
+        url = self.__api_url / 'groups.get'
         params: dict[str, str] = {
             'access_token': self.__access_token.get_secret_value(),
             'extended': '1',
@@ -63,51 +136,79 @@ class VkClientSession:
         root = await self.__request(
             GroupsGetRoot, hdrs.METH_GET, url, params=params
         )
+        if self.__cache:
+            await self.__cache.set_groups(self.__access_token, root.response.items)
         return root.response.items
 
-    async def get_market(self, owner_id: int, with_disabled: bool) -> list[MarketItem]:
-        url = VK_URL / 'market.get'
-        page_size = 100
-        common_params: dict[str, str] = {
+    async def __get_market_page(self, owner_id: int, with_disabled: bool, page_number: int) -> MarketGetResponse:
+        params: dict[str, str] = {
             'access_token': self.__access_token.get_secret_value(),
             'owner_id': str(owner_id),
-            'count': str(page_size),
+            'count': str(MARKET_PAGE_SIZE),
+            'offset': str(MARKET_PAGE_SIZE * page_number),
             'extended': '1',
             'need_variants': '0',
             'with_disabled': str(int(with_disabled)),
             'v': '5.199',
         }
+        root = await self.__request(MarketGetRoot, hdrs.METH_GET, self.__api_url / 'market.get', params=params)
+        return root.response
 
-        async def get_page() -> list[MarketItem]:
-            root = await self.__request(
-                MarketGetRoot, hdrs.METH_GET, url, params=common_params | {'offset': str(page_size * page_number)}
-            )
-            return root.response.items
+    async def probe_market(self, owner_id: int, with_disabled: bool) -> tuple[MarketSignature, list[MarketItem]]:
+        response = await self.__get_market_page(owner_id, with_disabled, 0)
+        return market_signature(response.count, response.items), response.items
+
+    async def get_market(
+        self, owner_id: int, with_disabled: bool, max_age: float | None = None,
+        first_page: list[MarketItem] | None = None,
+    ) -> list[MarketItem]:
+        if max_age and self.__cache and (
+            market := await self.__cache.get_market(owner_id, self.__access_token, with_disabled, max_age)
+        ):
+            return market
         result: list[MarketItem] = []
         page_number = 0
-        while page := await get_page():
+        if (page := first_page) is None:
+            page = (await self.__get_market_page(owner_id, with_disabled, page_number)).items
+        while page:
             result += page
-            if len(page) < page_size:
+            if len(page) < MARKET_PAGE_SIZE:
                 break
             page_number += 1
+            page = (await self.__get_market_page(owner_id, with_disabled, page_number)).items
+        if self.__cache:
+            await self.__cache.set_market(owner_id, self.__access_token, with_disabled, result)
         return result
 
+    async def get_synced_signature(self, owner_id: int, target: str) -> MarketSignature | None:
+        return await self.__cache.get_signature(owner_id, target) if self.__cache else None
+
+    async def set_synced_signature(self, owner_id: int, target: str, signature: MarketSignature) -> None:
+        if self.__cache:
+            await self.__cache.set_signature(owner_id, target, signature)
+
     async def get_market_product_by_id(self, owner_id: int, item_id: int) -> MarketItem | None:
-        url = VK_URL / 'market.getById'
-        params: dict[str, str] = {
-            'access_token': self.__access_token.get_secret_value(),
-            'item_ids': f'{owner_id}_{item_id}',
-            'extended': '1',
-            'v': '5.199',
-        }
+        items = await self.get_market_products_by_ids(owner_id, [item_id])
+        return items[0] if items else None
 
-        root = await self.__request(
-            MarketGetRoot, hdrs.METH_GET, url, params=params
-        )
-        return root.response.items[0] if root.response.items else None
+    async def get_market_products_by_ids(self, owner_id: int, item_ids: Iterable[int]) -> list[MarketItem]:
+        url = self.__api_url / 'market.getById'
+        result: list[MarketItem] = []
+        for batch in itertools.batched(item_ids, GET_BY_ID_BATCH_SIZE):
+            params: dict[str, str] = {
+                'access_token': self.__access_token.get_secret_value(),
+                'item_ids': ','.join(f'{owner_id}_{item_id}' for item_id in batch),
+                'extended': '1',
+                'v': '5.199',
+            }
+            root = await self.__request(
+                MarketGetRoot, hdrs.METH_GET, url, params=params
+            )
+            result += root.response.items
+        return result
 
     async def edit_market_item(self, owner_id: int, item_id: int, description: str) -> bool:
-        url = VK_URL / 'market.edit'
+        url = self.__api_url / 'market.edit'
         data: dict[str, str] = {
             'access_token': self.__access_token.get_secret_value(),
             'owner_id': str(owner_id),
@@ -119,28 +220,59 @@ class VkClientSession:
         root = await self.__request(
             MarketEditRoot, hdrs.METH_POST, url, data=data
         )
+        if self.__cache:
+            await self.__cache.invalidate_market(owner_id)
         return bool(root.response)
 
-    async def download_photos(self, photos: list[Photo], max_width: int | None = None) -> dict[str, bytes]:
-        async def download_single(name: str, url: str) -> tuple[str, bytes]:
-            cache_path = os.path.join(self.__tmp_dir, name)
+    async def edit_market_items(self, owner_id: int, descriptions: dict[int, str]) -> dict[int, str | None]:
+        url = self.__api_url / 'execute'
+        calls = [
+            market_edit_call(owner_id, item_id, description) for item_id, description in descriptions.items()
+        ]
+        data: dict[str, str] = {
+            'access_token': self.__access_token.get_secret_value(),
+            'code': execute_code(calls),
+            'v': '5.199',
+        }
+
+        root = await self.__request(
+            ExecuteRoot, hdrs.METH_POST, url, data=data
+        )
+        if self.__cache:
+            await self.__cache.invalidate_market(owner_id)
+        errors = iter(root.execute_errors)
+        result: dict[int, str | None] = {}
+        for item_id, response in zip(descriptions, root.response, strict=True):
+            if response:
+                result[item_id] = None
+            else:
+                error = next(errors, {})
+                result[item_id] = str(error.get('error_msg', 'market.edit failed'))
+        return result
+
+    async def download_photos(self, photos: list[Photo], max_width: int | None = None) -> dict[str, Path]:
+        async def download_single(name: str, url: str) -> tuple[str, Path]:
+            cache_path = Path(self.__tmp_dir, name)
             if await aiofiles.os.path.exists(cache_path):
-                async with aiofiles.open(cache_path, 'rb') as cache_file:
-                    return name, await cache_file.read()
-            async with self.__session.get(url) as response:
+                return name, cache_path
+            part_path = cache_path.with_name(f'{name}.{uuid.uuid4().hex}.part')
+            async with self.__cdn_stats.acquire(self.__download_semaphore), self.__cdn_session.get(url) as response:
                 response.raise_for_status()
-                data = await response.read()
-                async with aiofiles.open(cache_path, 'wb') as cache_file:
-                    await cache_file.write(data)
-                return name, await response.read()
-        tasks: list[Task[tuple[str, bytes]]] = []
+                async with aiofiles.open(part_path, 'wb') as cache_file:
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        count_streamed_bytes(response.url, len(chunk))
+                        await cache_file.write(chunk)
+            await aiofiles.os.replace(part_path, cache_path)
+            return name, cache_path
+        tasks: list[Task[tuple[str, Path]]] = []
         async with asyncio.TaskGroup() as tg:
             for photo in photos:
-                name = f'vk_{photo.id}.jpg'
-                url = next(iter(size.url for size in sorted(photo.sizes, key=attrgetter('width'), reverse=True)
-                                if not max_width or max_width >= size.width))
-                tasks.append(tg.create_task(download_single(name, str(url))))
-        result: dict[str, bytes] = {}
+                name = f'vk_{-photo.owner_id}_{photo.id}.jpg'
+                if not (size := select_photo_size(photo.sizes, max_width)):
+                    logger.warning('Photo without sizes skipped: %s', photo.id)
+                    continue
+                tasks.append(tg.create_task(download_single(name, str(size.url))))
+        result: dict[str, Path] = {}
         for task in tasks:
             name, content = task.result()
             result[name] = content
@@ -148,13 +280,40 @@ class VkClientSession:
 
 
 class VkClient:
-    def __init__(self) -> None:
+    def __init__(
+        self, api_limit_per_host: int = 8, cdn_limit: int = 32, cdn_limit_per_host: int = 8,
+        download_concurrency: int = 16, cache: VkCache | None = None, api_rate: float = 3,
+        api_url: str | URL = VK_URL
+    ) -> None:
         trace_config = TraceConfig()
         trace_config.on_request_end.append(self.__on_request_end)
+        self.__api_stats = PoolStats(limit=api_limit_per_host, limit_per_host=api_limit_per_host)
+        self.__cdn_stats = PoolStats(limit=cdn_limit, limit_per_host=cdn_limit_per_host)
         self.__session = ClientSession(
+            connector=TCPConnector(
+                limit=api_limit_per_host,
+                limit_per_host=api_limit_per_host,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=DNS_CACHE_TTL,
+            ),
+            cookie_jar=DummyCookieJar(),
+            trace_configs=[trace_config, self.__api_stats.trace_config(), traffic_trace_config('vk')]
+        )
+        self.__cdn_session = ClientSession(
+            connector=TCPConnector(
+                limit=cdn_limit,
+                limit_per_host=cdn_limit_per_host,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=DNS_CACHE_TTL,
+            ),
             cookie_jar=DummyCookieJar(),
-            trace_configs=[trace_config]
+            trace_configs=[trace_config, self.__cdn_stats.trace_config(), traffic_trace_config('vk_cdn')]
         )
+        self.__download_semaphore = asyncio.Semaphore(download_concurrency)
+        self.__cache = cache
+        self.__api_rate = api_rate
+        self.__api_url = URL(api_url)
+        self.__rate_limiters: dict[str, RateLimiter] = {}
         self.__context_tmp_dir = contextlib.AsyncExitStack()
         self.__tmp_dir: str | None = None
 
@@ -170,8 +329,13 @@ class VkClient:
             params.url
         )
 
+    @property
+    def pool_stats(self) -> dict[str, PoolStats]:
+        return {'api': self.__api_stats, 'cdn': self.__cdn_stats}
+
     async def close(self) -> None:
         await self.__session.close()
+        await self.__cdn_session.close()
         await self.__context_tmp_dir.aclose()
 
     async def get_access_token(self, client_id: str, client_secret: SecretStr, redirect_uri: str,
@@ -196,4 +360,8 @@ class VkClient:
             logger.info('Created temp directory: %s', tmp_dir)
         else:
             tmp_dir = self.__tmp_dir
-        return VkClientSession(self.__session, access_token, tmp_dir)
+        return VkClientSession(
+            self.__session, self.__cdn_session, access_token, tmp_dir, self.__download_semaphore, self.__cdn_stats,
+            self.__cache, self.__rate_limiters.setdefault(token_key(access_token), RateLimiter(self.__api_rate)),
+            self.__api_url,
+        )
@@ -38,6 +38,7 @@ class PhotoSize(VkBaseModel):
 
 class Photo(VkBaseModel):
     id: int
+    owner_id: int
     sizes: list[PhotoSize] = []
 
 
@@ -88,5 +89,21 @@ class MarketEditRoot(VkBaseModel):
     response: int
 
 
+class ExecuteRoot(VkBaseModel):
+    response: list[Any]
+    execute_errors: list[dict[str, Any]] = []
+
+
+class MarketSnapshot(VkBaseModel):
+    created_at: datetime
+    items: list[MarketItem] = []
+
+
+class MarketSignature(VkBaseModel):
+    count: int
+    max_date: datetime | None = None
+    fingerprint: str
+
+
 class ErrorResponse(VkBaseModel):
     error: dict[str, Any]
@@ -0,0 +1,71 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+from aiohttp import ClientSession, TraceConfig, tracing
+from pydantic import BaseModel, Field
+
+
+class WaitStats(BaseModel):
+    count: int = 0
+    waited: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    def record(self, wait: float) -> None:
+        self.count += 1
+        if wait > 0.001:
+            self.waited += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+class PoolStats(BaseModel):
+    limit: int
+    limit_per_host: int
+    requests: int = 0
+    in_flight: int = 0
+    max_in_flight: int = 0
+    connection_queue: WaitStats = Field(default_factory=WaitStats)
+    semaphore: WaitStats = Field(default_factory=WaitStats)
+
+    def trace_config(self) -> TraceConfig:
+        trace_config = TraceConfig()
+        trace_config.on_request_start.append(self.__on_request_start)
+        trace_config.on_request_end.append(self.__on_request_done)
+        trace_config.on_request_exception.append(self.__on_request_done)
+        trace_config.on_connection_queued_start.append(self.__on_connection_queued_start)
+        trace_config.on_connection_queued_end.append(self.__on_connection_queued_end)
+        return trace_config
+
+    @asynccontextmanager
+    async def acquire(self, semaphore: asyncio.Semaphore) -> AsyncIterator[None]:
+        started_at = time.monotonic()
+        async with semaphore:
+            self.semaphore.record(time.monotonic() - started_at)
+            yield
+
+    async def __on_request_start(
+        self, session: ClientSession, context: SimpleNamespace, params: tracing.TraceRequestStartParams
+    ) -> None:
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    async def __on_request_done(
+        self, session: ClientSession, context: SimpleNamespace,
+        params: tracing.TraceRequestEndParams | tracing.TraceRequestExceptionParams
+    ) -> None:
+        self.in_flight -= 1
+
+    async def __on_connection_queued_start(
+        self, session: ClientSession, context: SimpleNamespace, params: tracing.TraceConnectionQueuedStartParams
+    ) -> None:
+        context.queued_at = time.monotonic()
+
+    async def __on_connection_queued_end(
+        self, session: ClientSession, context: SimpleNamespace, params: tracing.TraceConnectionQueuedEndParams
+    ) -> None:
+        self.connection_queue.record(time.monotonic() - context.queued_at)
@@ -0,0 +1,98 @@
+import difflib
+import logging
+from collections.abc import AsyncIterator, Callable, Iterator
+from enum import StrEnum
+
+from pydantic import BaseModel, SecretStr
+
+from vk_to_commerceml.infrastructure.vk.client import (
+    EXECUTE_CODE_LIMIT,
+    EXECUTE_MAX_CALLS,
+    VkClient,
+    execute_code,
+    market_edit_call,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BulkEditStatus(StrEnum):
+    UNCHANGED = 'unchanged'
+    CHANGED = 'changed'
+    UPDATED = 'updated'
+    FAILED = 'failed'
+
+
+class BulkEditResult(BaseModel):
+    item_id: int
+    title: str
+    status: BulkEditStatus
+    diff: str = ''
+    error: str | None = None
+
+
+def execute_batches(calls: dict[int, str], max_calls: int, code_limit: int) -> Iterator[list[int]]:
+    batch: list[int] = []
+    code_size = len(execute_code([]).encode())
+    for item_id, call in calls.items():
+        call_size = len(call.encode()) + 2
+        if batch and (len(batch) >= max_calls or code_size + call_size > code_limit):
+            yield batch
+            batch = []
+            code_size = len(execute_code([]).encode())
+        batch.append(item_id)
+        code_size += call_size
+    if batch:
+        yield batch
+
+
+class BulkEditService:
+    def __init__(self, vk_client: VkClient, vk_token: SecretStr, vk_group_id: int) -> None:
+        self.__vk_client = vk_client
+        self.__vk_token = vk_token
+        self.__vk_group_id = vk_group_id
+
+    async def edit_descriptions(
+        self, transform: Callable[[str], str], dry_run: bool = True, with_disabled: bool = True,
+        batch_size: int = EXECUTE_MAX_CALLS, code_limit: int = EXECUTE_CODE_LIMIT,
+    ) -> AsyncIterator[BulkEditResult]:
+        vk_client = await self.__vk_client.get_session(self.__vk_token)
+        owner_id = -self.__vk_group_id
+        market = await vk_client.get_market(owner_id, with_disabled)
+        changed: list[BulkEditResult] = []
+        descriptions: dict[int, str] = {}
+        for item in market:
+            description = transform(item.description)
+            if description == item.description:
+                yield BulkEditResult(item_id=item.id, title=item.title, status=BulkEditStatus.UNCHANGED)
+                continue
+            diff = '\n'.join(difflib.unified_diff(
+                item.description.splitlines(), description.splitlines(), lineterm='', n=1,
+            ))
+            changed.append(BulkEditResult(item_id=item.id, title=item.title, status=BulkEditStatus.CHANGED, diff=diff))
+            descriptions[item.id] = description
+        logger.info('Bulk edit: %d of %d items changed, dry run: %s', len(changed), len(market), dry_run)
+        if dry_run:
+            for result in changed:
+                yield result
+            return
+
+        results = {result.item_id: result for result in changed}
+        calls = {
+            result.item_id: market_edit_call(owner_id, result.item_id, descriptions[result.item_id])
+            for result in changed
+        }
+        for item_ids in execute_batches(calls, batch_size, code_limit):
+            batch = [results[item_id] for item_id in item_ids]
+            try:
+                errors = await vk_client.edit_market_items(
+                    owner_id, {result.item_id: descriptions[result.item_id] for result in batch}
+                )
+            except Exception as exc:
+                logger.exception('Bulk edit batch failure: %s', exc)
+                errors = {result.item_id: str(exc) for result in batch}
+            for result in batch:
+                if error := errors[result.item_id]:
+                    yield result.model_copy(update={'status': BulkEditStatus.FAILED, 'error': error})
+                else:
+                    yield result.model_copy(update={'status': BulkEditStatus.UPDATED})
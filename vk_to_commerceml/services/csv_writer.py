@@ -1,18 +1,68 @@
 import csv
+import gzip
 import io
+import os
+import tempfile
 from collections.abc import Iterable
+from decimal import Decimal
+from pathlib import Path
+from typing import NamedTuple
+
+from pydantic import BaseModel
+
+FIELDNAMES = ['External ID', 'Mark', 'Category', 'Parent UID', 'SEO descr', 'SEO keywords']
+PRICE_FIELDNAMES = ['Price', 'Price Old', 'Quantity']
+
+
+class CsvSizeLimitError(Exception):
+    pass
+
+
+class CsvOptions(BaseModel):
+    max_bytes: int | None = None
+    compress: bool = False
+    with_prices: bool = False
+
+
+class CsvRow(NamedTuple):
+    external_id: str
+    categories: list[str]
+    mark: str | None = None
+    seo_descr: str | None = None
+    price: Decimal | None = None
+    old_price: Decimal | None = None
+    quantity: Decimal | None = None
 
 
 class CsvWriter:
-    def __init__(self) -> None:
-        self.__csv_file = io.StringIO(newline='')
+    def __init__(self, options: CsvOptions | None = None, directory: Path | None = None) -> None:
+        options = options or CsvOptions()
+        fd, path = tempfile.mkstemp(suffix='.csv.gz' if options.compress else '.csv', dir=directory)
+        self.path = Path(path)
+        self.bytes_written = 0
+        self.__max_bytes = options.max_bytes
+        self.__with_prices = options.with_prices
+        self.__raw_file = os.fdopen(fd, 'wb')
+        self.__file: io.BufferedWriter | gzip.GzipFile = self.__raw_file
+        if options.compress:
+            self.__file = gzip.GzipFile(fileobj=self.__raw_file, mode='wb')
+        self.__buffer = io.StringIO(newline='')
         self.__writer = csv.DictWriter(
-            self.__csv_file,
-            fieldnames=[
-                'External ID', 'Mark', 'Category', 'Parent UID', 'SEO descr', 'SEO keywords'
-            ],
+            self.__buffer,
+            fieldnames=FIELDNAMES + PRICE_FIELDNAMES if options.with_prices else FIELDNAMES,
         )
         self.__writer.writeheader()
+        self.__flush()
+
+    def __flush(self) -> None:
+        data = self.__buffer.getvalue().encode('utf8')
+        self.__buffer.seek(0)
+        self.__buffer.truncate()
+        if self.__max_bytes and self.bytes_written + len(data) > self.__max_bytes:
+            self.discard()
+            raise CsvSizeLimitError(f'CSV file exceeds {self.__max_bytes} bytes')
+        self.__file.write(data)
+        self.bytes_written += len(data)
 
     def write_row(
         self,
@@ -21,16 +71,30 @@ class CsvWriter:
         mark: str | None = None,
         seo_descr: str | None = None,
         seo_keywords: str | None = None,
+        price: Decimal | None = None,
+        old_price: Decimal | None = None,
+        quantity: Decimal | None = None,
     ) -> None:
-        self.__writer.writerow({
+        row: dict[str, str | Decimal | None] = {
             'External ID': external_id,
             'Mark': mark,
             'Category': ';'.join(categories),
             'SEO descr': seo_descr,
             'SEO keywords': seo_keywords,
-        })
+        }
+        if self.__with_prices:
+            row |= {'Price': price, 'Price Old': old_price, 'Quantity': quantity}
+        self.__writer.writerow(row)
+        self.__flush()
+
+    def __close(self) -> None:
+        self.__file.close()
+        self.__raw_file.close()
+
+    def finish(self) -> Path:
+        self.__close()
+        return self.path
 
-    def finish(self) -> str:
-        value = self.__csv_file.getvalue()
-        self.__csv_file.close()
-        return value
+    def discard(self) -> None:
+        self.__close()
+        self.path.unlink(missing_ok=True)
@@ -0,0 +1,87 @@
+import hashlib
+import re
+from collections import OrderedDict
+from typing import NamedTuple
+
+RE_PROPERTIES_AREA = re.compile(r'^(.*?)\s*--\s*(.*)$', re.DOTALL)
+RE_PROPERTIES_BLOCK = re.compile(r'(.*?)\s*^[ \t]*--[ \t\r]*$(.*)', re.DOTALL | re.MULTILINE)
+RE_PROPERTIES = re.compile(r'^\s*(.*?)\s*:\s*(.*?)\s*$', re.MULTILINE)
+RE_PROPERTY_LINE = re.compile(r'^\s*([^:]+?)\s*:\s*(.+?)\s*$')
+RE_VALUE_SEPARATOR = re.compile(r'\s*,(?!\d)\s*')
+RE_FULL_NAME = re.compile(r'^.*\n\s*(.*)\s*$', re.DOTALL)
+RE_COMMA = re.compile(r'\s*,\s*', re.DOTALL)
+CACHE_SIZE = 100_000
+
+
+class ParsedDescription(NamedTuple):
+    description: str
+    seo_descr: str
+    full_name: str
+    properties: tuple[tuple[str, str], ...]
+    property_values: tuple[tuple[str, str], ...]
+
+
+def parse_description(description: str) -> ParsedDescription:
+    properties: list[tuple[str, str]] = []
+    property_values: list[tuple[str, str]] = []
+    full_name = ''
+    if properties_area_match := RE_PROPERTIES_AREA.match(description):
+        description = properties_area_match.group(1)
+        for name, values in RE_PROPERTIES.findall(properties_area_match.group(2)):
+            property_id = name.lower().replace(' ', '_')
+            properties.append((property_id, name))
+            if not full_name:
+                full_name = f'{name} {values}'
+            for value in RE_COMMA.split(values):
+                property_values.append((property_id, value))
+    seo_descr = description.split('\n', maxsplit=1)[0]
+    if not full_name and (full_name_match := RE_FULL_NAME.match(description)):
+        full_name = full_name_match.group(1)
+    return ParsedDescription(description, seo_descr, full_name, tuple(properties), tuple(property_values))
+
+
+def normalize_properties_block(description: str) -> str:
+    if not (properties_area_match := RE_PROPERTIES_BLOCK.match(description)):
+        return description
+    values: dict[str, list[str]] = {}
+    names: dict[str, str] = {}
+    for line in properties_area_match.group(2).splitlines():
+        if not line.strip():
+            continue
+        if not (property_match := RE_PROPERTY_LINE.match(line)):
+            return description
+        name, line_values = property_match.groups()
+        property_id = name.lower().replace(' ', '_')
+        names.setdefault(property_id, name)
+        property_values = values.setdefault(property_id, [])
+        for value in RE_VALUE_SEPARATOR.split(line_values):
+            if value and value not in property_values:
+                property_values.append(value)
+    if not names:
+        return description
+    lines = [f'{names[property_id]}: {", ".join(property_values)}' for property_id, property_values in values.items()]
+    block = '--\n' + '\n'.join(lines)
+    return f'{properties_area_match.group(1)}\n\n{block}' if properties_area_match.group(1) else block
+
+
+class DescriptionParser:
+    def __init__(self, cache_size: int = CACHE_SIZE) -> None:
+        self.__cache_size = cache_size
+        self.__cache: OrderedDict[bytes, ParsedDescription] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, description: str) -> ParsedDescription:
+        key = hashlib.blake2b(description.encode(), digest_size=16).digest()
+        if parsed := self.__cache.get(key):
+            self.__cache.move_to_end(key)
+            self.hits += 1
+            return parsed
+        self.misses += 1
+        parsed = self.__cache[key] = parse_description(description)
+        if len(self.__cache) > self.__cache_size:
+            self.__cache.popitem(last=False)
+        return parsed
+
+
+description_parser = DescriptionParser()
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+from collections import defaultdict
+from collections.abc import Awaitable, Callable
+from contextlib import suppress
+
+logger = logging.getLogger(__name__)
+DEBOUNCE_DELAY = 5.0
+
+ItemSyncHandler = Callable[[int, set[int]], Awaitable[None]]
+
+
+class ItemChangeDebouncer:
+    def __init__(self, handler: ItemSyncHandler, delay: float = DEBOUNCE_DELAY) -> None:
+        self.__handler = handler
+        self.__delay = delay
+        self.__pending: dict[int, set[int]] = {}
+        self.__timers: dict[int, asyncio.Task[None]] = {}
+        self.__flushes: set[asyncio.Task[None]] = set()
+        self.__locks: defaultdict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    def add(self, group_id: int, item_id: int) -> None:
+        self.__pending.setdefault(group_id, set()).add(item_id)
+        if group_id not in self.__timers:
+            self.__timers[group_id] = asyncio.create_task(self.__schedule(group_id))
+
+    async def __schedule(self, group_id: int) -> None:
+        try:
+            await asyncio.sleep(self.__delay)
+        finally:
+            del self.__timers[group_id]
+        self.__start_flush(group_id)
+
+    def __start_flush(self, group_id: int) -> None:
+        task = asyncio.create_task(self.__flush(group_id))
+        self.__flushes.add(task)
+        task.add_done_callback(self.__flushes.discard)
+
+    async def __flush(self, group_id: int) -> None:
+        item_ids = self.__pending.pop(group_id, set())
+        if not item_ids:
+            return
+        async with self.__locks[group_id]:
+            logger.info('Item sync for group %d: %d changed items', group_id, len(item_ids))
+            try:
+                await self.__handler(group_id, item_ids)
+            except Exception as exc:
+                logger.exception('Item sync failure for group %d: %s', group_id, exc)
+
+    async def close(self) -> None:
+        timers = list(self.__timers.values())
+        for timer in timers:
+            timer.cancel()
+        for timer in timers:
+            with suppress(asyncio.CancelledError):
+                await timer
+        for group_id in list(self.__pending):
+            self.__start_flush(group_id)
+        while self.__flushes:
+            await asyncio.gather(*self.__flushes)
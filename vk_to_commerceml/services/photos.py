@@ -0,0 +1,64 @@
+import asyncio
+import hashlib
+import logging
+import os
+from concurrent.futures import Executor
+from pathlib import Path
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+PHOTO_WIDTH = 807
+PHOTO_QUALITY = 85
+
+
+def process_photo(path: Path, width: int, quality: int) -> tuple[str, Path]:
+    with path.open('rb') as file:
+        digest = hashlib.file_digest(file, 'sha256').hexdigest()
+    output_path = path.with_name(f'{path.stem}.w{width}q{quality}{path.suffix}')
+    if output_path.exists():
+        return digest, output_path
+    with Image.open(path) as image:
+        if image.format != 'JPEG' or image.width <= width:
+            return digest, path
+        height = round(image.height * width / image.width)
+        resized = image.resize((width, height), Image.Resampling.LANCZOS)
+    part_path = output_path.with_name(f'{output_path.name}.{os.getpid()}.part')
+    resized.save(part_path, 'JPEG', quality=quality, optimize=True)
+    os.replace(part_path, output_path)
+    return digest, output_path
+
+
+class PhotoProcessor:
+    def __init__(
+        self, executor: Executor | None = None, width: int = PHOTO_WIDTH, quality: int = PHOTO_QUALITY,
+        concurrency: int = 4
+    ) -> None:
+        self.__executor = executor
+        self.__width = width
+        self.__quality = quality
+        self.__semaphore = asyncio.Semaphore(concurrency)
+
+    async def __process_single(self, path: Path) -> tuple[str, Path]:
+        async with self.__semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.__executor, process_photo, path, self.__width, self.__quality)
+
+    async def process(self, photos: dict[str, Path]) -> tuple[dict[str, Path], dict[str, str]]:
+        async with asyncio.TaskGroup() as tg:
+            tasks = {name: tg.create_task(self.__process_single(path)) for name, path in photos.items()}
+        unique: dict[str, Path] = {}
+        names: dict[str, str] = {}
+        name_by_digest: dict[str, str] = {}
+        for name, task in tasks.items():
+            digest, path = task.result()
+            names[name] = name_by_digest.setdefault(digest, name)
+            if names[name] == name:
+                unique[name] = path
+        source_size = sum(path.stat().st_size for path in photos.values())
+        result_size = sum(path.stat().st_size for path in unique.values())
+        logger.info(
+            'Photos processed: %d -> %d unique, %d -> %d bytes',
+            len(photos), len(unique), source_size, result_size,
+        )
+        return unique, names
@@ -0,0 +1,180 @@
+import asyncio
+import cProfile
+import logging
+import time
+import tracemalloc
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager, suppress
+from contextvars import Token
+from datetime import UTC, datetime
+from pathlib import Path
+from types import TracebackType
+from typing import Any
+
+from pydantic import BaseModel, Field
+
+from vk_to_commerceml.infrastructure.traffic import TrafficRecorder
+
+logger = logging.getLogger(__name__)
+LAG_INTERVAL = 0.05
+
+
+class ProfileMode(BaseModel):
+    cprofile: bool = False
+    once: bool = False
+    capture: bool = False
+
+
+class PhaseProfile(BaseModel):
+    name: str
+    duration: float
+    memory_peak: int | None  # peak of the whole process, measured by one profiled run at a time
+    lag_max: float
+    lag_mean: float
+
+
+class SyncProfile(BaseModel):
+    started_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
+    tags: dict[str, Any] = {}
+    duration: float = 0
+    lag_max: float = 0
+    lag_mean: float = 0
+    phases: list[PhaseProfile] = []
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = LAG_INTERVAL) -> None:
+        self.__interval = interval
+        self.__task: asyncio.Task[None] | None = None
+        self.samples: list[float] = []
+
+    async def __run(self) -> None:
+        while True:
+            started_at = time.perf_counter()
+            await asyncio.sleep(self.__interval)
+            self.samples.append(max(time.perf_counter() - started_at - self.__interval, 0))
+
+    def start(self) -> None:
+        self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self) -> None:
+        if not self.__task:
+            return
+        self.__task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self.__task
+
+
+def lag_stats(samples: list[float]) -> tuple[float, float]:
+    if not samples:
+        return 0, 0
+    return max(samples), sum(samples) / len(samples)
+
+
+class SyncProfiler:
+    __tracemalloc_users = 0
+    __memory_peak_owner: 'SyncProfiler | None' = None
+    __cprofile_active = False
+
+    def __init__(
+        self, base_path: Path | None = None, tags: dict[str, Any] | None = None, mode: ProfileMode | None = None,
+        recorder: TrafficRecorder | None = None,
+    ) -> None:
+        self.__base_path = base_path
+        self.__mode = mode
+        self.__recorder = recorder
+        self.__recorder_token: Token[TrafficRecorder | None] | None = None
+        self.__lag_monitor = LoopLagMonitor()
+        self.__cprofile: cProfile.Profile | None = None
+        self.__started_at = 0.0
+        self.profile = SyncProfile(tags=tags or {})
+
+    @property
+    def enabled(self) -> bool:
+        return self.__mode is not None
+
+    def tag(self, **tags: Any) -> None:
+        self.profile.tags.update(tags)
+
+    async def __aenter__(self) -> 'SyncProfiler':
+        self.__started_at = time.perf_counter()
+        if not self.__mode:
+            return self
+        if not SyncProfiler.__tracemalloc_users:
+            tracemalloc.start()
+        SyncProfiler.__tracemalloc_users += 1
+        if SyncProfiler.__memory_peak_owner:
+            logger.warning('Memory peak is already measured, skipped for %s', self.profile.tags)
+        else:
+            SyncProfiler.__memory_peak_owner = self
+        self.__lag_monitor.start()
+        await asyncio.sleep(0)
+        if self.__recorder:
+            self.__recorder_token = self.__recorder.activate()
+        if self.__mode.cprofile:
+            if SyncProfiler.__cprofile_active:
+                logger.warning('cProfile is already active, skipped for %s', self.profile.tags)
+            else:
+                SyncProfiler.__cprofile_active = True
+                self.__cprofile = cProfile.Profile()
+                self.__cprofile.enable()
+        return self
+
+    async def __aexit__(
+        self, exc_type: type[BaseException] | None, exc: BaseException | None, tb: TracebackType | None,
+    ) -> None:
+        self.profile.duration = time.perf_counter() - self.__started_at
+        if not self.__mode:
+            return
+        if self.__cprofile:
+            self.__cprofile.disable()
+            SyncProfiler.__cprofile_active = False
+        if self.__recorder_token:
+            TrafficRecorder.deactivate(self.__recorder_token)
+        await self.__lag_monitor.stop()
+        if SyncProfiler.__memory_peak_owner is self:
+            SyncProfiler.__memory_peak_owner = None
+        SyncProfiler.__tracemalloc_users -= 1
+        if not SyncProfiler.__tracemalloc_users:
+            tracemalloc.stop()
+        self.profile.lag_max, self.profile.lag_mean = lag_stats(self.__lag_monitor.samples)
+        if exc:
+            self.tag(error=repr(exc))
+        logger.info('Sync profile: %s', self.profile.model_dump_json())
+        if self.__base_path:
+            try:
+                await asyncio.to_thread(self.__save)
+            except Exception as e:
+                logger.exception('Profile save error: %s', e)
+
+    def __save(self) -> None:
+        if not self.__base_path:
+            return
+        run_dir = self.__base_path / f'{self.profile.started_at:%Y%m%d_%H%M%S}_{uuid.uuid4()}'
+        run_dir.mkdir(parents=True, exist_ok=True)
+        (run_dir / 'profile.json').write_text(self.profile.model_dump_json(indent=2))
+        if self.__cprofile:
+            self.__cprofile.dump_stats(run_dir / 'profile.prof')
+        if self.__recorder:
+            self.__recorder.save(run_dir / 'traffic.json.gz', self.profile.tags)
+        logger.info('Sync profile saved: %s', run_dir)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        measure_memory = SyncProfiler.__memory_peak_owner is self
+        if measure_memory:
+            tracemalloc.reset_peak()
+        lag_start = len(self.__lag_monitor.samples)
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            lag_max, lag_mean = lag_stats(self.__lag_monitor.samples[lag_start:])
+            self.profile.phases.append(PhaseProfile(
+                name=name,
+                duration=time.perf_counter() - started_at,
+                memory_peak=tracemalloc.get_traced_memory()[1] if measure_memory and tracemalloc.is_tracing() else None,
+                lag_max=lag_max,
+                lag_mean=lag_mean,
+            ))
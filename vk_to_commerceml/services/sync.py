@@ -1,9 +1,11 @@
+import asyncio
 import logging
-import re
-from collections.abc import AsyncIterator
-from datetime import UTC, datetime, timedelta
-from decimal import Decimal
-from enum import Enum
+from collections.abc import AsyncIterator, Collection, Sequence
+from concurrent.futures import Executor
+from datetime import UTC, datetime
+from enum import Enum, StrEnum
+from pathlib import Path
+from typing import NamedTuple, cast
 
 from pydantic import SecretStr
 
@@ -11,28 +13,32 @@ from vk_to_commerceml.infrastructure.cml.client import CmlClient
 from vk_to_commerceml.infrastructure.cml.models import (
     Catalog,
     CatalogClassifier,
-    DetailValue,
     Group,
     ImportDocument,
-    Offer,
     OffersDocument,
     PackageOfOffers,
-    Price,
     PriceType,
     Product,
     Property,
-    PropertyValue,
 )
 from vk_to_commerceml.infrastructure.vk import models as vk_models
-from vk_to_commerceml.infrastructure.vk.client import VkClient
-from vk_to_commerceml.services.csv_writer import CsvWriter
-
-RE_PROPERTIES_AREA = re.compile(r'^(.*?)\s*--\s*(.*)$', re.DOTALL)
-RE_PROPERTIES = re.compile(r'^\s*(.*?)\s*:\s*(.*?)\s*$', re.MULTILINE)
-RE_FULL_NAME = re.compile(r'^.*\n\s*(.*)\s*$', re.DOTALL)
-RE_COMMA = re.compile(r'\s*,\s*', re.DOTALL)
+from vk_to_commerceml.infrastructure.vk.client import MARKET_PAGE_SIZE, VkClient, market_signature
+from vk_to_commerceml.services.csv_writer import CsvOptions, CsvWriter
+from vk_to_commerceml.services.photos import PHOTO_WIDTH, PhotoProcessor
+from vk_to_commerceml.services.profiling import SyncProfiler
+from vk_to_commerceml.services.transform import (
+    TransformResult,
+    build_csv_rows,
+    build_offer,
+    item_external_id,
+    transform_market,
+)
 
 logger = logging.getLogger(__name__)
+PRICE_TYPES = [
+    PriceType(id='sale_price', name='Цена продажи'),
+    PriceType(id='discount_price', name='Цена со скидкой'),
+]
 
 
 class SyncState(Enum):
@@ -42,134 +48,191 @@ class SyncState(Enum):
     MAIN_FAILED = 4
     PHOTO_SUCCESS = 5
     PHOTO_FAILED = 6
+    PROGRESS = 7
+    NO_CHANGES = 8
+    CSV_FAILED = 9
+
+
+class SyncError(Exception):
+    pass
+
+
+class SyncPhase(StrEnum):
+    GET_PRODUCTS = 'get_products'
+    UPLOAD = 'upload'
+    PHOTO_DOWNLOAD = 'photo_download'
+    PHOTO_UPLOAD = 'photo_upload'
+
+
+class SyncProgress(NamedTuple):
+    phase: SyncPhase
+    done: int
+    total: int
+
+    @property
+    def percent(self) -> int:
+        return 100 * self.done // self.total if self.total else 100
+
+
+def build_classifier(transformed: TransformResult) -> CatalogClassifier:
+    return CatalogClassifier(
+        groups=[Group(id=group_id, name=group_name) for group_id, group_name in transformed.groups.items()],
+        properties=[
+            Property(id=property_id, name=property_name)
+            for property_id, property_name in transformed.properties.items()
+        ],
+    )
 
 
 class SyncService:
     def __init__(self, cml_client: CmlClient, cml_url: str, cml_login: str, cml_password: SecretStr,
-                 vk_client: VkClient, vk_token: SecretStr, vk_group_id: int) -> None:
+                 vk_client: VkClient, vk_token: SecretStr, vk_group_ids: Sequence[int],
+                 process_pool: Executor | None = None) -> None:
         self.__cml_client = cml_client
         self.__cml_url = cml_url
         self.__cml_login = cml_login
         self.__cml_password = cml_password
         self.__vk_client = vk_client
         self.__vk_token = vk_token
-        self.__vk_group_id = vk_group_id
+        self.__vk_group_ids = list(vk_group_ids)
+        self.__namespaced = len(self.__vk_group_ids) > 1
+        self.__process_pool = process_pool
 
     async def sync(
             self, with_disabled: bool = False, with_photos: bool = False,
-            skip_multiple_group: bool = False, make_csv: bool = False
-    ) -> AsyncIterator[tuple[SyncState, str | int | None]]:
+            skip_multiple_group: bool = False, make_csv: bool = False, snapshot_max_age: int | None = None,
+            csv_options: CsvOptions | None = None, profiler: SyncProfiler | None = None, prices_only: bool = False,
+            skip_unchanged: bool = False,
+    ) -> AsyncIterator[tuple[SyncState, str | int | Path | SyncProgress | None]]:
+        profiler = profiler or SyncProfiler()
         vk_client = await self.__vk_client.get_session(self.__vk_token)
+        owner_ids = [-group_id for group_id in self.__vk_group_ids]
+        signature_target = ' '.join(
+            [self.__cml_url, self.__cml_login, *(str(int(flag)) for flag in (with_disabled, with_photos, prices_only))]
+        )
+        if self.__namespaced:
+            signature_target += ' ' + ','.join(map(str, sorted(self.__vk_group_ids)))
+        group_tags = {'vk_group_id': self.__vk_group_ids[0], 'vk_group_ids': self.__vk_group_ids}
+
+        async def probe(
+                owner_id: int,
+        ) -> tuple[vk_models.MarketSignature, list[vk_models.MarketItem], vk_models.MarketSignature | None]:
+            signature, first_page = await vk_client.probe_market(owner_id, with_disabled)
+            return signature, first_page, await vk_client.get_synced_signature(owner_id, signature_target)
+
+        yield SyncState.PROGRESS, SyncProgress(SyncPhase.GET_PRODUCTS, 0, 1)
+        first_pages: dict[int, list[vk_models.MarketItem]] = {}
+        if skip_unchanged:
+            try:
+                with profiler.phase('probe'):
+                    probes = await asyncio.gather(*(probe(owner_id) for owner_id in owner_ids))
+            except Exception as exc:
+                logger.warning('Market probe failure, falling back to full sync: %s', exc)
+            else:
+                first_pages = {owner_id: first_page for owner_id, (_, first_page, _) in zip(owner_ids, probes)}
+                if all(
+                    signature.count <= MARKET_PAGE_SIZE and signature == synced_signature
+                    for signature, _, synced_signature in probes
+                ):
+                    count = sum(signature.count for signature, _, _ in probes)
+                    profiler.tag(**group_tags, catalog_size=count, no_changes=True)
+                    yield SyncState.NO_CHANGES, count
+                    return
         try:
-            market = await vk_client.get_market(-self.__vk_group_id, with_disabled)
+            with profiler.phase('get_products'):
+                markets = await asyncio.gather(*(
+                    vk_client.get_market(
+                        owner_id, with_disabled, max_age=snapshot_max_age, first_page=first_pages.get(owner_id)
+                    )
+                    for owner_id in owner_ids
+                ))
         except Exception as exc:
             logger.exception('Get products failure: %s', exc)
             yield SyncState.GET_PRODUCTS_FAILED, str(exc)
             return
+        market = [item for group_market in markets for item in group_market]
+        profiler.tag(**group_tags, catalog_size=len(market))
+
+        async def save_signature() -> None:
+            try:
+                for owner_id, group_market in zip(owner_ids, markets):
+                    await vk_client.set_synced_signature(
+                        owner_id, signature_target,
+                        market_signature(len(group_market), group_market[:MARKET_PAGE_SIZE]),
+                    )
+            except Exception as exc:
+                logger.warning('Market signature save failure: %s', exc)
+
         yield SyncState.GET_PRODUCTS_SUCCESS, len(market)
-        groups: set[Group] = {Group(id='продано', name='Продано'), Group(id='new', name='new')}
-        properties: set[Property] = set()
-        products: list[Product] = []
-        offers: list[Offer] = []
-        csv_writer: CsvWriter | None = CsvWriter() if make_csv else None
-        for item in market:
-            group_id = item.owner_info.category.lower().replace(' ', '_')
-            group_name = item.owner_info.category
-            external_id = f'vk_{item.id}'
-            groups.add(Group(id=group_id, name=item.owner_info.category))
-            property_values: list[PropertyValue] = []
-            description = item.description
-            full_name = ''
-            if properties_area_match := RE_PROPERTIES_AREA.match(description):
-                description = properties_area_match.group(1)
-                if properties_found := RE_PROPERTIES.findall(properties_area_match.group(2)):
-                    for name, values in properties_found:
-                        property_id = name.lower().replace(' ', '_')
-                        properties.add(Property(id=property_id, name=name))
-                        if not full_name:
-                            full_name = f'{name} {values}'
-                        for value in RE_COMMA.split(values):
-                            property_values.append(PropertyValue(id=property_id, value=value))
-            seo_descr = description.split('\n', maxsplit=1)[0]
-            if not full_name and (full_name_match := RE_FULL_NAME.match(description)):
-                full_name = full_name_match.group(1)
-            video_urls: list[str] = []
-            for video in item.videos:
-                url = f'https://vk.com/video{item.owner_id}_{video.id}'
-                video_urls.append(
-                    f'<a href="{url}" target="_blank">Видео "{video.title}" ({timedelta(seconds=video.duration)})</a>')
-            if video_urls:
-                description += '\n\n' + '\n'.join(video_urls)
-            new = item.date > datetime.now(UTC) - timedelta(days=31) if item.date else False
-            mark: str | None = None
-            if item.availability == vk_models.Availability.PRESENTED:
-                title = item.title
-                if new:
-                    group_ids = ['new', group_id] if not skip_multiple_group else []
-                    categories = ['new', group_name]
-                    mark = 'NEW'
-                else:
-                    group_ids = [group_id]
-                    categories = [group_name]
-            else:
-                title = f'{item.title} [Продано]'
-                group_ids = ['продано']
-                categories = ['Продано']
-            if csv_writer:
-                csv_writer.write_row(external_id, categories=categories, mark=mark, seo_descr=seo_descr)
-            detail_values: list[DetailValue] = [
-                DetailValue(name='SEO описание', value=seo_descr),
-            ]
-            if full_name:
-                detail_values.append(DetailValue(name='Полное наименование', value=full_name))
-            if mark:
-                detail_values.append(DetailValue(name='Отметка на карточке', value=mark))
-            products.append(Product(
-                id=external_id,
-                number=item.sku,
-                name=title,
-                description=description,
-                group_ids=group_ids,
-                images=[],
-                property_values=property_values,
-                detail_values=detail_values,
-            ))
-            offers.append(Offer(
-                id=external_id,
-                number=item.sku,
-                name=title,
-                prices=[
-                    Price(price_type_id='sale_price', unit_price=item.price.old_amount / Decimal(100)),
-                    Price(price_type_id='discount_price', unit_price=item.price.amount / Decimal(100))
-                ] if item.price.old_amount is not None else [
-                    Price(price_type_id='sale_price', unit_price=item.price.amount / Decimal(100)),
-                ],
-                quantity=Decimal(1) if item.availability == vk_models.Availability.PRESENTED else Decimal(0),
-            ))
-
-        classifier = CatalogClassifier(groups=list(groups), properties=list(properties))
+        cml_client_session = await self.__cml_client.get_session(self.__cml_url, self.__cml_login, self.__cml_password)
+        if prices_only:
+            prices_document = OffersDocument(
+                package_of_offers=PackageOfOffers(
+                    only_changes=True,
+                    price_types=PRICE_TYPES,
+                    offers=[build_offer(item, self.__namespaced) for item in market],
+                )
+            )
+            yield SyncState.PROGRESS, SyncProgress(SyncPhase.UPLOAD, 0, 1)
+            try:
+                with profiler.phase('upload_offers'):
+                    await cml_client_session.upload(
+                        offers_document=prices_document, skip_unchanged=skip_unchanged, document_kind='prices',
+                    )
+            except Exception as exc:
+                logger.exception('Prices sync failure: %s', exc)
+                yield SyncState.MAIN_FAILED, str(exc)
+                return
+            finally:
+                profiler.tag(
+                    uploaded_bytes=cml_client_session.uploaded_bytes, retries=cml_client_session.retries,
+                    skipped_documents=cml_client_session.skipped_documents,
+                )
+            await save_signature()
+            yield SyncState.MAIN_SUCCESS, None
+            return
+        with profiler.phase('transform'):
+            transformed = await transform_market(
+                market, self.__process_pool, skip_multiple_group=skip_multiple_group, namespaced=self.__namespaced,
+            )
+        classifier = build_classifier(transformed)
         import_document = ImportDocument(
             classifier=classifier,
-            catalog=Catalog(products=products),
+            catalog=Catalog(products=transformed.products),
         )
         offers_document = OffersDocument(
             package_of_offers=PackageOfOffers(
-                price_types=[
-                    PriceType(id='sale_price', name='Цена продажи'),
-                    PriceType(id='discount_price', name='Цена со скидкой'),
-                ],
-                offers=offers,
+                price_types=PRICE_TYPES,
+                offers=transformed.offers,
             )
         )
-        cml_client_session = await self.__cml_client.get_session(self.__cml_url, self.__cml_login, self.__cml_password)
+        yield SyncState.PROGRESS, SyncProgress(SyncPhase.UPLOAD, 0, 1)
         try:
-            await cml_client_session.upload(import_document, offers_document)
+            with profiler.phase('upload'):
+                await cml_client_session.upload(
+                    import_document, offers_document, skip_unchanged=skip_unchanged, document_kind='full',
+                )
         except Exception as exc:
             logger.exception('Main sync failure: %s', exc)
             yield SyncState.MAIN_FAILED, str(exc)
             return
+        finally:
+            profiler.tag(
+                uploaded_bytes=cml_client_session.uploaded_bytes, retries=cml_client_session.retries,
+                skipped_documents=cml_client_session.skipped_documents,
+            )
 
-        yield SyncState.MAIN_SUCCESS, csv_writer.finish() if csv_writer else None
+        csv_path: Path | None = None
+        if make_csv:
+            try:
+                with profiler.phase('csv'):
+                    csv_path = self.__write_csv(market, csv_options)
+            except Exception as exc:
+                logger.exception('CSV failure: %s', exc)
+                yield SyncState.CSV_FAILED, str(exc)
+        if not with_photos:
+            await save_signature()
+        yield SyncState.MAIN_SUCCESS, csv_path
         if not with_photos:
             return
 
@@ -180,24 +243,109 @@ class SyncService:
                 products=[],
             ),
         )
-        photos: dict[str, bytes] = {}
+        downloaded: dict[str, Path] = {}
+        item_photo_names: dict[str, list[str]] = {}
+        presented = [item for item in market if item.availability == vk_models.Availability.PRESENTED]
+        with profiler.phase('photo_download'):
+            for number, item in enumerate(presented):
+                yield SyncState.PROGRESS, SyncProgress(SyncPhase.PHOTO_DOWNLOAD, number, len(presented))
+                logger.info('Product photo upload: %s [%d]', item.title, item.id)
+                item_photos = await vk_client.download_photos(item.photos, max_width=PHOTO_WIDTH)
+                item_photo_names[item_external_id(item, self.__namespaced)] = list(item_photos)
+                downloaded.update(item_photos)
+        yield SyncState.PROGRESS, SyncProgress(SyncPhase.PHOTO_DOWNLOAD, len(presented), len(presented))
+        with profiler.phase('photo_process'):
+            photos, photo_names = await PhotoProcessor(self.__process_pool).process(downloaded)
         for item in market:
-            if item.availability != vk_models.Availability.PRESENTED:
+            external_id = item_external_id(item, self.__namespaced)
+            if external_id not in item_photo_names:
                 continue
-            logger.info('Product photo upload: %s [%d]', item.title, item.id)
-            item_photos = await vk_client.download_photos(item.photos, max_width=807)
             images_document.catalog.products.append(
                 Product(
-                    id=f'vk_{item.id}',
+                    id=external_id,
                     name=item.title,
-                    images=list(item_photos),
+                    images=list(dict.fromkeys(photo_names[name] for name in item_photo_names[external_id])),
                 )
             )
-            photos.update(item_photos)
+        yield SyncState.PROGRESS, SyncProgress(SyncPhase.PHOTO_UPLOAD, 0, 1)
         try:
-            await cml_client_session.upload(import_document=images_document, photos=photos)
+            with profiler.phase('photo_upload'):
+                await cml_client_session.upload(import_document=images_document, photos=photos)
         except Exception as exc:
             logger.exception('Photo sync failure: %s', exc)
             yield SyncState.PHOTO_FAILED, str(exc)
             return
+        finally:
+            profiler.tag(
+                uploaded_bytes=cml_client_session.uploaded_bytes, retries=cml_client_session.retries,
+                skipped_documents=cml_client_session.skipped_documents,
+            )
+        await save_signature()
         yield SyncState.PHOTO_SUCCESS, len(photos)
+
+    def __write_csv(self, market: list[vk_models.MarketItem], csv_options: CsvOptions | None) -> Path:
+        csv_writer = CsvWriter(csv_options)
+        try:
+            for row in build_csv_rows(market, datetime.now(UTC), self.__namespaced):
+                csv_writer.write_row(
+                    row.external_id, categories=row.categories, mark=row.mark, seo_descr=row.seo_descr,
+                    price=row.price, old_price=row.old_price, quantity=row.quantity,
+                )
+        except Exception:
+            csv_writer.discard()
+            raise
+        return csv_writer.finish()
+
+    async def sync_items(
+            self, vk_group_id: int, item_ids: Collection[int], with_disabled: bool = False,
+            skip_multiple_group: bool = False, profiler: SyncProfiler | None = None,
+    ) -> int:
+        profiler = profiler or SyncProfiler()
+        vk_client = await self.__vk_client.get_session(self.__vk_token)
+        with profiler.phase('get_products'):
+            items = await vk_client.get_market_products_by_ids(-vk_group_id, sorted(item_ids))
+        profiler.tag(vk_group_id=vk_group_id, catalog_size=len(items))
+        listed = {
+            item.id for item in items if with_disabled or item.availability == vk_models.Availability.PRESENTED
+        }
+        if removed := set(item_ids) - listed:
+            logger.info('Items %s of group %d are deleted or hidden, running a full sync', sorted(removed), vk_group_id)
+            profiler.tag(full_sync=True)
+            return await self.__sync_full(with_disabled, skip_multiple_group, profiler)
+        with profiler.phase('transform'):
+            transformed = await transform_market(
+                items, skip_multiple_group=skip_multiple_group, namespaced=self.__namespaced
+            )
+        import_document = ImportDocument(
+            classifier=build_classifier(transformed),
+            catalog=Catalog(only_changes=True, products=transformed.products),
+        )
+        offers_document = OffersDocument(
+            package_of_offers=PackageOfOffers(
+                only_changes=True,
+                price_types=PRICE_TYPES,
+                offers=transformed.offers,
+            )
+        )
+        cml_client_session = await self.__cml_client.get_session(self.__cml_url, self.__cml_login, self.__cml_password)
+        try:
+            with profiler.phase('upload'):
+                await cml_client_session.upload(import_document, offers_document)
+        finally:
+            profiler.tag(
+                uploaded_bytes=cml_client_session.uploaded_bytes, retries=cml_client_session.retries,
+                skipped_documents=cml_client_session.skipped_documents,
+            )
+        return len(items)
+
+    async def __sync_full(self, with_disabled: bool, skip_multiple_group: bool, profiler: SyncProfiler) -> int:
+        count = 0
+        async for state, result in self.sync(
+            with_disabled=with_disabled, skip_multiple_group=skip_multiple_group, profiler=profiler,
+        ):
+            match state:
+                case SyncState.GET_PRODUCTS_FAILED | SyncState.MAIN_FAILED:
+                    raise SyncError(result)
+                case SyncState.GET_PRODUCTS_SUCCESS | SyncState.NO_CHANGES:
+                    count = cast(int, result)
+        return count
@@ -0,0 +1,157 @@
+import asyncio
+import itertools
+from collections.abc import Iterator
+from concurrent.futures import Executor
+from datetime import UTC, datetime, timedelta
+from decimal import Decimal
+from functools import partial
+
+from pydantic import BaseModel
+
+from vk_to_commerceml.infrastructure.cml.models import (
+    DetailValue,
+    Offer,
+    Price,
+    Product,
+    PropertyValue,
+)
+from vk_to_commerceml.infrastructure.vk import models as vk_models
+from vk_to_commerceml.services.csv_writer import CsvRow
+from vk_to_commerceml.services.description_parser import description_parser
+
+BATCH_SIZE = 2_000
+PARALLEL_THRESHOLD = 5_000
+
+
+class TransformResult(BaseModel):
+    groups: dict[str, str] = {}
+    properties: dict[str, str] = {}
+    products: list[Product] = []
+    offers: list[Offer] = []
+
+    def merge(self, other: 'TransformResult') -> None:
+        for group_id, group_name in other.groups.items():
+            self.groups.setdefault(group_id, group_name)
+        for property_id, property_name in other.properties.items():
+            self.properties.setdefault(property_id, property_name)
+        self.products += other.products
+        self.offers += other.offers
+
+
+def item_external_id(item: vk_models.MarketItem, namespaced: bool = False) -> str:
+    return f'vk_{-item.owner_id}_{item.id}' if namespaced else f'vk_{item.id}'
+
+
+def item_categories(item: vk_models.MarketItem, now: datetime) -> tuple[list[str], str | None]:
+    if item.availability != vk_models.Availability.PRESENTED:
+        return ['Продано'], None
+    if item.date and item.date > now - timedelta(days=31):
+        return ['new', item.owner_info.category], 'NEW'
+    return [item.owner_info.category], None
+
+
+def transform_items(
+    items: list[vk_models.MarketItem], now: datetime, skip_multiple_group: bool = False, namespaced: bool = False,
+) -> TransformResult:
+    result = TransformResult()
+    for item in items:
+        group_id = item.owner_info.category.lower().replace(' ', '_')
+        group_name = item.owner_info.category
+        external_id = item_external_id(item, namespaced)
+        result.groups.setdefault(group_id, group_name)
+        parsed = description_parser.parse(item.description)
+        for property_id, property_name in parsed.properties:
+            result.properties.setdefault(property_id, property_name)
+        property_values = [
+            PropertyValue(id=property_id, value=value) for property_id, value in parsed.property_values
+        ]
+        description = parsed.description
+        seo_descr = parsed.seo_descr
+        full_name = parsed.full_name
+        video_urls: list[str] = []
+        for video in item.videos:
+            url = f'https://vk.com/video{item.owner_id}_{video.id}'
+            video_urls.append(
+                f'<a href="{url}" target="_blank">Видео "{video.title}" ({timedelta(seconds=video.duration)})</a>')
+        if video_urls:
+            description += '\n\n' + '\n'.join(video_urls)
+        _, mark = item_categories(item, now)
+        if item.availability == vk_models.Availability.PRESENTED:
+            title = item.title
+            if mark:
+                group_ids = ['new', group_id] if not skip_multiple_group else []
+            else:
+                group_ids = [group_id]
+        else:
+            title = f'{item.title} [Продано]'
+            group_ids = ['продано']
+        detail_values: list[DetailValue] = [
+            DetailValue(name='SEO описание', value=seo_descr),
+        ]
+        if full_name:
+            detail_values.append(DetailValue(name='Полное наименование', value=full_name))
+        if mark:
+            detail_values.append(DetailValue(name='Отметка на карточке', value=mark))
+        result.products.append(Product(
+            id=external_id,
+            number=item.sku,
+            name=title,
+            description=description,
+            group_ids=group_ids,
+            images=[],
+            property_values=property_values,
+            detail_values=detail_values,
+        ))
+        result.offers.append(build_offer(item, namespaced))
+    return result
+
+
+def build_csv_rows(
+    market: list[vk_models.MarketItem], now: datetime, namespaced: bool = False
+) -> Iterator[CsvRow]:
+    for item in market:
+        categories, mark = item_categories(item, now)
+        yield CsvRow(
+            item_external_id(item, namespaced), categories=categories, mark=mark,
+            seo_descr=description_parser.parse(item.description).seo_descr,
+            price=item.price.amount / Decimal(100),
+            old_price=item.price.old_amount / Decimal(100) if item.price.old_amount is not None else None,
+            quantity=Decimal(1) if item.availability == vk_models.Availability.PRESENTED else Decimal(0),
+        )
+
+
+def build_offer(item: vk_models.MarketItem, namespaced: bool = False) -> Offer:
+    presented = item.availability == vk_models.Availability.PRESENTED
+    return Offer(
+        id=item_external_id(item, namespaced),
+        number=item.sku,
+        name=item.title if presented else f'{item.title} [Продано]',
+        prices=[
+            Price(price_type_id='sale_price', unit_price=item.price.old_amount / Decimal(100)),
+            Price(price_type_id='discount_price', unit_price=item.price.amount / Decimal(100))
+        ] if item.price.old_amount is not None else [
+            Price(price_type_id='sale_price', unit_price=item.price.amount / Decimal(100)),
+        ],
+        quantity=Decimal(1) if presented else Decimal(0),
+    )
+
+
+async def transform_market(
+    market: list[vk_models.MarketItem], executor: Executor | None = None,
+    skip_multiple_group: bool = False, batch_size: int = BATCH_SIZE,
+    parallel_threshold: int = PARALLEL_THRESHOLD, namespaced: bool = False,
+) -> TransformResult:
+    result = TransformResult(groups={'продано': 'Продано', 'new': 'new'})
+    transform = partial(
+        transform_items, now=datetime.now(UTC), skip_multiple_group=skip_multiple_group, namespaced=namespaced,
+    )
+    if executor is None or len(market) < parallel_threshold:
+        result.merge(transform(market))
+        return result
+    loop = asyncio.get_running_loop()
+    batch_results = await asyncio.gather(*(
+        loop.run_in_executor(executor, transform, list(batch)) for batch in itertools.batched(market, batch_size)
+    ))
+    for batch_result in batch_results:
+        result.merge(batch_result)
+    return result
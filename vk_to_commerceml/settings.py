@@ -1,3 +1,4 @@
+from functools import cache
 from pathlib import Path
 
 from pydantic import BaseModel, HttpUrl, RedisDsn, SecretStr
@@ -8,15 +9,50 @@ class Vk(BaseModel):
     client_id: str
     client_secret: SecretStr
     oauth_callback_url: HttpUrl
+    api_limit_per_host: int = 8
+    cdn_limit: int = 32
+    cdn_limit_per_host: int = 8
+    download_concurrency: int = 16
+    groups_cache_ttl: int = 300
+    market_cache_ttl: int = 3600
+    market_snapshot_max_age: int = 600
+    market_signature_ttl: int = 86400
+    api_rate: float = 3
+    callback_debounce: float = 5
 
 
 class Settings(BaseSettings):
     bot_token: SecretStr = SecretStr('1234567890:ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+    bot_api_rate: float = 25
+    bot_progress_interval: float = 3
+    admin_chat_ids: list[int] = []
+    admin_api_token: SecretStr | None = None
     base_url: HttpUrl = HttpUrl('http://127.0.0.1:8000')
     vk: Vk
     redis_url: RedisDsn = RedisDsn('redis://')
     encryption_key: bytes = b'change_me'
+    old_encryption_keys: list[bytes] = []
+    secrets_cache_ttl: float = 300
+    secrets_cache_size: int = 1024
     cml_debug_base_path: Path | None = None
+    cml_debug_sample_rate: int = 1
+    cml_debug_failures_only: bool = False
+    cml_debug_max_age_days: float = 30
+    cml_debug_max_total_bytes: int = 1024 * 1024 * 1024
+    cml_debug_max_runs_per_site: int = 50
+    traffic_capture_anonymize: bool = True
+    cml_auth_ttl: int = 900
+    cml_upload_concurrency: int = 4
+    cml_connector_limit_per_host: int = 32
+    cml_package_size: int | None = None
+    cml_package_target_duration: float = 30
+    cml_import_hash_ttl: int = 7 * 24 * 3600
+    process_pool_workers: int | None = None
+    csv_max_bytes: int | None = 50 * 1024 * 1024
+    csv_gzip: bool = False
+    csv_with_prices: bool = False
+    sync_history_size: int = 5000
+    sync_history_max_age_days: float = 30
 
     model_config = SettingsConfigDict(
         env_nested_delimiter='__',
@@ -24,4 +60,12 @@ class Settings(BaseSettings):
     )
 
 
-settings = Settings()
+@cache
+def get_settings() -> Settings:
+    return Settings()
+
+
+def __getattr__(name: str) -> Settings:
+    if name == 'settings':
+        return get_settings()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')